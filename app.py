@@ -1,27 +1,52 @@
-from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, send_file, jsonify, flash, session
+from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, send_file, jsonify, flash, session, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from scm_utils import get_github_pr_data, get_gitlab_pr_data, get_bitbucket_pr_data, get_azure_devops_pr_data
-import google.generativeai as genai
-from celery.result import AsyncResult
-from tasks import analyze_pr_task
-from celery_worker import celery
+from scm_utils import fetch_pr_data, detect_platform, parse_pr_url, SUPPORTED_PLATFORMS
+from diff_parser import group_file_changes
+from cost_estimator import estimate_analysis_cost, check_budget, record_usage
+from webhooks import parse_event, verify_signature, debounce, lookup_analysis, debounce_seconds, PREWARM_QUEUE
+from single_flight import flight_key, claim, current_flight, take_over
+from key_pool import sync_keys, pool_size, pool_status
+from queue_stats import snapshot, task_eta, register_task, record_phase, prometheus_text
+from path_filter import make_filter, parse_globs, analysis_scope
+from task_profiler import list_profiles, load_profile, folded_text, summary_text
+from exporters import iter_export_rows, iter_csv, iter_ndjson, write_xlsx, write_parquet, export_filename, spool_file
 import os
-import re
-import io
-import pandas as pd
 import json
-from urllib.parse import urlparse, unquote
+import hmac
+import time
+import uuid
+import sqlite3
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from utils.encryption import encrypt_token, decrypt_token
+from utils.cache import TTLCache
 
 
 app = Flask(__name__)
 
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "dev-secret-key")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+# SQLite by default; set DATABASE_URL (e.g. postgresql://...) for a shared database
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", 'sqlite:///users.db')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "pool_pre_ping": True
+}
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, "connect")
+def configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers run alongside a writer; NORMAL sync is safe with WAL
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
 login_manager = LoginManager()
 login_manager.login_view = "login"
 login_manager.init_app(app)
@@ -107,24 +132,140 @@ class Prompt(db.Model):
     prompt_name = db.Column(db.String(150), nullable=False)
     prompt_intro = db.Column(db.Text, nullable=False)
     app_function = db.Column(db.String(100), nullable=False)
+    # Default path scope of analyses run with this prompt (globs, one per line)
+    include_paths = db.Column(db.Text, nullable=True)
+    exclude_paths = db.Column(db.Text, nullable=True)
 
     __table_args__ = (db.UniqueConstraint('user_id', 'prompt_name', name='unique_user_prompt'),)
+
+class ApiKey(db.Model):
+    """A Gemini API key in the shared pool managed by admins (see key_pool.py)."""
+    __tablename__ = "api_keys"
+
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(150), nullable=False)
+    _api_key = db.Column("api_key", db.String(255), nullable=False)
+    enabled = db.Column(db.Boolean, default=True)
+
+    @property
+    def api_key(self):
+        return decrypt_token(self._api_key) if self._api_key else None
+
+    @api_key.setter
+    def api_key(self, value):
+        self._api_key = encrypt_token(value)
+
+def publish_key_pool():
+    """Publish the enabled pool keys (still encrypted) to Redis for the workers."""
+    sync_keys({key.id: key._api_key for key in ApiKey.query.filter_by(enabled=True).all()})
+
+class WebhookSubscription(db.Model):
+    """A repository whose PR events pre-warm analyses for a user (see webhooks.py)."""
+    __tablename__ = "webhook_subscriptions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    platform = db.Column(db.String(20), nullable=False)
+    repo = db.Column(db.String(255), nullable=False)  # lower-cased owner/repo, group/project, ...
+    _secret = db.Column("secret", db.String(255), nullable=False)
+    prompt_name = db.Column(db.String(150), nullable=False, default="default")
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'platform', 'repo', name='unique_user_webhook'),)
+
+    @property
+    def secret(self):
+        return decrypt_token(self._secret) if self._secret else None
+
+    @secret.setter
+    def secret(self, value):
+        self._secret = encrypt_token(value)
     
 def validate_google_token(token):
+    from llm_providers import get_provider
+
     try:
-        genai.configure(api_key=token)
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        _ = model.generate_content("Hello", generation_config=genai.types.GenerationConfig(
-            temperature=0.1, max_output_tokens=10
-        ))
+        get_provider("gemini").generate(
+            "Hello", model="gemini-2.0-flash", max_output_tokens=10, temperature=0.1, api_key=token, timeout=30
+        )
         return True
     except Exception as e:
         print("[Token Validation Error]", e)
         return False
     
+def get_task_result(task_id):
+    # Celery is imported on first use so web workers start without it
+    from celery.result import AsyncResult
+    from celery_worker import celery
+    return AsyncResult(task_id, app=celery)
+
+def live_flight(flight):
+    """Task id of a queued or running identical analysis (see single_flight.py), or None."""
+    holder = current_flight(flight)
+    if holder and get_task_result(holder).state not in ("FAILURE", "REVOKED"):
+        return holder
+    return None
+
+# Shown when an SCM fetch fails, per platform
+scm_token_errors = {
+    "github": "There was an issue with your GitHub token. Please make sure your token is correct and try again.",
+    "gitlab": "There was an issue with your GitLab token. Please make sure your token is correct and try again.",
+    "bitbucket": "There was an issue with your Bitbucket Username or App Password. Please make sure your token is correct and try again.",
+    "azdevops": "There was an issue with your Azure DevOps API Token. Please make sure your token is correct and try again."
+}
+
+# Maximum PRs accepted by /summarize_batch
+batch_max_prs = int(os.getenv("BATCH_MAX_PRS", "100"))
+
+def resolve_prompt_intro(user, selected_prompt):
+    """Prompt text for the selected saved prompt, or None if it doesn't exist."""
+    if selected_prompt == "default":
+        return "Summarize this pull request in a concise, general overview."
+    prompt_obj = Prompt.query.filter_by(user_id=user.id, prompt_name=selected_prompt).first()
+    return prompt_obj.prompt_intro if prompt_obj else None
+
+def resolve_path_filter(user, selected_prompt, include=None, exclude=None):
+    """Path scope of an analysis: globs given with the request, else the saved prompt's."""
+    if include is None and exclude is None and selected_prompt != "default":
+        prompt_obj = Prompt.query.filter_by(user_id=user.id, prompt_name=selected_prompt).first()
+        if prompt_obj:
+            include, exclude = prompt_obj.include_paths, prompt_obj.exclude_paths
+    return make_filter(include, exclude)
+
+def get_scm_credentials(user):
+    return {
+        "github_token": user.github_api_token,
+        "gitlab_token": user.gitlab_api_token,
+        "bitbucket_username": user.bitbucket_username,
+        "bitbucket_app_password": user.bitbucket_app_password,
+        "azdevops_token": user.azdevops_api_token
+    }
+
+# Detached copies of recently loaded users, so authenticated requests skip the
+# users query. Entries are dropped whenever a user row changes (see below).
+user_cache = TTLCache(int(os.getenv("USER_CACHE_TTL", "60")))
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_user_cache(mapper, connection, user):
+    user_cache.pop(user.id)
+
+def detached_copy(user):
+    copy = User()
+    for attr in User.__mapper__.column_attrs:
+        set_committed_value(copy, attr.key, getattr(user, attr.key))
+    make_transient_to_detached(copy)
+    return copy
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    cached = user_cache.get(int(user_id))
+    if cached is not None:
+        # Attach a copy to this request's session without querying the database
+        return db.session.merge(cached, load=False)
+    user = db.session.get(User, int(user_id))
+    if user is not None:
+        user_cache.set(user.id, detached_copy(user))
+    return user
 
 @app.route("/signup", methods=["GET", "POST"])
 def signup():
@@ -206,6 +347,7 @@ def delete_user(user_id):
         return redirect(url_for("user_dashboard"))
 
     Prompt.query.filter_by(user_id=user.id).delete()
+    WebhookSubscription.query.filter_by(user_id=user.id).delete()
     db.session.delete(user)
     db.session.commit()
     flash(f"User {user.email} deleted.", "success")
@@ -229,14 +371,73 @@ def toggle_lock_user(user_id):
     flash(f"User {user.email} has been {status}.", "info")
     return redirect(url_for("user_dashboard"))
 
+@app.route("/admin/api_keys", methods=["POST"])
+@login_required
+def add_api_key():
+    if not current_user.is_admin:
+        flash("Unauthorized.", "danger")
+        return redirect(url_for("user_dashboard"))
+
+    label = (request.form.get("label") or "").strip()
+    api_key = (request.form.get("api_key") or "").strip()
+    if not label or not api_key:
+        flash("A label and an API key are required.", "error")
+        return redirect(url_for("user_dashboard"))
+    if not validate_google_token(api_key):
+        flash("Invalid Google token. Please make sure your token is correct and try again.", "error")
+        return redirect(url_for("user_dashboard"))
+
+    key = ApiKey(label=label)
+    key.api_key = api_key
+    db.session.add(key)
+    db.session.commit()
+    publish_key_pool()
+    flash(f"Key '{label}' added to the Gemini key pool.", "success")
+    return redirect(url_for("user_dashboard"))
+
+@app.route("/admin/api_keys/<int:key_id>/toggle", methods=["POST"])
+@login_required
+def toggle_api_key(key_id):
+    if not current_user.is_admin:
+        flash("Unauthorized.", "danger")
+        return redirect(url_for("user_dashboard"))
+
+    key = ApiKey.query.get_or_404(key_id)
+    key.enabled = not key.enabled
+    db.session.commit()
+    publish_key_pool()
+    flash(f"Key '{key.label}' {'enabled' if key.enabled else 'disabled'}.", "info")
+    return redirect(url_for("user_dashboard"))
+
+@app.route("/admin/api_keys/<int:key_id>/delete", methods=["POST"])
+@login_required
+def delete_api_key(key_id):
+    if not current_user.is_admin:
+        flash("Unauthorized.", "danger")
+        return redirect(url_for("user_dashboard"))
+
+    key = ApiKey.query.get_or_404(key_id)
+    db.session.delete(key)
+    db.session.commit()
+    publish_key_pool()
+    flash(f"Key '{key.label}' removed from the Gemini key pool.", "success")
+    return redirect(url_for("user_dashboard"))
+
 @app.route("/dashboard")
 @login_required
 def user_dashboard():
     prompts = Prompt.query.filter_by(user_id=current_user.id).all()
+    subscriptions = WebhookSubscription.query.filter_by(user_id=current_user.id).all()
     users = []
+    api_keys = []
+    key_status = {}
     if current_user.is_admin:
         users = User.query.all()
-    return render_template("user.html", user_email=current_user.email, users=users, is_admin=current_user.is_admin, prompts=prompts)
+        api_keys = ApiKey.query.all()
+        key_status = pool_status()
+    return render_template("user.html", user_email=current_user.email, users=users, is_admin=current_user.is_admin,
+                           prompts=prompts, subscriptions=subscriptions, platforms=SUPPORTED_PLATFORMS,
+                           api_keys=api_keys, key_status=key_status)
 
 @app.route("/update_password", methods=["POST"])
 @login_required
@@ -339,82 +540,198 @@ def summarize():
 
     selected_prompt = data.get("selected_prompt", "default")
     selected_platform = data.get("selected_platform", "github")
+    # "stats": LLM-free structural report of the diff instead of AI summaries
+    requested_mode = data.get("mode", "full")
+    if requested_mode not in ("full", "stats"):
+        return jsonify({"error": "Unsupported mode."}), 400
 
-    if selected_prompt == "default":
-        prompt_intro = "Summarize this pull request in a concise, general overview."
-    else:
-        prompt_obj = Prompt.query.filter_by(user_id=current_user.id, prompt_name=selected_prompt).first()
-        if not prompt_obj:
-            return jsonify({"error": "Selected prompt not found."}), 400
-        prompt_intro = prompt_obj.prompt_intro
-
-    # use prompt_obj.prompt_intro or other fields as needed
+    prompt_intro = resolve_prompt_intro(current_user, selected_prompt)
+    if prompt_intro is None:
+        return jsonify({"error": "Selected prompt not found."}), 400
 
     pr_url = data.get("pr_url")
     if not pr_url:
         return jsonify({"error": "Missing PR URL"}), 400
+
+    path_filter = resolve_path_filter(current_user, selected_prompt, data.get("include_paths"), data.get("exclude_paths"))
+    scope = analysis_scope(prompt_intro, path_filter)
+    # Admins can have the worker profile this run (see /admin/profiles)
+    profile = bool(data.get("profile")) and current_user.is_admin
     
-    if not current_user.google_api_token:
+    # Users without their own key run on the admin-managed Gemini key pool
+    if requested_mode == "full" and not current_user.google_api_token and not pool_size():
         return jsonify({
             "error": "Google API tokens are required. Please set them up in your Account Info."
         }), 400
     
-    if not validate_google_token(current_user.google_api_token):
+    if requested_mode == "full" and current_user.google_api_token and not validate_google_token(current_user.google_api_token):
         return jsonify({"error": "Invalid Google token. Please make sure your token is correct and try again."}), 400
 
 
     try:
         print("Parsing PR URL...")
 
-        if selected_platform == "github":
-            user_token = current_user.github_api_token
-            parsed = parse_github_url(pr_url)
-            pr_data = get_github_pr_data(parsed, user_token)
-            print(pr_data)
-            if "error" in pr_data:
-                print(f"[ERROR] GitHub API returned an error: {pr_data['error']}")
-                return jsonify({"error": "There was an issue with your GitHub token. Please make sure your token is correct and try again."}), 400  # Stop execution and return the error
-        elif selected_platform == "gitlab":
-            user_token = current_user.gitlab_api_token
-            parsed = parse_gitlab_url(pr_url)
-            pr_data = get_gitlab_pr_data(parsed, user_token)
-            if "error" in pr_data:
-                print(f"[ERROR] GitHub API returned an error: {pr_data['error']}")
-                return jsonify({"error": "There was an issue with your GitLab token. Please make sure your token is correct and try again."}), 400  # Stop execution and return the error
-        elif selected_platform == "bitbucket":
-            user_token = current_user.bitbucket_app_password
-            bb_username = current_user.bitbucket_username
-            parsed = parse_bitbucket_url(pr_url)
-            pr_data = get_bitbucket_pr_data(parsed, bb_username, user_token)
-            if "error" in pr_data:
-                print(f"[ERROR] GitHub API returned an error: {pr_data['error']}")
-                return jsonify({"error": "There was an issue with your Bitbucket Username or App Password. Please make sure your token is correct and try again."}), 400  # Stop execution and return the error
-        elif selected_platform == "azdevops":
-            user_token = current_user.azdevops_api_token
-            parsed = parse_azure_devops_url(pr_url)
-            pr_data = get_azure_devops_pr_data(parsed, user_token)
-            if "error" in pr_data:
-                #print(f"[ERROR] Azure DevOps API returned an error: {pr_data['error']}")
-                return jsonify({"error": "There was an issue with your Azure DevOps API Token. Please make sure your token is correct and try again."}), 400  # Stop execution and return the error
-        else:
+        if selected_platform not in SUPPORTED_PLATFORMS:
             return jsonify({"error": "Unsupported platform selected."}), 400
 
+        fetch_started = time.monotonic()
+        pr_data = fetch_pr_data(selected_platform, pr_url, get_scm_credentials(current_user), path_filter=path_filter)
+        fetch_seconds = time.monotonic() - fetch_started
+        record_phase("fetch", fetch_seconds)
+        if "retry_after" in pr_data:
+            # The token's API budget ran out: say when to retry instead of blaming the token
+            print(f"[ERROR] {selected_platform} rate limit: {pr_data['error']}")
+            return jsonify({"error": pr_data["error"], "retry_after": pr_data["retry_after"]}), 429, {"Retry-After": str(pr_data["retry_after"])}
+        if "error" in pr_data:
+            print(f"[ERROR] {selected_platform} API returned an error: {pr_data['error']}")
+            return jsonify({"error": scm_token_errors[selected_platform]}), 400  # Stop execution and return the error
+
         print("Fetched PR data.")
 
+        from tasks import analyze_pr_task
+        from celery_worker import capped_countdown
+
+        # No LLM calls: no budget, estimate or coalescing needed
+        if requested_mode == "stats":
+            task = analyze_pr_task.apply_async(args=[{
+                "pr_data": pr_data,
+                "url": pr_url,
+                "platform": selected_platform,
+                "head_sha": pr_data.get("head_sha"),
+                "prompt_intro": prompt_intro,
+                "mode": "stats",
+                "path_filter": path_filter,
+                "profile": profile,
+                "fetch_seconds": round(fetch_seconds, 3)
+            }])
+            print("Task ID:", task.id)
+            return jsonify({"task_id": task.id})
+
+        # A webhook may already have analyzed this exact head with this prompt
+        precomputed_id = lookup_analysis(selected_platform, pr_url, pr_data.get("head_sha"), scope)
+        if precomputed_id and get_task_result(precomputed_id).state == "SUCCESS":
+            print("Reusing pre-warmed analysis:", precomputed_id)
+            return jsonify({"task_id": precomputed_id, "precomputed": True})
+
+        # Someone else already submitted this exact analysis: follow their task
+        flight = flight_key(selected_platform, pr_url, pr_data.get("head_sha"), scope)
+        running_id = live_flight(flight)
+        if running_id:
+            print("Attaching to in-flight analysis:", running_id)
+            return jsonify({"task_id": running_id, "coalesced": True})
+
+        # Pre-flight: estimate the LLM cost and apply budgets before enqueueing
+        estimate = estimate_analysis_cost(group_file_changes(pr_data["commits"], path_filter), prompt_intro)
+        admission = check_budget(current_user.id, estimate)
+        print("Estimate:", estimate, "Admission:", admission)
+
+        if admission["decision"] == "reject":
+            return jsonify({"error": admission["reason"], "estimate": estimate, "admission": admission}), 429
+
+        mode = "stats" if admission["decision"] == "downgrade" else "full"
+        countdown = admission["retry_after"] if admission["decision"] == "defer" else None
+
+        # Stats-only runs make no LLM calls and aren't worth sharing
+        task_id = str(uuid.uuid4())
+        if mode == "full":
+            holder = claim(flight, task_id, queued_for=countdown)
+            if holder is not None and live_flight(flight) == holder:
+                print("Attaching to in-flight analysis:", holder)
+                return jsonify({"task_id": holder, "coalesced": True})
+            if holder is not None and not take_over(flight, holder, task_id):  # the previous holder failed
+                # Another submission replaced it first: follow that task instead of enqueueing a duplicate
+                winner = current_flight(flight) or claim(flight, task_id, queued_for=countdown)
+                if winner is not None and winner != holder:
+                    print("Attaching to in-flight analysis:", winner)
+                    return jsonify({"task_id": winner, "coalesced": True})
+        else:
+            flight = None
+
+        # Registered before enqueueing, so a fast worker's mark_started finds the job
+        register_task(task_id, "celery", estimate, countdown=countdown)
         task = analyze_pr_task.apply_async(args=[{
             "pr_data": pr_data,
             "url": pr_url,
+            "platform": selected_platform,
+            "head_sha": pr_data.get("head_sha"),
             "google_token": current_user.google_api_token,
-            "prompt_intro": prompt_intro
-        }])
+            "prompt_intro": prompt_intro,
+            "mode": mode,
+            "flight": flight,
+            "path_filter": path_filter,
+            "profile": profile,
+            "fetch_seconds": round(fetch_seconds, 3),
+            # Over budget now: the task re-runs admission and charges the usage when it starts
+            "deferred_admission": {"user_id": current_user.id, "estimate": estimate} if admission["decision"] == "defer" else None
+        }], countdown=capped_countdown(countdown), task_id=task_id)
         print("Task ID:", task.id)
 
-        return jsonify({"task_id": task.id})
+        if admission["decision"] == "accept":
+            record_usage(current_user.id, estimate)
+
+        return jsonify({"task_id": task.id, "estimate": estimate, "admission": admission})
 
     except Exception as e:
         print("Error during summarization:", e)
         return jsonify({"error": str(e)}), 500
     
+@app.route("/summarize_batch", methods=["POST"])
+@login_required
+def summarize_batch():
+    """
+    Analyze many PRs/compare ranges (e.g. for release notes) as one job.
+    Body: { pr_urls: [url or {pr_url, platform}], selected_prompt, selected_platform, include_paths, exclude_paths, profile }
+    The platform is taken from each entry, then the URL host, then selected_platform.
+    """
+    data = request.get_json()
+
+    selected_prompt = data.get("selected_prompt", "default")
+    prompt_intro = resolve_prompt_intro(current_user, selected_prompt)
+    if prompt_intro is None:
+        return jsonify({"error": "Selected prompt not found."}), 400
+    path_filter = resolve_path_filter(current_user, selected_prompt, data.get("include_paths"), data.get("exclude_paths"))
+
+    entries = data.get("pr_urls") or []
+    if not entries:
+        return jsonify({"error": "Missing PR URLs"}), 400
+    if len(entries) > batch_max_prs:
+        return jsonify({"error": f"A batch can contain at most {batch_max_prs} PRs."}), 400
+
+    prs = []
+    for entry in entries:
+        pr_url = entry if isinstance(entry, str) else entry.get("pr_url", "")
+        platform = (None if isinstance(entry, str) else entry.get("platform")) \
+            or detect_platform(pr_url) or data.get("selected_platform", "github")
+        try:
+            parse_pr_url(platform, pr_url)
+        except ValueError as e:
+            return jsonify({"error": f"{pr_url}: {e}"}), 400
+        prs.append({"url": pr_url.strip(), "platform": platform})
+
+    # Users without their own key run on the admin-managed Gemini key pool
+    if not current_user.google_api_token and not pool_size():
+        return jsonify({
+            "error": "Google API tokens are required. Please set them up in your Account Info."
+        }), 400
+
+    if current_user.google_api_token and not validate_google_token(current_user.google_api_token):
+        return jsonify({"error": "Invalid Google token. Please make sure your token is correct and try again."}), 400
+
+    from tasks import analyze_batch_task
+
+    task = analyze_batch_task.apply_async(args=[{
+        "prs": prs,
+        "credentials": get_scm_credentials(current_user),
+        "google_token": current_user.google_api_token,
+        "prompt_intro": prompt_intro,
+        "path_filter": path_filter,
+        "user_id": current_user.id,
+        "profile": bool(data.get("profile")) and current_user.is_admin
+    }])
+    print("Batch Task ID:", task.id)
+
+    return jsonify({"task_id": task.id, "prs": len(prs)})
+
 @app.route("/configure_prompt", methods=["POST"])
 @login_required
 def configure_prompt():
@@ -436,7 +753,9 @@ def configure_prompt():
         user_id=current_user.id,
         app_function=app_function,
         prompt_name=prompt_name,
-        prompt_intro=prompt_intro
+        prompt_intro=prompt_intro,
+        include_paths="\n".join(parse_globs(request.form.get("include_paths"))) or None,
+        exclude_paths="\n".join(parse_globs(request.form.get("exclude_paths"))) or None
     )
     db.session.add(new_prompt)
     db.session.commit()
@@ -460,12 +779,109 @@ def delete_prompt():
     
     return redirect(url_for("user_dashboard"))
 
+@app.route("/webhooks/subscribe", methods=["POST"])
+@login_required
+def subscribe_webhook():
+    platform = request.form.get("platform")
+    repo = (request.form.get("repo") or "").strip().strip("/").lower()
+    secret = request.form.get("secret") or ""
+    prompt_name = request.form.get("prompt_name") or "default"
+
+    if platform not in SUPPORTED_PLATFORMS or not repo:
+        flash("Please choose a platform and enter the repository.", "error")
+        return redirect(url_for("user_dashboard"))
+    if len(secret) < 8:
+        flash("The webhook secret must be at least 8 characters.", "error")
+        return redirect(url_for("user_dashboard"))
+    if resolve_prompt_intro(current_user, prompt_name) is None:
+        flash("Selected prompt not found.", "error")
+        return redirect(url_for("user_dashboard"))
+
+    subscription = WebhookSubscription.query.filter_by(user_id=current_user.id, platform=platform, repo=repo).first()
+    if not subscription:
+        subscription = WebhookSubscription(user_id=current_user.id, platform=platform, repo=repo)
+        db.session.add(subscription)
+    subscription.secret = secret
+    subscription.prompt_name = prompt_name
+    db.session.commit()
+    flash(f"Webhook pre-warming enabled for {repo}. Point the {platform} webhook at /webhooks/{platform}.", "success")
+    return redirect(url_for("user_dashboard"))
+
+@app.route("/webhooks/unsubscribe", methods=["POST"])
+@login_required
+def unsubscribe_webhook():
+    subscription = WebhookSubscription.query.filter_by(
+        id=request.form.get("subscription_id", type=int), user_id=current_user.id
+    ).first()
+    if subscription:
+        db.session.delete(subscription)
+        db.session.commit()
+        flash(f"Webhook pre-warming disabled for {subscription.repo}.", "success")
+    else:
+        flash("Webhook subscription not found.", "danger")
+    return redirect(url_for("user_dashboard"))
+
+@app.route("/webhooks/<platform>", methods=["POST"])
+def receive_webhook(platform):
+    """
+    PR opened/updated events from GitHub, GitLab, Bitbucket and Azure DevOps.
+    Every subscription whose secret verifies gets a debounced pre-warm analysis.
+    """
+    if platform not in SUPPORTED_PLATFORMS:
+        return jsonify({"error": "Unsupported platform."}), 404
+
+    body = request.get_data()
+    try:
+        pr_event = parse_event(platform, request.headers, request.get_json(silent=True) or {})
+        if pr_event is not None:
+            parse_pr_url(platform, pr_event["url"])  # debounce and the fetchers need a URL they understand
+    except (KeyError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Unexpected {platform} payload: missing {e}"}), 400
+    except ValueError as e:
+        return jsonify({"error": f"Unsupported {platform} PR URL: {e}"}), 400
+    if pr_event is None:
+        return jsonify({"status": "ignored"})
+
+    subscriptions = WebhookSubscription.query.filter_by(platform=platform, repo=pr_event["repo"].lower()).all()
+    verified = [s for s in subscriptions if verify_signature(platform, request.headers, body, s.secret)]
+    if not verified:
+        return jsonify({"error": "Invalid signature or unknown repository."}), 401
+
+    from tasks import prewarm_pr_task
+
+    queued = 0
+    for subscription in verified:
+        user = db.session.get(User, subscription.user_id)
+        if not user or user.locked or not (user.google_api_token or pool_size()):
+            continue
+        prompt_intro = resolve_prompt_intro(user, subscription.prompt_name)
+        if prompt_intro is None:
+            continue
+
+        # Later pushes within the debounce window supersede this one (see prewarm_pr_task)
+        debounce(platform, pr_event["url"], user.id, pr_event["head_sha"])
+        prewarm_pr_task.apply_async(args=[{
+            "platform": platform,
+            "url": pr_event["url"],
+            "head_sha": pr_event["head_sha"],
+            "user_id": user.id,
+            "credentials": get_scm_credentials(user),
+            "google_token": user.google_api_token,
+            "prompt_intro": prompt_intro,
+            "path_filter": resolve_path_filter(user, subscription.prompt_name)
+        }], queue=PREWARM_QUEUE, countdown=debounce_seconds)
+        queued += 1
+
+    print(f"[Webhook] {platform} {pr_event['url']} @ {pr_event['head_sha'][:12]}: {queued} pre-warm analyses queued")
+    return jsonify({"status": "queued", "queued": queued}), 202
+
 @app.route("/delete_account", methods=["POST"])
 @login_required
 def delete_account():
     try:
         # Delete all prompts belonging to the user
         Prompt.query.filter_by(user_id=current_user.id).delete()
+        WebhookSubscription.query.filter_by(user_id=current_user.id).delete()
 
         # Then delete the user
         user_email = current_user.email  # Save for feedback
@@ -491,7 +907,7 @@ def logout():
 
 @app.route("/result/<task_id>")
 def show_result(task_id):
-    task = AsyncResult(task_id, app=celery)
+    task = get_task_result(task_id)
     if task.state == "SUCCESS":
         return render_template("index.html", summary=task.result)
     elif task.state in ["PENDING", "STARTED", "PROGRESS"]:
@@ -508,7 +924,7 @@ def root_redirect():
 
 @app.route("/task_status/<task_id>")
 def task_status(task_id):
-    task = AsyncResult(task_id, app=celery)
+    task = get_task_result(task_id)
 
     # print(f"Task {task_id} state: {task.state}")
     # print("Meta:", task.info)
@@ -518,6 +934,11 @@ def task_status(task_id):
             'state': task.state,
             'progress': 0
         }
+        # Waiting behind other analyses: tell the user roughly how long
+        eta = task_eta(task_id)
+        if eta:
+            response.update(eta)
+            response['details'] = f"Queued behind {eta['tasks_ahead']} analyses, about {max(eta['eta_seconds'] // 60, 1)} min remaining"
     elif task.state == 'PROGRESS':
         progress = task.info or {}
         current = progress.get('current', 0)
@@ -527,6 +948,18 @@ def task_status(task_id):
             'progress': int((current / total) * 100),
             'details': progress.get('status', '')
         }
+    elif task.state == 'RETRY':
+        # Rescheduled while waiting for the Gemini quota or the budget; finished files are kept
+        response = {
+            'state': task.state,
+            'progress': 0,
+            'details': 'Waiting for the Gemini rate limit, the analysis will resume shortly.'
+        }
+        # defer_task recorded when it resumes and what is left to summarize
+        eta = task_eta(task_id)
+        if eta:
+            response.update(eta)
+            response['details'] = f"Waiting for the rate limit or token budget, about {max(eta['eta_seconds'] // 60, 1)} min remaining"
     elif task.state == 'SUCCESS':
         response = {
             'state': task.state,
@@ -541,157 +974,161 @@ def task_status(task_id):
 
     return jsonify(response)
 
+# Bearer token for autoscalers reading /queue_stats (admins can always read it)
+queue_stats_token = os.getenv("QUEUE_STATS_TOKEN")
 
-@app.route("/download_excel", methods=["POST"])
-def download_excel():
-    try:
-        pr_url = request.form.get("pr_url", "")
-        count = int(request.form.get("commit_count"))
-        rows = []
-
-        match = re.search(r"github\.com/([^/]+/[^/]+)/pull/(\d+)", pr_url)
-        if match:
-            repo = match.group(1).replace("/", "_")
-            pr_number = match.group(2)
-        else:
-            repo = "unknown_repo"
-            pr_number = "unknown_pr"
+@app.route("/queue_stats")
+def queue_stats():
+    """Queue backlog for autoscaling; ?format=prometheus for the metrics text format."""
+    bearer = request.headers.get("Authorization", "")
+    token_ok = bool(queue_stats_token) and hmac.compare_digest(bearer, f"Bearer {queue_stats_token}")
+    if not token_ok and not (current_user.is_authenticated and current_user.is_admin):
+        return jsonify({"error": "Unauthorized."}), 401
 
-        for i in range(count):
-            reason = request.form.get(f"reason_{i}")
-            file_count = int(request.form.get(f"file_count_{i}"))
+    stats = snapshot()
+    if request.args.get("format") == "prometheus":
+        return Response(prometheus_text(stats), mimetype="text/plain; version=0.0.4")
+    return jsonify(stats)
 
-            for j in range(file_count):
-                file_name = request.form.get(f"file_{i}_{j}")
-                rows.append({
-                    "File Name": file_name,
-                    "Reason to Change": reason
-                })
+@app.route("/admin/profiles")
+@login_required
+def admin_profiles():
+    """Recently profiled tasks."""
+    if not current_user.is_admin:
+        return jsonify({"error": "Unauthorized."}), 401
+    return jsonify({"profiles": list_profiles()})
 
-        df = pd.DataFrame(rows)
+@app.route("/admin/profiles/<task_id>")
+@login_required
+def admin_profile(task_id):
+    """
+    A task's profile: ?format=summary (default, plain text), folded (for
+    flamegraph.pl / speedscope) or json; ?run=N for an earlier run.
+    """
+    if not current_user.is_admin:
+        return jsonify({"error": "Unauthorized."}), 401
+
+    run = request.args.get("run", type=int)
+    profile = load_profile(task_id, run)
+    if profile is None:
+        return jsonify({"error": "Profile not found."}), 404
+
+    output = request.args.get("format", "summary")
+    if output == "json":
+        return jsonify(profile)
+    if output == "folded":
+        response = Response(folded_text(profile), mimetype="text/plain")
+        response.headers["Content-Disposition"] = f'attachment; filename="{task_id}-{profile["run"]}.folded"'
+        return response
+    return Response(summary_text(profile), mimetype="text/plain")
+
+@app.route("/task_lines/<task_id>")
+@login_required
+def task_lines(task_id):
+    """Raw added/removed lines of one file of a finished analysis (?ref=<lines_ref>)."""
+    from result_store import load_lines
+    lines = load_lines(task_id, request.args.get("ref", ""))
+    if lines is None:
+        return jsonify({"error": "Lines are not available (unknown file or expired result)."}), 404
+    return jsonify(lines)
 
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="Summary")
 
+@app.route("/export/<task_id>")
+@login_required
+def export_result(task_id):
+    """
+    Stream a finished analysis by task id as xlsx, csv, ndjson or parquet
+    (?format=...). Rows are written one at a time, never as a whole table in memory.
+    """
+    export_format = request.args.get("format", "xlsx").lower()
+    task = get_task_result(task_id)
+    if task.state != "SUCCESS":
+        return jsonify({"error": f"Task is not finished (state: {task.state})."}), 404
+
+    result = task.result
+    rows = iter_export_rows(result)
+
+    if export_format == "csv":
+        response = Response(stream_with_context(iter_csv(rows)), mimetype="text/csv")
+    elif export_format == "ndjson":
+        response = Response(stream_with_context(iter_ndjson(rows)), mimetype="application/x-ndjson")
+    elif export_format == "xlsx":
+        output = spool_file()
+        write_xlsx(rows, output)
         output.seek(0)
-        filename = f"diffsage_{repo}_pr{pr_number}.xlsx"
         return send_file(
             output,
             as_attachment=True,
-            download_name=filename,
+            download_name=export_filename(result.get("metadata"), "xlsx"),
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
+    elif export_format == "parquet":
+        output = spool_file()
+        try:
+            write_parquet(rows, output)
+        except ImportError:
+            output.close()
+            return jsonify({"error": "Parquet export requires the pyarrow package."}), 400
+        output.seek(0)
+        return send_file(
+            output,
+            as_attachment=True,
+            download_name=export_filename(result.get("metadata"), "parquet"),
+            mimetype="application/vnd.apache.parquet"
+        )
+    else:
+        return jsonify({"error": "Unsupported export format."}), 400
 
-    except Exception as e:
-        return f"Error creating Excel file: {str(e)}", 500
-
-def parse_github_url(url):
-    """
-    Parses a GitHub Pull Request or Compare URL and returns a dict with type info.
-    """
-    url = url.strip()
-    pr_pattern = r"https://github\.com/([^/]+)/([^/]+)/pull/(\d+)"
-    compare_pattern = r"https://github\.com/([^/]+)/([^/]+)/compare/(.+)\.\.\.(.+)"
-
-    pr_match = re.match(pr_pattern, url)
-    if pr_match:
-        return {
-            "type": "pr",
-            "repo": f"{pr_match.group(1)}/{pr_match.group(2)}",
-            "pr_number": int(pr_match.group(3))
-        }
-
-    compare_match = re.match(compare_pattern, url)
-    if compare_match:
-        return {
-            "type": "compare",
-            "repo": f"{compare_match.group(1)}/{compare_match.group(2)}",
-            "base": compare_match.group(3),
-            "head": compare_match.group(4)
-        }
-
-    raise ValueError("Unsupported or invalid GitHub URL.")
+    filename = export_filename(result.get("metadata"), export_format)
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
 
-def parse_gitlab_url(url):
-    """
-    Parses a GitLab Merge Request (MR) URL and returns a dict with type info.
-    """
-    url = url.strip()
-    mr_pattern = r"https://gitlab\.com/([^/]+(?:/[^/]+)*)/-/merge_requests/(\d+)"
-
-    mr_match = re.match(mr_pattern, url)
-    print(mr_match)
-    if mr_match:
-        return {
-            "url": url,
-            "type": "mr",  # Merge Request in GitLab
-            "repo": mr_match.group(1),
-            "mr_id": int(mr_match.group(2))
-        }
+@app.route("/download_excel", methods=["POST"])
+def download_excel():
+    try:
+        pr_url = request.form.get("pr_url", "")
+        count = int(request.form.get("commit_count"))
 
-    raise ValueError("Unsupported or invalid GitLab Merge Request URL.")
+        def iter_form_rows():
+            for i in range(count):
+                reason = request.form.get(f"reason_{i}")
+                file_count = int(request.form.get(f"file_count_{i}"))
 
-def parse_bitbucket_url(url):
-    """
-    Parses a Bitbucket Pull Request URL and returns a dict with type info.
-    """
-    url = url.strip()
-    pr_pattern = r"https://bitbucket\.org/([^/]+)/([^/]+)/pull-requests/(\d+)"
-
-    pr_match = re.match(pr_pattern, url)
-    print(url,pr_match)
-    if pr_match:
-        return {
-            "url": url,
-            "type": "pr",  # Pull Request in Bitbucket
-            "workspace": pr_match.group(1),
-            "repo": pr_match.group(2),
-            "pr_id": int(pr_match.group(3))
-        }
+                for j in range(file_count):
+                    yield {
+                        "File Name": request.form.get(f"file_{i}_{j}"),
+                        "Change Type": request.form.get(f"change_type_{i}_{j}", ""),
+                        "Reason to Change": reason
+                    }
 
-    raise ValueError("Unsupported or invalid Bitbucket Pull Request URL.")
+        output = spool_file()
+        write_xlsx(iter_form_rows(), output)
+        output.seek(0)
+        return send_file(
+            output,
+            as_attachment=True,
+            download_name=export_filename({"url": pr_url}, "xlsx"),
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
 
-def parse_azure_devops_url(url):
-    """
-    Parses an Azure DevOps Pull Request URL and returns a dict with type info.
-    Supports format:
-    https://dev.azure.com/{organization}/{project}/_git/{repo}/pullrequest/{pr_id}
-    or
-    https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo}/pullRequests/{pr_id}
-    """
-    url = url.strip()
-    parsed = urlparse(url)
-    path = unquote(parsed.path)  # Decode any URL-encoded characters
-    path_parts = path.strip("/").split("/")
+    except Exception as e:
+        return f"Error creating Excel file: {str(e)}", 500
 
-    if "pullrequest" in path_parts:
-        try:
-            org = path_parts[0]
-            project = path_parts[1]
-            if "_apis" in path_parts:
-                repo = path_parts[5]
-                pr_id = path_parts[7]
-            else:
-                repo = path_parts[3]
-                pr_id = path_parts[5]
-
-            return {
-                "url": url,
-                "type": "pr",
-                "organization": org,
-                "project": project,
-                "repo": repo,
-                "pr_id": int(pr_id)
-            }
-        except (IndexError, ValueError):
-            raise ValueError("Malformed Azure DevOps PR URL structure.")
-
-    raise ValueError("Unsupported or invalid Azure DevOps PR URL.")
+def ensure_columns(model):
+    """Add columns missing from an existing table (create_all only creates new tables)."""
+    table = model.__table__
+    existing = {column["name"] for column in inspect(db.engine).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            print(f"[INIT] Added column {table.name}.{column.name}")
 
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()  # Automatically create tables if they don't exist
+        ensure_columns(Prompt)
 
         admin_email = "admin"
         existing_admin = User.query.filter_by(email=admin_email).first()
@@ -706,4 +1143,10 @@ if __name__ == "__main__":
             db.session.commit()
             print(f"[INIT] Admin account created: {admin_email} / admin")
 
+        # Redis may have been flushed since the pool was last changed
+        try:
+            publish_key_pool()
+        except Exception as e:
+            print("[Key Pool Error]", e)
+
     app.run(host="0.0.0.0", port=3000, debug=True)
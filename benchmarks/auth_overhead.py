@@ -0,0 +1,119 @@
+"""
+Per-request overhead of the authenticated path (session -> load_user ->
+decrypted credentials) under concurrent load, with and without the user and
+token caches.
+
+Each configuration runs in a fresh interpreter against a throwaway SQLite
+database. The benchmark endpoint does what /summarize does before any SCM
+work: load the current user and read all of their credentials.
+
+Usage (from the repository root):
+    python benchmarks/auth_overhead.py
+    python benchmarks/auth_overhead.py --threads 16 --requests 200
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = {
+    "no cache": {"USER_CACHE_TTL": "0", "TOKEN_CACHE_TTL": "0"},
+    "cached": {"USER_CACHE_TTL": "60", "TOKEN_CACHE_TTL": "300"}
+}
+
+def run(threads, requests_per_thread):
+    """Runs inside the child interpreter; prints one JSON line of results."""
+    import statistics
+    import threading
+    import time
+    from flask_login import login_required, current_user
+
+    sys.path.insert(0, ROOT)
+    from app import app, db, User, get_scm_credentials
+    from werkzeug.security import generate_password_hash
+
+    @login_required
+    def bench_auth():
+        credentials = get_scm_credentials(current_user)
+        return {"ok": bool(current_user.google_api_token and credentials["github_token"])}
+
+    app.add_url_rule("/_bench_auth", "bench_auth", bench_auth)
+
+    with app.app_context():
+        db.create_all()
+        user = User(email="bench", password=generate_password_hash("bench"))
+        for field in ("github_api_token", "google_api_token", "gitlab_api_token",
+                      "bitbucket_username", "bitbucket_app_password", "azdevops_api_token"):
+            setattr(user, field, f"{field}-value-0123456789")
+        db.session.add(user)
+        db.session.commit()
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        client.post("/login", data={"email": "bench", "password": "bench"})
+        local = []
+        for _ in range(requests_per_thread):
+            start = time.perf_counter()
+            response = client.get("/_bench_auth")
+            local.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requests per thread")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run(args.threads, args.requests)
+        return
+
+    from cryptography.fernet import Fernet
+    for name, overrides in CONFIGS.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                **os.environ,
+                **overrides,
+                "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                "ENCRYPTION_KEY": os.getenv("ENCRYPTION_KEY") or Fernet.generate_key().decode()
+            }
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child",
+                 "--threads", str(args.threads), "--requests", str(args.requests)],
+                cwd=ROOT, env=env, capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                print(f"[{name}] failed:\n{proc.stderr[-2000:]}")
+                sys.exit(1)
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"[{name}] {result['requests']} requests on {args.threads} threads: "
+                  f"{result['rps']:.0f} req/s, p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms")
+
+if __name__ == "__main__":
+    main()
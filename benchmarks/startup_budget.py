@@ -0,0 +1,88 @@
+"""
+Cold-start budget check for the web and worker processes.
+
+Imports each entry module in a fresh interpreter with `python -X importtime`,
+parses the timings and fails (exit code 1) when a process exceeds its budget
+or eagerly imports a dependency that is supposed to load on first use.
+
+Usage (from the repository root):
+    python benchmarks/startup_budget.py
+    python benchmarks/startup_budget.py --runs 5 --web-budget-ms 800 --worker-budget-ms 400
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy dependencies that must not be imported at process start
+LAZY_MODULES = ["google.generativeai", "openai", "pandas", "cryptography", "xlsxwriter", "pyarrow"]
+
+# process -> (entry module, budget env var, default budget in ms)
+TARGETS = {
+    "web": ("app", "STARTUP_BUDGET_WEB_MS", 1000),
+    "worker": ("tasks", "STARTUP_BUDGET_WORKER_MS", 500),  # a worker boots celery_worker plus its included tasks
+}
+
+_line = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def parse_importtime(stderr):
+    """Return [(module, self_us, cumulative_us, depth)] from `-X importtime` output."""
+    entries = []
+    for line in stderr.splitlines():
+        match = _line.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+def measure(module):
+    # Nothing in the import path needs credentials, but keep the environment realistic
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    entries = parse_importtime(proc.stderr)
+    total_ms = sum(cumulative for _, _, cumulative, depth in entries if depth == 0) / 1000
+    return total_ms, entries
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="measurements per process (median is used)")
+    parser.add_argument("--top", type=int, default=10, help="heaviest imports to print")
+    for name, (_, env_var, default) in TARGETS.items():
+        parser.add_argument(f"--{name}-budget-ms", type=float, default=float(os.getenv(env_var, default)))
+    args = parser.parse_args()
+
+    failed = False
+    for name, (module, _, _) in TARGETS.items():
+        budget = getattr(args, f"{name}_budget_ms")
+        timings = []
+        entries = []
+        for _ in range(args.runs):
+            total_ms, entries = measure(module)
+            timings.append(total_ms)
+        median = statistics.median(timings)
+
+        status = "OK" if median <= budget else "OVER BUDGET"
+        print(f"[{name}] import {module}: median {median:.0f} ms over {args.runs} runs (budget {budget:.0f} ms) {status}")
+        for module_name, _, cumulative, _ in sorted(entries, key=lambda e: e[2], reverse=True)[:args.top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {module_name}")
+
+        imported = {entry[0] for entry in entries}
+        eager = [lazy for lazy in LAZY_MODULES if lazy in imported]
+        if eager:
+            print(f"[{name}] eagerly imports: {', '.join(eager)}")
+        if median > budget or eager:
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,35 @@ broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 result_backend = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 
 def make_celery(app_name=__name__):
+    # Task modules are listed in `include` and imported when a worker starts,
+    # so web processes importing this module don't load the whole pipeline.
     return Celery(
         app_name,
         broker=broker_url,
-        backend=result_backend
+        backend=result_backend,
+        include=["tasks"]
     )
 
 celery = make_celery()
 
-# 👇 Import your task to ensure it's registered
-import tasks  # This line is critical!
\ No newline at end of file
+# Tasks use acks_late, so an unacknowledged message is redelivered after this
+# many seconds. Keep it above the longest single task run.
+visibility_timeout = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", "3600"))
+celery.conf.broker_transport_options = {
+    "visibility_timeout": visibility_timeout
+}
+
+def capped_countdown(seconds):
+    """
+    Countdown for delaying a task, kept below the visibility timeout: the Redis
+    transport also redelivers a delayed message once that has passed, which
+    would run the task twice. Longer waits are taken in steps (the task checks
+    again and defers itself once more).
+    """
+    if seconds is None:
+        return None
+    return min(seconds, max(visibility_timeout - 60, 1))
+
+# Results only carry summaries and metadata (raw diff lines are stored
+# separately, see result_store.py) and expire after RESULT_EXPIRES seconds.
+celery.conf.result_expires = int(os.getenv("RESULT_EXPIRES", "86400"))
@@ -0,0 +1,64 @@
+import os
+import json
+import zlib
+from utils.redis_client import get_redis
+
+# How long per-file summaries of an unfinished task are kept, in seconds
+checkpoint_ttl = int(os.getenv("CHECKPOINT_TTL", "86400"))
+
+def _key(task_id):
+    return f"checkpoint:{task_id}"
+
+def load_checkpoint(task_id):
+    """Return {file digest: summary} saved so far for this task id."""
+    try:
+        saved = get_redis().hgetall(_key(task_id))
+        return {digest.decode(): summary.decode() for digest, summary in saved.items()}
+    except Exception as e:
+        print("[Checkpoint Load Error]", e)
+        return {}
+
+def save_checkpoint(task_id, digest, summary):
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(_key(task_id), digest, summary)
+        pipe.expire(_key(task_id), checkpoint_ttl)
+        pipe.execute()
+    except Exception as e:
+        print("[Checkpoint Save Error]", e)
+
+def clear_checkpoint(task_id):
+    try:
+        get_redis().delete(_key(task_id), f"{_key(task_id)}:metrics", f"{_key(task_id)}:state")
+    except Exception as e:
+        print("[Checkpoint Clear Error]", e)
+
+def load_metrics(task_id):
+    """Tier metrics snapshot saved by earlier runs of this task (see model_router.TierMetrics)."""
+    try:
+        saved = get_redis().get(f"{_key(task_id)}:metrics")
+        return json.loads(saved) if saved else {}
+    except Exception as e:
+        print("[Checkpoint Load Error]", e)
+        return {}
+
+def save_metrics(task_id, snapshot):
+    try:
+        get_redis().set(f"{_key(task_id)}:metrics", json.dumps(snapshot), ex=checkpoint_ttl)
+    except Exception as e:
+        print("[Checkpoint Save Error]", e)
+
+def load_state(task_id):
+    """Intermediate task data saved by save_state (e.g. a batch's fetched and grouped diffs)."""
+    try:
+        saved = get_redis().get(f"{_key(task_id)}:state")
+        return json.loads(zlib.decompress(saved)) if saved else None
+    except Exception as e:
+        print("[Checkpoint Load Error]", e)
+        return None
+
+def save_state(task_id, state):
+    try:
+        get_redis().set(f"{_key(task_id)}:state", zlib.compress(json.dumps(state).encode()), ex=checkpoint_ttl)
+    except Exception as e:
+        print("[Checkpoint Save Error]", e)
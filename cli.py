@@ -0,0 +1,181 @@
+"""
+Summarize PRs, compare ranges or local diffs without the web app or a worker,
+streaming one NDJSON record per file to stdout as soon as it is summarized.
+
+Sources run concurrently (`--jobs`); within a source, files are summarized
+`SUMMARY_CONCURRENCY` at a time as usual. Redis is optional: without it the
+shared state (key pool, circuit breaker, queue timings) is skipped.
+
+Usage:
+    python cli.py https://github.com/owner/repo/pull/123 > summaries.ndjson
+    python cli.py --diff changes.patch --provider stub
+    git log -p main..HEAD | python cli.py --diff - --provider stub --include 'src/**'
+
+Local diffs can be plain `git diff` output, `git log -p` or `git format-patch`
+output (one commit per entry). SCM tokens come from GITHUB_TOKEN, GITLAB_TOKEN,
+BITBUCKET_USERNAME/BITBUCKET_APP_PASSWORD and AZDEVOPS_TOKEN, the Gemini key
+from GOOGLE_API_KEY. Each record has "source" and either the file's fields or
+"error"; the exit code is 1 when a source failed.
+"""
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_log_commit = re.compile(r"^commit ([0-9a-f]{40})\b.*$", re.MULTILINE)
+_patch_commit = re.compile(r"^From ([0-9a-f]{40}) ", re.MULTILINE)
+
+def read_commits(text, name, message=None):
+    """Commits ({sha, message, diff}) of a local diff, `git log -p` or `git format-patch` text."""
+    for pattern, parse in ((_log_commit, _log_entry), (_patch_commit, _patch_entry)):
+        starts = list(pattern.finditer(text))
+        if starts:
+            ends = [m.start() for m in starts[1:]] + [len(text)]
+            return [parse(m.group(1), text[m.end():end]) for m, end in zip(starts, ends)]
+    return [{"sha": None, "message": message or name, "diff": text}]
+
+def _split_diff(body):
+    index = body.find("diff --git ")
+    return (body, "") if index < 0 else (body[:index], body[index:])
+
+def _log_entry(sha, body):
+    header, diff = _split_diff(body)
+    # The message is the indented block after the Author/Date headers
+    message = "\n".join(line[4:] for line in header.splitlines() if line.startswith("    "))
+    return {"sha": sha, "message": message.strip() or sha, "diff": diff}
+
+def _patch_entry(sha, body):
+    header, diff = _split_diff(body)
+    match = re.search(r"^Subject: (?:\[[^\]]*\] )?(.*)$", header, re.MULTILINE)
+    return {"sha": sha, "message": match.group(1).strip() if match else sha, "diff": diff}
+
+def credentials_from_env():
+    return {
+        "github_token": os.getenv("GITHUB_TOKEN"),
+        "gitlab_token": os.getenv("GITLAB_TOKEN"),
+        "bitbucket_username": os.getenv("BITBUCKET_USERNAME"),
+        "bitbucket_app_password": os.getenv("BITBUCKET_APP_PASSWORD"),
+        "azdevops_token": os.getenv("AZDEVOPS_TOKEN")
+    }
+
+def file_record(source, item):
+    file_change = item["files_changed"][0]
+    record = {
+        "source": source,
+        "file_path": file_change["file_path"],
+        "change_type": file_change["change_type"],
+        "added": sum(1 for line in file_change["added_lines"] if line != "---"),
+        "removed": sum(1 for line in file_change["removed_lines"] if line != "---"),
+        "hunks": file_change.get("hunks", 0),
+        "intent": item.get("intent"),
+        "model_tier": item.get("model_tier"),
+        "message": item["message"],
+        "summary": item["summary"]
+    }
+    if item.get("status"):
+        record["status"] = item["status"]
+    return record
+
+class NdjsonWriter:
+    """Thread-safe line writer: every record is flushed as soon as it is complete."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.stream.write(line + "\n")
+                self.stream.flush()
+            except BrokenPipeError:
+                self.closed = True  # the reader went away (e.g. `| head`): drop the rest
+
+def run_source(source, args, writer):
+    """Fetch (or read) one source and stream its file records; returns False on errors."""
+    from diff_parser import group_file_changes, summarize_grouped
+    from path_filter import make_filter
+
+    path_filter = make_filter(args.include, args.exclude)
+    try:
+        if source["kind"] == "url":
+            from scm_utils import fetch_pr_data, detect_platform
+
+            platform = args.platform or detect_platform(source["name"]) or "github"
+            pr_data = fetch_pr_data(platform, source["name"], credentials_from_env(), path_filter=path_filter)
+            if "error" in pr_data:
+                writer.write({"source": source["name"], "error": pr_data["error"]})
+                return False
+            commits = pr_data["commits"]
+        else:
+            commits = read_commits(source["text"], source["name"], args.message)
+
+        grouped = group_file_changes(commits, path_filter)
+        summarize_grouped(
+            grouped, google_token=os.getenv("GOOGLE_API_KEY"), prompt_intro=args.prompt, mode=args.mode,
+            on_result=lambda item: writer.write(file_record(source["name"], item))
+        )
+        if args.mode == "stats":
+            from diff_stats import build_report
+            from intent_extractor import intent_breakdown
+
+            writer.write({"source": source["name"], "report": build_report(grouped, intent_breakdown([c["message"] for c in commits]))})
+        return True
+    except Exception as e:
+        writer.write({"source": source["name"], "error": str(e)})
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("urls", nargs="*", help="PR/MR or compare URLs")
+    parser.add_argument("--diff", action="append", default=[], help="local diff file, '-' for stdin (repeatable)")
+    parser.add_argument("--platform", choices=["github", "gitlab", "bitbucket", "azdevops"], help="default: detected from each URL")
+    parser.add_argument("--provider", choices=["gemini", "openai", "stub"], help="LLM provider for every model tier (stub: offline)")
+    parser.add_argument("--mode", choices=["full", "stats"], default="full", help="stats: no LLM, adds a structural report record")
+    parser.add_argument("--prompt", help="prompt intro (default: the built-in prompt)")
+    parser.add_argument("--message", help="commit message for plain diffs (default: the file name)")
+    parser.add_argument("--include", action="append", help="path glob to analyze (repeatable)")
+    parser.add_argument("--exclude", action="append", help="path glob to skip (repeatable)")
+    parser.add_argument("--jobs", type=int, default=4, help="sources processed at once")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's log output on stderr")
+    args = parser.parse_args()
+
+    sources = [{"kind": "url", "name": url} for url in args.urls]
+    for path in args.diff:
+        if path == "-":
+            sources.append({"kind": "diff", "name": "stdin", "text": sys.stdin.read()})
+        else:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                sources.append({"kind": "diff", "name": path, "text": f.read()})
+    if not sources:
+        parser.error("give at least one URL or --diff")
+
+    # Configuration is read at import time, so it is set before the pipeline is imported
+    if args.provider:
+        tiers = json.loads(os.getenv("MODEL_TIERS", "{}"))
+        for tier in ("fast", "standard", "strong"):
+            tiers[tier] = {**tiers.get(tier, {}), "provider": args.provider}
+        os.environ["MODEL_TIERS"] = json.dumps(tiers)
+    if args.provider == "stub":
+        os.environ.setdefault("GEMINI_REQUESTS_PER_MINUTE", "1000000")  # no quota to pace for
+
+    # stdout carries the records only; the pipeline's print() logging goes to stderr (or nowhere)
+    writer = NdjsonWriter(sys.stdout)
+    log = sys.stderr if args.verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(log):
+        with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+            results = list(pool.map(lambda source: run_source(source, args, writer), sources))
+    if writer.closed:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())  # no flush error at exit
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+from diff_parser import build_prompt
+from key_pool import pool_rpm
+from model_router import route_file, get_tier
+from intent_extractor import classify_grouped, skips_llm
+from prompt_compactor import compact_lines
+from utils.redis_client import get_redis
+
+# Rough average Gemini latency for one summary call, in seconds
+seconds_per_call = float(os.getenv("LLM_SECONDS_PER_CALL", "2.0"))
+
+# Budgets are in estimated prompt tokens. 0 disables a budget.
+max_tokens_per_analysis = int(os.getenv("MAX_TOKENS_PER_ANALYSIS", "0"))
+user_token_budget = int(os.getenv("USER_TOKEN_BUDGET", "0"))
+global_token_budget = int(os.getenv("GLOBAL_TOKEN_BUDGET", "0"))
+budget_window_seconds = int(os.getenv("BUDGET_WINDOW_SECONDS", "3600"))
+
+# What to do when a budget would be exceeded: "reject", "defer" or "downgrade"
+budget_exceeded_action = os.getenv("BUDGET_EXCEEDED_ACTION", "downgrade")
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for English and source code
+    return len(text) // 4 + 1
+
+def estimate_analysis_cost(grouped_data, prompt_intro=None):
+    """
+    Estimate the cost of summarizing already grouped file changes.
+    Returns:
+        {
+            files: int,
+            llm_calls: int,
+            prompt_tokens: int,
+            output_tokens: int,
+            estimated_seconds: int
+        }
+    """
+    prompt_tokens = 0
+    output_tokens = 0
+    llm_calls = 0
+    for item in classify_grouped(grouped_data):
+        if skips_llm(item):
+            continue
+        file_change = item["files_changed"][0]
+        added_lines, removed_lines, _ = compact_lines(file_change["file_path"], file_change["added_lines"], file_change["removed_lines"])
+        prompt = build_prompt(item["message"], added_lines, removed_lines, prompt_intro)
+        prompt_tokens += estimate_tokens(prompt)
+        output_tokens += get_tier(route_file(item, classification=item["intent"]))["max_output_tokens"]
+        llm_calls += 1
+
+    # Summaries pause for 60 seconds after each minute's worth of requests
+    # (one key's limit, or the whole Gemini key pool's)
+    rate_limit_waits = max(llm_calls - 1, 0) // pool_rpm()
+    estimated_seconds = llm_calls * seconds_per_call + rate_limit_waits * 60
+
+    return {
+        "files": len(grouped_data),
+        "llm_calls": llm_calls,
+        "prompt_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "estimated_seconds": int(estimated_seconds)
+    }
+
+def _window_usage(key):
+    r = get_redis()
+    used = r.get(key)
+    ttl = r.ttl(key)
+    return int(used or 0), (ttl if ttl and ttl > 0 else budget_window_seconds)
+
+def check_budget(user_id, estimate):
+    """
+    Decide whether an analysis may be enqueued.
+    Returns:
+        { decision: "accept" | "reject" | "defer" | "downgrade", reason: str, retry_after: int }
+    """
+    tokens = estimate["prompt_tokens"]
+
+    if max_tokens_per_analysis and tokens > max_tokens_per_analysis:
+        # Waiting does not make a single oversized analysis cheaper
+        decision = "downgrade" if budget_exceeded_action == "downgrade" else "reject"
+        return {
+            "decision": decision,
+            "reason": f"Estimated {tokens} prompt tokens exceeds the per-analysis limit of {max_tokens_per_analysis}.",
+            "retry_after": 0
+        }
+
+    budgets = [
+        ("user", f"budget:user:{user_id}", user_token_budget),
+        ("global", "budget:global", global_token_budget)
+    ]
+    try:
+        for scope, key, limit in budgets:
+            if not limit:
+                continue
+            used, ttl = _window_usage(key)
+            if used + tokens > limit:
+                return {
+                    "decision": budget_exceeded_action,
+                    "reason": f"The {scope} token budget ({used}/{limit} used) would be exceeded by {tokens} tokens.",
+                    "retry_after": ttl
+                }
+    except Exception as e:
+        # Fail open: a Redis outage should not block summarization
+        print("[Budget Check Error]", e)
+
+    return {"decision": "accept", "reason": "", "retry_after": 0}
+
+def record_usage(user_id, estimate):
+    tokens = estimate["prompt_tokens"]
+    try:
+        r = get_redis()
+        for key in (f"budget:user:{user_id}", "budget:global"):
+            pipe = r.pipeline()
+            pipe.incrby(key, tokens)
+            pipe.expire(key, budget_window_seconds, nx=True)
+            pipe.execute()
+    except Exception as e:
+        print("[Budget Usage Error]", e)
+
+def admit_deferred(task_id, user_id, estimate):
+    """
+    Admission of an analysis deferred by check_budget, re-run when the task
+    starts. Its usage is recorded once; reschedules of a charged task are accepted.
+    """
+    charged_key = f"budget:charged:{task_id}"
+    try:
+        if get_redis().exists(charged_key):
+            return {"decision": "accept", "reason": "", "retry_after": 0}
+    except Exception as e:
+        print("[Budget Check Error]", e)
+
+    admission = check_budget(user_id, estimate)
+    if admission["decision"] == "accept":
+        record_usage(user_id, estimate)
+        try:
+            get_redis().set(charged_key, 1, ex=max(budget_window_seconds, 86400))
+        except Exception as e:
+            print("[Budget Usage Error]", e)
+    return admission
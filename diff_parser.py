@@ -2,71 +2,140 @@ from unidiff import PatchSet, UnidiffParseError
 from io import StringIO
 import json
 import copy
-import google.generativeai as genai
+import hashlib
+from llm_client import call_with_hedging, CircuitOpenError, request_timeout
+from llm_providers import get_provider
+from model_router import route_file, get_tier
+import diff_store
+from intent_extractor import classify_grouped, skips_llm
+from path_filter import path_matches
+from prompt_compactor import compact_lines
+from queue_stats import record_phase
+from task_profiler import phase
+from key_pool import generate_with_pool, pool_size
 import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Gemini free-tier pacing: sleep for a minute after this many summaries
+requests_per_minute = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "15"))
+
+# Summaries kept in flight at once within one analysis
+summary_concurrency = max(int(os.getenv("SUMMARY_CONCURRENCY", "4")), 1)
+
+DEFAULT_PROMPT_INTRO = (
+    "Here is a code change. Based on the added and removed lines, and the commit messages, "
+    "provide a brief natural language description of what was changed and why. Be concise but informative."
+)
+
+class QuotaExceededError(Exception):
+    """Gemini rejected the request with a 429; retry after `retry_after` seconds."""
+    def __init__(self, retry_after):
+        super().__init__(f"Gemini quota exceeded, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+class SummarizationDeferred(Exception):
+    """
+    Raised by parse_diff_by_commit instead of sleeping when it runs inside a task.
+    `completed` maps file digest -> summary for every file finished so far, so the
+    task can reschedule itself and only summarize the remaining files.
+    """
+    def __init__(self, retry_after, completed):
+        super().__init__(f"Summarization deferred for {retry_after} seconds")
+        self.retry_after = retry_after
+        self.completed = completed
+
+class SummaryFailedError(Exception):
+    """
+    A file could not be summarized for another reason than the quota (timeout,
+    API error). It is left pending: never checkpointed or reused as a result.
+    """
+
+PENDING_SUMMARY = "Pending: the AI service is currently unavailable, this file was not summarized."
+
+# Build the exact prompt sent to Gemini for one file (also used for cost estimation)
+def build_prompt(message, added_lines, removed_lines, prompt_intro=None):
+    intro = prompt_intro.strip() if prompt_intro else DEFAULT_PROMPT_INTRO
+    return (
+        intro + "\n\n" +
+        f"Commit message(s): {message}\n\n" +
+        f"Added lines:\n" + "\n".join(added_lines or []) + "\n\n" +
+        f"Removed lines:\n" + "\n".join(removed_lines or [])
+    )
 
-# Function to call Gemini and generate summary with retry logic
-def summarize_change_with_retry(message, added_lines, removed_lines, google_token=None, retries=3, prompt_intro=None):
+# Function to call the routed LLM and generate summary with retry logic
+# With raise_on_quota=True a 429 raises QuotaExceededError instead of sleeping,
+# letting the caller release the worker while waiting for the quota.
+# `tier` comes from model_router.get_tier (defaults to the "standard" tier) and
+# `metrics` is an optional model_router.TierMetrics collecting latency and tokens.
+def summarize_change_with_retry(message, added_lines, removed_lines, google_token=None, retries=3, prompt_intro=None, raise_on_quota=False, tier=None, metrics=None):
     #print("[DEBUG] Google token in summarize_change_with_retry:", google_token)
 
-    # ✅ Configure token ONCE
-    genai.configure(api_key=google_token)
-
-    model = genai.GenerativeModel("gemini-2.0-flash")
+    tier = tier or get_tier("standard")
+    provider = get_provider(tier["provider"])
 
     attempt = 0
     while attempt < retries:
         try:
-            if prompt_intro:
-                prompt = (
-                    prompt_intro.strip() + "\n\n" +
-                    f"Commit message(s): {message}\n\n" +
-                    f"Added lines:\n" + "\n".join(added_lines or []) + "\n\n" +
-                    f"Removed lines:\n" + "\n".join(removed_lines or [])
-                )
-            else:
-                prompt = (
-                    "Here is a code change. Based on the added and removed lines, and the commit messages, "
-                    "provide a brief natural language description of what was changed and why. Be concise but informative.\n\n"
-                    f"Commit message(s): {message}\n\n"
-                    f"Added lines:\n" + "\n".join(added_lines or []) + "\n\n" +
-                    f"Removed lines:\n" + "\n".join(removed_lines or [])
+            prompt = build_prompt(message, added_lines, removed_lines, prompt_intro)
+
+            def generate(api_key):
+                return provider.generate(
+                    prompt,
+                    model=tier["model"],
+                    max_output_tokens=tier["max_output_tokens"],
+                    temperature=tier["temperature"],
+                    api_key=api_key,
+                    timeout=request_timeout,
+                    thinking_budget=tier.get("thinking_budget")
                 )
 
-            response = genai.GenerativeModel("gemini-2.0-flash").generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.3,
-                    max_output_tokens=200
-                )
-            )
-            return response.text.strip()
+            start = time.monotonic()
+            with phase("summarize", tier["name"]):
+                if tier["provider"] == "gemini":
+                    # Pooled keys first (least loaded, with failover), the user's key otherwise
+                    response = call_with_hedging(lambda: generate_with_pool(generate, fallback_key=google_token), scope="gemini")
+                else:
+                    response = call_with_hedging(lambda: generate(google_token), scope=tier["provider"])
+            if metrics:
+                metrics.record(tier["name"], time.monotonic() - start, response["prompt_tokens"], response["output_tokens"])
+            return response["text"]
 
+        except CircuitOpenError:
+            raise
         except Exception as e:
             error_message = str(e)
             print(error_message)
 
-            if "429" in error_message and "retry_delay" in error_message:
+            if "429" in error_message:
                 match = re.search(r'retry_delay\s*{\s*seconds\s*:\s*(\d+)', error_message)
                 if match:
                     retry_delay = int(match.group(1))
+                    if raise_on_quota:
+                        raise QuotaExceededError(retry_delay + 1)
                     print(f"Quota exceeded. Retrying in {retry_delay + 1} seconds...")
-                    time.sleep(retry_delay + 1)
+                    with phase("sleep", "quota"):
+                        time.sleep(retry_delay + 1)
                     attempt += 1
                     continue
                 else:
                     print("Couldn't parse retry delay.")
                     break
             else:
-                return f"Error generating summary: {e}"
+                raise SummaryFailedError(f"Error generating summary: {e}") from e
+
+    if raise_on_quota:
+        raise QuotaExceededError(60)
 
     # 🔁 Final retry after 1 min, must include google_token
     print("Retries exhausted. Waiting 1 minute before retrying once more...")
-    time.sleep(60)
+    with phase("sleep", "retries exhausted"):
+        time.sleep(60)
     return summarize_change_with_retry(
         message, added_lines, removed_lines,
-        google_token=google_token, retries=1
+        google_token=google_token, retries=1, prompt_intro=prompt_intro,
+        tier=tier, metrics=metrics
     )
 
 # Group changes by file path
@@ -85,7 +154,8 @@ def regroup_by_file_path(data, message_separator=" || ", line_separator="---"):
                         "change_type": file["change_type"],
                         "is_new_file": file["is_new_file"],
                         "added_lines": copy.deepcopy(file["added_lines"]),
-                        "removed_lines": copy.deepcopy(file["removed_lines"])
+                        "removed_lines": copy.deepcopy(file["removed_lines"]),
+                        "hunks": file.get("hunks", 0)
                     }]
                 }
             else:
@@ -99,75 +169,117 @@ def regroup_by_file_path(data, message_separator=" || ", line_separator="---"):
                 if file_changed["removed_lines"] and file["removed_lines"]:
                     file_changed["removed_lines"].append(line_separator)
                 file_changed["removed_lines"].extend(file["removed_lines"])
+                file_changed["hunks"] += file.get("hunks", 0)
 
     return list(grouped.values())
 
 # Main parsing function
 from unidiff import PatchSet, UnidiffParseError
 
-def parse_diff_by_commit(commits, task=None, google_token=None, prompt_intro=None):
-    result = []
-    for commit in commits:
-        commit_entry = {
-            "message": commit["message"],
-            "files_changed": []
-        }
+def group_file_changes(commits, path_filter=None):
+    """
+    Parse each commit's diff and regroup the changes per file path.
+    This is the LLM-free part of the pipeline, shared by the worker and the
+    pre-flight cost estimation in /summarize. Files outside `path_filter`
+    (see path_filter.py) are dropped.
+    """
+    with phase("parse", f"{len(commits)} commits"):
+        parsed = [
+            {
+                "message": commit["message"],
+                "files_changed": [f for f in parse_commit_files(commit) if path_matches(path_filter, f["file_path"])]
+            }
+            for commit in commits
+        ]
+    with phase("group"):
+        return group_parsed_commits(parsed)
+
+def parse_commit_files(commit):
+    """
+    Parse one commit's diff (or Azure file list) into per-file changes.
+    Commits carrying a "repo" key are looked up in (and added to) the diff store.
+    """
+    if "files_changed" in commit:
+        return commit["files_changed"]  # fetcher already served it from the diff store
+    stored = diff_store.get(commit.get("repo"), commit.get("sha"))
+    if stored is not None:
+        return stored
+
+    parse_failed = False
+    commit_entry = {
+        "message": commit["message"],
+        "files_changed": []
+    }
 
-        # Check if diff is present
-        if not commit.get("diff"):
-            # Azure-style metadata-only commit
-            for file_info in commit.get("files", []):
-                file_path = file_info["file"].lstrip("/")
-                raw_change = file_info["change_type"].lower()
-                change_type_map = {
-                    "add": "added",
-                    "edit": "modified",
-                    "delete": "deleted"
-                }
-                change_type = change_type_map.get(raw_change, "modified")
-                is_new_file = change_type == "add"
-                
-                # Placeholder content (optional: refine for better summary prompts)
-                added_lines = ["// No diff available (Azure DevOps)"] if change_type != "delete" else []
-                removed_lines = ["// No diff available (Azure DevOps)"] if change_type != "add" else []
+    if commit.get("diff"):
+        # GitHub/GitLab/Bitbucket-style commit with real diff (Azure diffs are computed locally)
+        try:
+            patch_set = PatchSet(StringIO(commit["diff"]))
+            for file in patch_set:
+                added = [line.value.strip() for hunk in file for line in hunk if line.is_added]
+                removed = [line.value.strip() for hunk in file for line in hunk if line.is_removed]
+
+                if file.is_added_file:
+                    change_type = "added"
+                elif file.is_removed_file:
+                    change_type = "deleted"
+                else:
+                    change_type = "modified"
+
+                is_new_file = file.is_added_file and len(removed) == 0 and len(added) > 0
 
                 commit_entry["files_changed"].append({
-                    "file_path": file_path,
+                    "file_path": file.path,
                     "change_type": change_type,
-                    "added_lines": added_lines,
-                    "removed_lines": removed_lines,
-                    "is_new_file": is_new_file
+                    "added_lines": added,
+                    "removed_lines": removed,
+                    "is_new_file": is_new_file,
+                    "hunks": len(file)
                 })
-        else:
-            # GitHub/GitLab/Bitbucket-style commit with real diff
-            try:
-                patch_set = PatchSet(StringIO(commit["diff"]))
-                for file in patch_set:
-                    added = [line.value.strip() for hunk in file for line in hunk if line.is_added]
-                    removed = [line.value.strip() for hunk in file for line in hunk if line.is_removed]
-
-                    if file.is_added_file:
-                        change_type = "added"
-                    elif file.is_removed_file:
-                        change_type = "deleted"
-                    else:
-                        change_type = "modified"
-
-                    is_new_file = file.is_added_file and len(removed) == 0 and len(added) > 0
-
-                    commit_entry["files_changed"].append({
-                        "file_path": file.path,
-                        "change_type": change_type,
-                        "added_lines": added,
-                        "removed_lines": removed,
-                        "is_new_file": is_new_file
-                    })
-            except UnidiffParseError as e:
-                print(f"[WARN] Failed to parse diff for commit {commit.get('sha')}: {e}")
-                # Optional: fallback logic here
-
-        result.append(commit_entry)
-
+        except UnidiffParseError as e:
+            print(f"[WARN] Failed to parse diff for commit {commit.get('sha')}: {e}")
+            parse_failed = True
+
+    # Azure-style metadata for files whose content could not be fetched
+    parsed_paths = {f["file_path"] for f in commit_entry["files_changed"]}
+    placeholders = 0
+    for file_info in commit.get("files", []):
+        file_path = file_info["file"].lstrip("/")
+        if file_path in parsed_paths:
+            continue
+        raw_change = file_info["change_type"].lower()
+        change_type_map = {
+            "add": "added",
+            "edit": "modified",
+            "delete": "deleted"
+        }
+        change_type = change_type_map.get(raw_change, "modified")
+        is_new_file = change_type == "added"
+        placeholders += 1
+
+        # Placeholder content (optional: refine for better summary prompts)
+        added_lines = ["// No diff available (Azure DevOps)"] if change_type != "deleted" else []
+        removed_lines = ["// No diff available (Azure DevOps)"] if change_type != "added" else []
+
+        commit_entry["files_changed"].append({
+            "file_path": file_path,
+            "change_type": change_type,
+            "added_lines": added_lines,
+            "removed_lines": removed_lines,
+            "is_new_file": is_new_file,
+            "hunks": 0
+        })
+
+    # Placeholders may stem from a failed download and "partial" diffs were narrowed
+    # to a path filter by the fetcher, so only complete parses are immutable.
+    # A diff body without a single file is an error page rather than an empty commit.
+    unparsed = bool(commit.get("diff")) and not commit_entry["files_changed"]
+    if not (parse_failed or unparsed or placeholders or commit.get("partial")):
+        diff_store.put(commit.get("repo"), commit.get("sha"), commit_entry["files_changed"])
+    return commit_entry["files_changed"]
+
+def group_parsed_commits(result):
+    """Flatten [{message, files_changed}] entries to per-file level and group them by path."""
     # Flatten to per-file level and group
     exploded = []
     for entry in result:
@@ -184,36 +296,172 @@ def parse_diff_by_commit(commits, task=None, google_token=None, prompt_intro=Non
     }
     exploded.sort(key=lambda e: change_type_priority.get(e['files_changed'][0]['change_type'], 99))
 
-    grouped_data = regroup_by_file_path(exploded)
+    return regroup_by_file_path(exploded)
+
+def _digest(parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8", "replace"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+# Content digest of one parsed file change, independent of the commit it came from
+def change_digest(file_change):
+    return _digest((file_change["file_path"], *file_change["added_lines"], "\0", *file_change["removed_lines"]))
+
+# Stable content digest of one grouped file change (used to checkpoint and dedup summaries)
+def file_digest(item):
+    file_change = item["files_changed"][0]
+    return _digest((file_change["file_path"], item["message"], *file_change["added_lines"], "\0", *file_change["removed_lines"]))
+
+# Summary used instead of Gemini output when running in stats-only mode
+def summarize_change_stats(file_change, reason="stats-only mode"):
+    added = len([line for line in file_change["added_lines"] if line != "---"])
+    removed = len([line for line in file_change["removed_lines"] if line != "---"])
+    return f"{file_change['change_type'].capitalize()} file: +{added} / -{removed} lines ({reason}, no AI summary)."
+
+def parse_diff_by_commit(commits, task=None, google_token=None, prompt_intro=None, mode="full", completed=None, on_summary=None, metrics=None, path_filter=None, on_result=None):
+    """
+    Summarize every changed file of the given commits.
+    When `task` is given, rate-limit waits raise SummarizationDeferred instead of
+    sleeping so the Celery task can reschedule itself. `completed` maps file
+    digests to summaries from earlier runs, which are reused instead of calling
+    Gemini again; `on_summary(digest, summary)` is called after each new summary
+    and `on_result(item)` whenever a file's result is final (in completion order).
+    Each file is routed to a model tier; `metrics` (TierMetrics) collects per-tier stats.
+    Only files within `path_filter` are summarized.
+    """
+    return summarize_grouped(
+        group_file_changes(commits, path_filter), task=task, google_token=google_token, prompt_intro=prompt_intro,
+        mode=mode, completed=completed, on_summary=on_summary, metrics=metrics, on_result=on_result
+    )
+
+def summarize_grouped(grouped_data, task=None, google_token=None, prompt_intro=None, mode="full", completed=None, on_summary=None, metrics=None, on_result=None):
+    """Add a "summary" to every grouped file change (see parse_diff_by_commit for the options)."""
+    completed = dict(completed or {})
 
     print("Number of Files to be process:", len(grouped_data))
-
+    with phase("classify"):
+        classify_grouped(grouped_data)
+
+    if mode == "stats":
+        for item in grouped_data:
+            item["summary"] = summarize_change_stats(item["files_changed"][0])
+            if on_result:
+                on_result(item)
+        return grouped_data
+
+    total = len(grouped_data)
+    work = []
     for index, item in enumerate(grouped_data, start=1):
-        if task:
-            task.update_state(state='PROGRESS', meta={
-                'current': index,
-                'total': len(grouped_data),
-                'status': f'Processed {index} of {len(grouped_data)}'
-            })
-
         file_change = item["files_changed"][0]
-        item["summary"] = summarize_change_with_retry(
-            message=item["message"],
-            added_lines=file_change["added_lines"],
-            removed_lines=file_change["removed_lines"],
-            google_token=google_token,
-            prompt_intro=prompt_intro
-        )
-
-        if index % 15 == 0:
-            print(f"Processed {index}/{len(grouped_data)} items. Sleeping for 60 seconds to avoid hitting rate limits.")
-            time.sleep(60)
-        else:
-            print(f"Processed {index}/{len(grouped_data)} items.")
+        digest = file_digest(item)
+        if digest in completed:
+            item["summary"] = completed[digest]
+            if on_result:
+                on_result(item)
+            continue
+        if skips_llm(item):
+            item["summary"] = summarize_change_stats(file_change, reason=f"{item['intent']} change")
+            if on_result:
+                on_result(item)
+            continue
+        work.append((index, item, digest))
+
+    # Summaries run `summary_concurrency` at a time, in windows of at most
+    # `requests_per_minute` calls separated by the rate-limit pause. Items are
+    # updated in place, so the output order never depends on completion order.
+    # A Gemini key pool paces every key itself, so there is a single window.
+    window_size = len(work) if pool_size() else requests_per_minute
+    done = total - len(work)
+    calls = 0
+    position = 0
+    with ThreadPoolExecutor(max_workers=summary_concurrency) as pool:
+        while position < len(work):
+            if calls and calls % window_size == 0:
+                if task:
+                    print(f"Processed {done}/{total} items. Rescheduling in 60 seconds to avoid hitting rate limits.")
+                    raise SummarizationDeferred(60, completed)
+                print(f"Processed {done}/{total} items. Sleeping for 60 seconds to avoid hitting rate limits.")
+                with phase("sleep", "rate limit window"):
+                    time.sleep(60)
+
+            window = work[position:position + window_size - calls % window_size]
+            position += len(window)
+            window_started = time.monotonic()
+            window_calls = calls
+            futures = {}
+            for index, item, digest in window:
+                file_change = item["files_changed"][0]
+                tier = get_tier(route_file(item, classification=item["intent"]))
+                item["model_tier"] = tier["name"]
+                added_lines, removed_lines, compaction = compact_lines(
+                    file_change["file_path"], file_change["added_lines"], file_change["removed_lines"]
+                )
+                item["prompt_tokens_saved"] = compaction["tokens_saved"]
+                future = pool.submit(
+                    summarize_change_with_retry,
+                    message=item["message"],
+                    added_lines=added_lines,
+                    removed_lines=removed_lines,
+                    google_token=google_token,
+                    prompt_intro=prompt_intro,
+                    raise_on_quota=task is not None,
+                    tier=tier,
+                    metrics=metrics
+                )
+                futures[future] = (index, item, digest)
 
-    print(grouped_data)
+            quota_retry_after = None
+            for future in as_completed(futures):
+                index, item, digest = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    item["summary"] = future.result()
+                    calls += 1
+                except QuotaExceededError as e:
+                    # Stop queued calls; in-flight ones finish and are kept
+                    quota_retry_after = max(quota_retry_after or 0, e.retry_after)
+                    for other in futures:
+                        other.cancel()
+                    continue
+                except CircuitOpenError:
+                    # Gemini is degraded: fail fast and leave the file pending instead of hammering it
+                    item["summary"] = PENDING_SUMMARY
+                    item["status"] = "pending"
+                    print(f"Circuit open, marked {index}/{total} as pending.")
+                except SummaryFailedError as e:
+                    # Shown, but not checkpointed: a resumed or repeated analysis tries the file again.
+                    # The failed request still used the per-minute quota.
+                    item["summary"] = str(e)
+                    item["status"] = "pending"
+                    calls += 1
+                    print(f"Summary failed, marked {index}/{total} as pending.")
+                else:
+                    completed[digest] = item["summary"]
+                    if on_summary:
+                        on_summary(digest, item["summary"])
+
+                if on_result:
+                    on_result(item)
+                done += 1
+                if task:
+                    task.update_state(state='PROGRESS', meta={
+                        'current': done,
+                        'total': total,
+                        'status': f'Processed {done} of {total}'
+                    })
+                print(f"Processed {done}/{total} items.")
 
-    return grouped_data
+            if calls > window_calls:
+                # Wall time per file at the current concurrency feeds the queue ETAs
+                record_phase("summarize_file", (time.monotonic() - window_started) / (calls - window_calls))
 
+            if quota_retry_after is not None:
+                print(f"Quota exceeded after {len(completed)} files. Rescheduling in {quota_retry_after} seconds.")
+                raise SummarizationDeferred(quota_retry_after, completed)
 
+    print(grouped_data)
 
+    return grouped_data
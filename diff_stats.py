@@ -0,0 +1,73 @@
+"""
+Structural report of a PR computed from the parsed diffs alone ("stats" mode).
+
+No LLM is involved: line, hunk and change-type counts per file, churn rolled
+up by directory and by extension, the largest files and the commit intents.
+It's linear in the number of changed lines, so even PRs with hundreds of
+files are reported in milliseconds.
+"""
+import os
+import posixpath
+
+# Number of files listed under "largest_files"
+largest_files_count = int(os.getenv("STATS_LARGEST_FILES", "10"))
+
+def _count(lines):
+    # Grouped changes separate the commits touching a file with "---"
+    return sum(1 for line in lines if line != "---")
+
+def _rollup(files, key):
+    """[{ name, files, insertions, deletions, churn }] grouped by key(file), highest churn first."""
+    groups = {}
+    for file in files:
+        name = key(file)
+        group = groups.setdefault(name, {"name": name, "files": 0, "insertions": 0, "deletions": 0, "churn": 0})
+        group["files"] += 1
+        group["insertions"] += file["insertions"]
+        group["deletions"] += file["deletions"]
+        group["churn"] += file["insertions"] + file["deletions"]
+    return sorted(groups.values(), key=lambda g: (-g["churn"], g["name"]))
+
+def _directory(file):
+    return posixpath.dirname(file["file_path"]) or "(root)"
+
+def _extension(file):
+    return posixpath.splitext(posixpath.basename(file["file_path"]))[1].lower() or "(none)"
+
+def build_report(grouped_data, intents):
+    """
+    Report for grouped file changes (output of group_file_changes, before the
+    lines are compacted away); `intents` is the commits' intent_breakdown.
+    """
+    files = []
+    for item in grouped_data:
+        file_change = item["files_changed"][0]
+        files.append({
+            "file_path": file_change["file_path"],
+            "change_type": file_change["change_type"],
+            "insertions": _count(file_change["added_lines"]),
+            "deletions": _count(file_change["removed_lines"]),
+            "hunks": file_change.get("hunks", 0),
+            "intent": item.get("intent")
+        })
+
+    change_types = {}
+    for file in files:
+        change_types[file["change_type"]] = change_types.get(file["change_type"], 0) + 1
+
+    largest = sorted(files, key=lambda f: (-(f["insertions"] + f["deletions"]), f["file_path"]))
+
+    return {
+        "totals": {
+            "files": len(files),
+            "insertions": sum(f["insertions"] for f in files),
+            "deletions": sum(f["deletions"] for f in files),
+            "hunks": sum(f["hunks"] for f in files),
+            "change_types": change_types
+        },
+        "files": files,
+        "by_directory": _rollup(files, _directory),
+        "by_extension": _rollup(files, _extension),
+        "largest_files": largest[:largest_files_count],
+        "intents": intents
+    }
@@ -0,0 +1,120 @@
+"""
+Immutable, content-addressed store of parsed commit diffs on local disk.
+
+A commit's diff never changes, so the parsed file changes of (repo, sha) are
+written once as compressed JSON and reused by both the fetch stage (skip the
+download) and the parse stage (skip PatchSet). The store is size-capped with
+least-recently-used eviction based on file modification times, which reads refresh.
+"""
+import os
+import json
+import mmap
+import time
+import zlib
+import hashlib
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional: fall back to zlib
+    zstandard = None
+
+store_dir = os.getenv("DIFF_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "diff_store"))
+store_enabled = os.getenv("DIFF_STORE_ENABLED", "true").lower() == "true"
+max_bytes = int(os.getenv("DIFF_STORE_MAX_MB", "512")) * 1024 * 1024
+evict_every = 50  # puts between eviction scans
+
+# Bump when the stored format (output of parse_commit_files) changes
+STORE_VERSION = "v2"
+
+_extension = ".json.zst" if zstandard else ".json.zz"
+_lock = threading.Lock()
+_puts = 0
+
+def _compress(data):
+    if zstandard:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+def _decompress(path, data):
+    if path.endswith(".zst"):
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def _path(repo, sha, extension=_extension):
+    repo_hash = hashlib.sha256(repo.encode()).hexdigest()[:16]
+    return os.path.join(store_dir, STORE_VERSION, repo_hash, f"{sha}{extension}")
+
+def get(repo, sha):
+    """Parsed file changes of a commit, or None when not stored."""
+    if not (store_enabled and repo and sha):
+        return None
+    for extension in ([_extension, ".json.zz"] if zstandard else [_extension]):
+        path = _path(repo, sha, extension)
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                files_changed = json.loads(_decompress(path, mm))
+            os.utime(path)  # mark as recently used for LRU eviction
+            return files_changed
+        except (FileNotFoundError, ValueError):
+            continue
+        except Exception as e:
+            print("[Diff Store Read Error]", e)
+            return None
+    return None
+
+def put(repo, sha, files_changed):
+    """Store a commit's parsed file changes. Entries are immutable; existing ones are kept."""
+    global _puts
+    if not (store_enabled and repo and sha):
+        return
+    path = _path(repo, sha)
+    if os.path.exists(path):
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = _compress(json.dumps(files_changed).encode())
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print("[Diff Store Write Error]", e)
+        return
+
+    with _lock:
+        _puts += 1
+        scan = _puts % evict_every == 0
+    if scan:
+        evict()
+
+def evict():
+    """Delete least recently used entries until the store is below 90% of DIFF_STORE_MAX_MB."""
+    entries = []
+    total = 0
+    for root, _, names in os.walk(store_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith(".tmp") and time.time() - stat.st_mtime < 3600:
+                continue  # write in progress
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return
+    entries.sort()
+    target = max_bytes * 0.9
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
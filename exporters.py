@@ -0,0 +1,94 @@
+import csv
+import io
+import json
+import re
+import tempfile
+
+EXPORT_COLUMNS = ["File Name", "Change Type", "Reason to Change"]
+
+# Flush CSV/NDJSON output to the client every this many rows
+chunk_rows = 500
+
+# (pattern, name builder) for every supported platform URL
+_url_patterns = [
+    (r"github\.com/([^/]+)/([^/]+)/pull/(\d+)", lambda m: f"{m.group(1)}_{m.group(2)}_pr{m.group(3)}"),
+    (r"github\.com/([^/]+)/([^/]+)/compare/([^?#]+)", lambda m: f"{m.group(1)}_{m.group(2)}_compare_{m.group(3)}"),
+    (r"gitlab\.com/(.+?)/-/merge_requests/(\d+)", lambda m: f"{m.group(1)}_mr{m.group(2)}"),
+    (r"bitbucket\.org/([^/]+)/([^/]+)/pull-requests/(\d+)", lambda m: f"{m.group(1)}_{m.group(2)}_pr{m.group(3)}"),
+    (r"dev\.azure\.com/([^/]+)/([^/]+)/_git/([^/]+)/pullrequest/(\d+)", lambda m: f"{m.group(1)}_{m.group(3)}_pr{m.group(4)}"),
+]
+
+def export_filename(metadata, extension):
+    url = (metadata or {}).get("url") or ""
+    name = "unknown_pr"
+    for pattern, build in _url_patterns:
+        match = re.search(pattern, url)
+        if match:
+            name = build(match)
+            break
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("_")
+    return f"diffsage_{name}.{extension}"
+
+def iter_export_rows(result):
+    """Yield one row per changed file of a stored analysis result."""
+    for item in result.get("commits", []):
+        reason = item.get("summary") or "No summary provided."
+        for file in item.get("files_changed", []):
+            yield {
+                "File Name": file.get("file_path"),
+                "Change Type": file.get("change_type"),
+                "Reason to Change": reason
+            }
+
+def write_xlsx(rows, fileobj):
+    import xlsxwriter
+    # constant_memory flushes each row to a temp file instead of keeping the sheet in memory
+    workbook = xlsxwriter.Workbook(fileobj, {"constant_memory": True})
+    worksheet = workbook.add_worksheet("Summary")
+    bold = workbook.add_format({"bold": True})
+    worksheet.write_row(0, 0, EXPORT_COLUMNS, bold)
+    for index, row in enumerate(rows, start=1):
+        worksheet.write_row(index, 0, [row[column] for column in EXPORT_COLUMNS])
+    workbook.close()
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for index, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if index % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_ndjson(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row))
+        if len(lines) == chunk_rows:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+def write_parquet(rows, fileobj):
+    """Columnar export, written in row groups of `chunk_rows`. Needs the optional pyarrow package."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.string()) for column in EXPORT_COLUMNS])
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunk_rows:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+def spool_file():
+    """Anonymous temp file for XLSX/Parquet output; deleted when Flask closes it after sending."""
+    return tempfile.TemporaryFile()
@@ -1,25 +1,88 @@
+import os
 import re
+import json
+from collections import Counter
 
-def extract_commit_reasons(commit_messages):
-    reasons = []
-    for msg in commit_messages:
-        cleaned = msg.strip().split("\n")[0]  # Use subject line
-        reason = classify_reason(cleaned)
-        reasons.append({"message": cleaned, "category": reason})
-    return reasons
+# Commit intent categories in priority order: a message matching several
+# categories gets the first one. Keywords match anywhere in the subject line
+# (case-insensitive). Override with INTENT_CATEGORIES='[["Bug Fix", ["fix", "bug"]], ...]'.
+DEFAULT_CATEGORIES = [
+    ("Bug Fix", ["fix", "bug"]),
+    ("Refactor", ["refactor"]),
+    ("Feature", ["add", "feature"]),
+    ("Removal", ["remove", "delete"]),
+    ("Documentation", ["doc", "readme"]),
+    ("Testing", ["test"])
+]
+categories = [tuple(c) for c in json.loads(os.getenv("INTENT_CATEGORIES", "null")) or DEFAULT_CATEGORIES]
+
+OTHER = "Other"
+
+# Files whose commits all fall into these categories are not sent to the LLM
+# (they get a stats summary instead), e.g. INTENT_SKIP_LLM=Documentation
+skip_llm_categories = {c.strip() for c in os.getenv("INTENT_SKIP_LLM", "").split(",") if c.strip()}
+
+def build_matcher(categories):
+    """
+    One compiled regex for all keywords. The alternation sits in a lookahead so
+    every position is tried (overlapping keywords are all seen) and, at a given
+    position, higher-priority categories are tried first.
+    """
+    groups = "|".join(
+        f"(?P<c{i}>{'|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))})"
+        for i, (_, keywords) in enumerate(categories) if keywords
+    )
+    return re.compile(f"(?=(?:{groups}))", re.IGNORECASE)
+
+_matcher = build_matcher(categories)
+_priority = {name: i for i, (name, _) in enumerate(categories)}
 
 def classify_reason(message):
-    message = message.lower()
-    if "fix" in message or "bug" in message:
-        return "Bug Fix"
-    if "refactor" in message:
-        return "Refactor"
-    if "add" in message or "feature" in message:
-        return "Feature"
-    if "remove" in message or "delete" in message:
-        return "Removal"
-    if "doc" in message or "readme" in message:
-        return "Documentation"
-    if "test" in message:
-        return "Testing"
-    return "Other"
\ No newline at end of file
+    best = None
+    for match in _matcher.finditer(message):
+        if match.lastgroup is None:
+            continue
+        priority = int(match.lastgroup[1:])
+        if best is None or priority < best:
+            best = priority
+            if best == 0:
+                break
+    return categories[best][0] if best is not None else OTHER
+
+def subject_line(message):
+    return (message or "").strip().split("\n")[0]
+
+def classify_messages(messages):
+    """Classify many commit messages at once (each distinct subject line is matched once)."""
+    subjects = [subject_line(m) for m in messages]
+    cache = {s: classify_reason(s) for s in set(subjects)}
+    return [cache[s] for s in subjects]
+
+def extract_commit_reasons(commit_messages):
+    subjects = [subject_line(m) for m in commit_messages]
+    return [{"message": s, "category": c} for s, c in zip(subjects, classify_messages(subjects))]
+
+def intent_breakdown(messages):
+    """{category: number of messages}, most common first."""
+    return dict(Counter(classify_messages(messages)).most_common())
+
+def classify_grouped(grouped_data):
+    """
+    Add "intents" ({category: commits}) and "intent" (the most common one) to
+    every grouped file change. Grouped messages are joined with " || ".
+    """
+    messages = [item["message"].split(" || ") for item in grouped_data]
+    flat = classify_messages([m for item_messages in messages for m in item_messages])
+    position = 0
+    for item, item_messages in zip(grouped_data, messages):
+        counts = Counter(flat[position:position + len(item_messages)])
+        position += len(item_messages)
+        # Most common first; ties go to the higher-priority category
+        ranked = sorted(counts.items(), key=lambda c: (-c[1], _priority.get(c[0], len(categories))))
+        item["intents"] = dict(ranked)
+        item["intent"] = ranked[0][0]
+    return grouped_data
+
+def skips_llm(item):
+    """True when every commit touching this file is in an INTENT_SKIP_LLM category."""
+    return bool(skip_llm_categories) and bool(item.get("intents")) and set(item["intents"]) <= skip_llm_categories
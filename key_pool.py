@@ -0,0 +1,179 @@
+"""
+Admin-managed pool of Gemini API keys shared by all analyses.
+
+The web app publishes the enabled keys (still encrypted) to Redis; every
+summary call takes the least-loaded key that has quota left this minute. A
+429 puts the key on cooldown for the announced retry delay and the call fails
+over to the next key; invalid keys and repeated errors take a key out of
+rotation for a while. Without pooled keys the user's own key is used, as before.
+"""
+import os
+from utils.redis_client import get_redis
+from utils.encryption import decrypt_token
+from llm_providers import GeminiAPIError
+
+# Per-key Gemini request limit (the pool's combined limit is this times the number of keys)
+key_rpm = int(os.getenv("KEY_POOL_RPM", os.getenv("GEMINI_REQUESTS_PER_MINUTE", "15")))
+max_errors = int(os.getenv("KEY_POOL_MAX_ERRORS", "3"))  # consecutive errors before a key is taken out
+down_seconds = int(os.getenv("KEY_POOL_DOWN_SECONDS", "300"))
+default_cooldown = 60  # 429 without a retry delay
+
+KEYS_KEY = "gemini:pool:keys"
+
+def _key(key_id, name):
+    return f"gemini:pool:{key_id}:{name}"
+
+def sync_keys(keys):
+    """Replace the published pool with { key_id: encrypted key } (called by the web app)."""
+    r = get_redis()
+    pipe = r.pipeline()
+    pipe.delete(KEYS_KEY)
+    if keys:
+        pipe.hset(KEYS_KEY, mapping={str(key_id): ciphertext for key_id, ciphertext in keys.items()})
+    pipe.execute()
+
+def _key_ids():
+    try:
+        return sorted(key_id.decode() for key_id in get_redis().hkeys(KEYS_KEY))
+    except Exception as e:
+        print("[Key Pool Error]", e)
+        return []
+
+def pool_size():
+    return len(_key_ids())
+
+def pool_rpm():
+    """Gemini requests per minute available to one analysis: the pool's combined limit, or one key's."""
+    return key_rpm * max(pool_size(), 1)
+
+def _api_key(key_id):
+    ciphertext = get_redis().hget(KEYS_KEY, key_id)
+    return decrypt_token(ciphertext.decode()) if ciphertext else None
+
+def acquire(key_ids, exclude=()):
+    """
+    Reserve the least-loaded usable key: returns (key_id, None), or (None, seconds
+    until a key frees up) when every key is cooling down, down or at its limit.
+    """
+    r = get_redis()
+    candidates = [key_id for key_id in key_ids if key_id not in exclude]
+    if not candidates:
+        return None, default_cooldown
+
+    pipe = r.pipeline()
+    for key_id in candidates:
+        pipe.get(_key(key_id, "inflight"))
+        pipe.get(_key(key_id, "minute"))
+        pipe.ttl(_key(key_id, "minute"))
+        pipe.ttl(_key(key_id, "cooldown"))
+        pipe.ttl(_key(key_id, "down"))
+    values = pipe.execute()
+
+    usable = []
+    waits = []
+    for i, key_id in enumerate(candidates):
+        inflight, minute, minute_ttl, cooldown_ttl, down_ttl = values[i * 5:i * 5 + 5]
+        minute = int(minute or 0)
+        if down_ttl > 0 or cooldown_ttl > 0:
+            waits.append(max(down_ttl, cooldown_ttl))
+        elif minute >= key_rpm:
+            waits.append(max(minute_ttl, 1))
+        else:
+            usable.append((int(inflight or 0), minute, key_id))
+
+    # Fewest calls in flight first, then the most quota left this minute
+    for _, _, key_id in sorted(usable):
+        pipe = r.pipeline()
+        pipe.incr(_key(key_id, "minute"))
+        pipe.expire(_key(key_id, "minute"), 60, nx=True)
+        count, _ = pipe.execute()
+        if count > key_rpm:
+            continue  # another worker took the last slot
+        # Expires so a crashed worker can't leave a key looking busy forever
+        r.pipeline().incr(_key(key_id, "inflight")).expire(_key(key_id, "inflight"), 600).execute()
+        return key_id, None
+    return None, (min(waits) if waits else 1)
+
+def release(key_id):
+    get_redis().decr(_key(key_id, "inflight"))
+
+def _record(key_id, error=None, retry_after=None):
+    r = get_redis()
+    pipe = r.pipeline()
+    if error is None:
+        pipe.incr(_key(key_id, "calls"))
+        pipe.delete(_key(key_id, "errors"))
+    elif retry_after is not None:
+        pipe.incr(_key(key_id, "quota_errors"))
+        pipe.set(_key(key_id, "cooldown"), 1, ex=max(int(retry_after), 1))
+    else:
+        pipe.incr(_key(key_id, "errors"))
+    pipe.execute()
+
+    if error is not None and retry_after is None:
+        status = getattr(error, "status_code", None)
+        if status in (401, 403) or int(r.get(_key(key_id, "errors")) or 0) >= max_errors:
+            print(f"[Key Pool] Taking key {key_id} out of rotation for {down_seconds}s: {error}")
+            r.set(_key(key_id, "down"), 1, ex=down_seconds)
+
+def _is_quota(error):
+    return getattr(error, "status_code", None) == 429 or "429" in str(error)
+
+def generate_with_pool(generate, fallback_key=None):
+    """
+    Call generate(api_key) with pooled keys, failing over to the next key on a
+    429 or a key error. Falls back to `fallback_key` (the user's own key) when
+    the pool is empty or exhausted; raises a 429 GeminiAPIError with the wait
+    until the next key frees up otherwise, which the caller turns into a deferral.
+    """
+    key_ids = _key_ids()
+    if not key_ids:
+        return generate(fallback_key)
+
+    tried = set()
+    while True:
+        key_id, wait = acquire(key_ids, exclude=tried)
+        if key_id is None:
+            if fallback_key:
+                return generate(fallback_key)
+            raise GeminiAPIError(429, "every pooled Gemini key is rate limited", retry_after=wait)
+        tried.add(key_id)
+        try:
+            result = generate(_api_key(key_id))
+        except Exception as e:
+            if _is_quota(e):
+                _record(key_id, e, retry_after=getattr(e, "retry_after", None) or default_cooldown)
+                continue
+            _record(key_id, e)
+            if getattr(e, "status_code", None) in (401, 403):
+                continue  # the key itself is bad: try another one
+            raise
+        finally:
+            release(key_id)
+        _record(key_id)
+        return result
+
+def pool_status():
+    """Per-key load and health for the admin page: { key_id: {...} }."""
+    key_ids = _key_ids()
+    if not key_ids:
+        return {}
+    fields = ("inflight", "minute", "calls", "quota_errors", "errors")
+    pipe = get_redis().pipeline()
+    for key_id in key_ids:
+        for field in fields:
+            pipe.get(_key(key_id, field))
+        pipe.ttl(_key(key_id, "cooldown"))
+        pipe.ttl(_key(key_id, "down"))
+    values = pipe.execute()
+
+    status = {}
+    per_key = len(fields) + 2
+    for i, key_id in enumerate(key_ids):
+        chunk = values[i * per_key:(i + 1) * per_key]
+        status[key_id] = {
+            **{field: int(value or 0) for field, value in zip(fields, chunk)},
+            "cooldown_seconds": max(chunk[-2], 0),
+            "down_seconds": max(chunk[-1], 0)
+        }
+    return status
@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.redis_client import get_redis
+
+# Per-request timeout for one Gemini call, in seconds
+request_timeout = float(os.getenv("LLM_REQUEST_TIMEOUT", "30"))
+
+# Hedging: if a call is slower than the observed p95, send a duplicate and keep the first answer
+hedging_enabled = os.getenv("LLM_HEDGING", "true").lower() == "true"
+hedge_min_delay = float(os.getenv("LLM_HEDGE_MIN_DELAY", "3"))
+hedges_per_minute = int(os.getenv("LLM_HEDGES_PER_MINUTE", "3"))  # extra calls allowed on top of the rate limit
+
+# Circuit breaker shared by all workers through Redis
+breaker_window = int(os.getenv("LLM_BREAKER_WINDOW", "60"))
+breaker_min_requests = int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10"))
+breaker_error_rate = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+breaker_cooldown = int(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+class CircuitOpenError(Exception):
+    """The LLM service is failing for everyone; calls are short-circuited until the cooldown ends."""
+
+class LLMTimeoutError(Exception):
+    """No answer within the per-request timeout (including the hedged request)."""
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_CLIENT_THREADS", "16")))
+_lock = threading.Lock()
+_latencies = deque(maxlen=200)
+_hedge_times = deque()
+
+def _record_latency(seconds):
+    with _lock:
+        _latencies.append(seconds)
+
+def hedge_delay():
+    """p95 of the recent call latencies, never below LLM_HEDGE_MIN_DELAY."""
+    with _lock:
+        samples = sorted(_latencies)
+    if len(samples) < 20:
+        return max(hedge_min_delay, request_timeout / 3)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    return max(hedge_min_delay, p95)
+
+def _take_hedge_slot():
+    now = time.monotonic()
+    with _lock:
+        while _hedge_times and now - _hedge_times[0] > 60:
+            _hedge_times.popleft()
+        if len(_hedge_times) >= hedges_per_minute:
+            return False
+        _hedge_times.append(now)
+        return True
+
+def _is_quota_error(error):
+    # 429s are per-key quota, not service health: handled by task rescheduling
+    return "429" in str(error)
+
+def circuit_is_open(scope="gemini"):
+    try:
+        return bool(get_redis().exists(f"llm:breaker:{scope}:open"))
+    except Exception as e:
+        print("[Circuit Breaker Error]", e)
+        return False
+
+def circuit_cooldown(scope="gemini"):
+    """Seconds until an open circuit breaker closes again (0 when closed)."""
+    try:
+        return max(get_redis().ttl(f"llm:breaker:{scope}:open"), 0)
+    except Exception as e:
+        print("[Circuit Breaker Error]", e)
+        return 0
+
+def _record_outcome(scope, failed):
+    try:
+        r = get_redis()
+        ok_key = f"llm:breaker:{scope}:ok"
+        err_key = f"llm:breaker:{scope}:err"
+        pipe = r.pipeline()
+        pipe.incr(err_key if failed else ok_key)
+        pipe.expire(err_key if failed else ok_key, breaker_window, nx=True)
+        pipe.get(ok_key)
+        pipe.get(err_key)
+        _, _, ok, err = pipe.execute()
+        if not failed:
+            return
+        ok, err = int(ok or 0), int(err or 0)
+        total = ok + err
+        if total >= breaker_min_requests and err / total >= breaker_error_rate:
+            print(f"[WARN] Opening LLM circuit breaker for {breaker_cooldown}s ({err}/{total} failed)")
+            # Reset the counters so the first calls after the cooldown decide afresh
+            pipe = r.pipeline()
+            pipe.set(f"llm:breaker:{scope}:open", 1, ex=breaker_cooldown)
+            pipe.delete(ok_key, err_key)
+            pipe.execute()
+    except Exception as e:
+        print("[Circuit Breaker Error]", e)
+
+def _timed(fn):
+    start = time.monotonic()
+    result = fn()
+    return result, time.monotonic() - start
+
+def call_with_hedging(fn, timeout=None, scope="gemini"):
+    """
+    Run `fn()` (one LLM request) with a timeout, a hedged duplicate after the
+    p95 delay, and the shared circuit breaker. Returns the first successful result.
+    Raises CircuitOpenError, LLMTimeoutError or the request's own exception.
+    """
+    timeout = timeout or request_timeout
+    if circuit_is_open(scope):
+        raise CircuitOpenError(f"{scope} circuit breaker is open")
+
+    start = time.monotonic()
+    pending = {_executor.submit(_timed, fn)}
+    hedged = not hedging_enabled
+    last_error = None
+
+    while pending:
+        elapsed = time.monotonic() - start
+        remaining = timeout - elapsed
+        if remaining <= 0:
+            break
+        wait_for = remaining if hedged else min(remaining, max(hedge_delay() - elapsed, 0))
+        done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            try:
+                result, latency = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            _record_latency(latency)
+            _record_outcome(scope, failed=False)
+            return result
+
+        if not done and not hedged:
+            hedged = True
+            if _take_hedge_slot():
+                print(f"[INFO] LLM call slower than {hedge_delay():.1f}s, sending hedged request")
+                pending.add(_executor.submit(_timed, fn))
+
+    if last_error is not None and not pending:
+        if not _is_quota_error(last_error):
+            _record_outcome(scope, failed=True)
+        raise last_error
+
+    _record_outcome(scope, failed=True)
+    raise LLMTimeoutError(f"No LLM response within {timeout:.0f} seconds")
@@ -0,0 +1,158 @@
+import os
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+
+gemini_api_base = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+gemini_pool_size = int(os.getenv("GEMINI_POOL_SIZE", "8"))  # connections per API key
+gemini_max_clients = int(os.getenv("GEMINI_MAX_CLIENTS", "64"))  # API keys kept in the pool
+
+class GeminiAPIError(Exception):
+    """
+    Non-200 answer from the Gemini REST API. The message keeps the status code
+    and a `retry_delay { seconds: N }` hint, which summarize_change_with_retry parses.
+    """
+    def __init__(self, status_code, message, retry_after=None):
+        hint = f" retry_delay {{ seconds: {retry_after} }}" if retry_after is not None else ""
+        super().__init__(f"{status_code} {message}{hint}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class GeminiClient:
+    """Gemini REST client bound to one API key. Thread-safe: no global SDK configuration is involved."""
+
+    def __init__(self, api_key):
+        self.session = requests.Session()
+        self.session.headers.update({"x-goog-api-key": api_key or "", "Content-Type": "application/json"})
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=gemini_pool_size))
+
+    def generate_content(self, model, prompt, max_output_tokens, temperature, timeout=None, thinking_budget=None):
+        generation_config = {"temperature": temperature, "maxOutputTokens": max_output_tokens}
+        if thinking_budget is not None:
+            # Thinking models (2.5) spend thinking tokens out of maxOutputTokens
+            generation_config["thinkingConfig"] = {"thinkingBudget": thinking_budget}
+        resp = self.session.post(
+            f"{gemini_api_base}/models/{model}:generateContent",
+            json={
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generationConfig": generation_config
+            },
+            timeout=timeout
+        )
+        if resp.status_code != 200:
+            raise self._error(resp)
+        return resp.json()
+
+    @staticmethod
+    def _error(resp):
+        try:
+            error = resp.json().get("error", {})
+        except ValueError:
+            error = {}
+        retry_after = None
+        for detail in error.get("details", []):
+            if detail.get("@type", "").endswith("RetryInfo") and detail.get("retryDelay"):
+                retry_after = int(float(detail["retryDelay"].rstrip("s")))
+        if retry_after is None and resp.headers.get("Retry-After", "").isdigit():
+            retry_after = int(resp.headers["Retry-After"])
+        return GeminiAPIError(resp.status_code, error.get("message") or resp.text[:500], retry_after)
+
+class GeminiClientPool:
+    """One GeminiClient (and connection pool) per API key, least recently used keys are dropped."""
+
+    def __init__(self, max_clients=gemini_max_clients):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+
+    def get(self, api_key):
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                client = self._clients[api_key] = GeminiClient(api_key)
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)[1].session.close()
+            self._clients.move_to_end(api_key)
+            return client
+
+gemini_clients = GeminiClientPool()
+
+class GeminiProvider:
+    name = "gemini"
+
+    def generate(self, prompt, model, max_output_tokens, temperature, api_key=None, timeout=None, thinking_budget=None):
+        data = gemini_clients.get(api_key).generate_content(
+            model, prompt, max_output_tokens, temperature, timeout=timeout, thinking_budget=thinking_budget
+        )
+        candidates = data.get("candidates") or []
+        parts = (candidates[0].get("content") or {}).get("parts", []) if candidates else []
+        text = "".join(part.get("text", "") for part in parts)
+        if not text:
+            reason = candidates[0].get("finishReason") if candidates else (data.get("promptFeedback") or {}).get("blockReason")
+            raise ValueError(f"Gemini returned no text (reason: {reason})")
+        usage = data.get("usageMetadata") or {}
+        return {
+            "text": text.strip(),
+            "prompt_tokens": usage.get("promptTokenCount", 0),
+            "output_tokens": usage.get("candidatesTokenCount", 0)
+        }
+
+class OpenAIProvider:
+    """OpenAI (or any OpenAI-compatible endpoint via OPENAI_BASE_URL). Uses a server-wide key."""
+    name = "openai"
+
+    def __init__(self):
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_BASE_URL") or None
+            )
+        return self._client
+
+    def generate(self, prompt, model, max_output_tokens, temperature, api_key=None, timeout=None, thinking_budget=None):
+        response = self._get_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_output_tokens,
+            temperature=temperature,
+            timeout=timeout
+        )
+        usage = response.usage
+        return {
+            "text": (response.choices[0].message.content or "").strip(),
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "output_tokens": usage.completion_tokens if usage else 0
+        }
+
+class StubProvider:
+    """Offline provider for local runs: describes the change from the prompt without any network call."""
+    name = "stub"
+
+    def generate(self, prompt, model, max_output_tokens, temperature, api_key=None, timeout=None, thinking_budget=None):
+        added = prompt.split("Added lines:\n", 1)[-1].split("\n\nRemoved lines:\n", 1)[0]
+        removed = prompt.split("\n\nRemoved lines:\n", 1)[-1]
+        added_count = len([line for line in added.splitlines() if line.strip()])
+        removed_count = len([line for line in removed.splitlines() if line.strip()])
+        message = prompt.split("Commit message(s): ", 1)[-1].split("\n", 1)[0]
+        text = f"[{model}] {message.strip()} (+{added_count} / -{removed_count} lines)"
+        return {
+            "text": text,
+            "prompt_tokens": len(prompt) // 4 + 1,
+            "output_tokens": len(text) // 4 + 1
+        }
+
+providers = {
+    "gemini": GeminiProvider(),
+    "openai": OpenAIProvider(),
+    "stub": StubProvider()
+}
+
+def get_provider(name):
+    if name not in providers:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    return providers[name]
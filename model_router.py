@@ -0,0 +1,109 @@
+import os
+import json
+import threading
+from utils.redis_client import get_redis
+
+# Model tiers; override with MODEL_TIERS='{"fast": {...}, ...}' (JSON, merged per tier).
+# thinking_budget (Gemini 2.5+) caps the thinking tokens, which count against max_output_tokens.
+model_tiers = {
+    "fast": {"provider": "gemini", "model": "gemini-2.0-flash-lite", "max_output_tokens": 120, "temperature": 0.2},
+    "standard": {"provider": "gemini", "model": "gemini-2.0-flash", "max_output_tokens": 200, "temperature": 0.3},
+    "strong": {"provider": "gemini", "model": "gemini-2.5-flash", "max_output_tokens": 400, "temperature": 0.3, "thinking_budget": 0}
+}
+for _tier, _config in json.loads(os.getenv("MODEL_TIERS", "{}")).items():
+    model_tiers[_tier] = {**model_tiers.get(_tier, {}), **_config}
+
+# With routing disabled every file uses the "standard" tier (the previous behaviour)
+routing_enabled = os.getenv("MODEL_ROUTING", "true").lower() == "true"
+small_diff_lines = int(os.getenv("SMALL_DIFF_LINES", "20"))
+large_diff_lines = int(os.getenv("LARGE_DIFF_LINES", "400"))
+# Commit intents (names from INTENT_CATEGORIES) whose files always use the "fast" tier
+fast_intents = {c.strip() for c in os.getenv("FAST_INTENTS", "Documentation").split(",") if c.strip()}
+
+# Files that rarely need a deep explanation
+simple_extensions = {
+    ".md", ".rst", ".txt", ".json", ".yml", ".yaml", ".toml", ".ini", ".cfg",
+    ".lock", ".csv", ".svg", ".xml", ".properties", ".env"
+}
+simple_file_names = {"requirements.txt", "package-lock.json", "yarn.lock", "poetry.lock", "go.sum", ".gitignore", "Dockerfile"}
+
+def route_file(item, classification=None):
+    """
+    Pick the tier name for one grouped file change based on its diff size,
+    file type and classification (change type or commit intent).
+    """
+    if not routing_enabled:
+        return "standard"
+
+    file_change = item["files_changed"][0]
+    path = file_change["file_path"]
+    changed = len(file_change["added_lines"]) + len(file_change["removed_lines"])
+    name = os.path.basename(path)
+    ext = os.path.splitext(name)[1].lower()
+
+    if file_change["change_type"] == "deleted" or classification in fast_intents:
+        return "fast"
+    if name in simple_file_names or ext in simple_extensions:
+        return "fast" if changed < large_diff_lines else "standard"
+    if changed <= small_diff_lines:
+        return "fast"
+    if changed >= large_diff_lines:
+        return "strong"
+    return "standard"
+
+def get_tier(name):
+    return {"name": name, **model_tiers[name]}
+
+class TierMetrics:
+    """Per-tier call count, latency and token totals for one analysis."""
+
+    def __init__(self, snapshot=None):
+        self._lock = threading.Lock()
+        self._tiers = {tier: dict(stats) for tier, stats in (snapshot or {}).items()}
+
+    def snapshot(self):
+        """Raw totals, to carry the metrics across reschedules of the same task."""
+        with self._lock:
+            return {tier: dict(stats) for tier, stats in self._tiers.items()}
+
+    def record(self, tier, latency, prompt_tokens, output_tokens):
+        with self._lock:
+            stats = self._tiers.setdefault(tier, {"calls": 0, "latency": 0.0, "prompt_tokens": 0, "output_tokens": 0})
+            stats["calls"] += 1
+            stats["latency"] += latency
+            stats["prompt_tokens"] += prompt_tokens
+            stats["output_tokens"] += output_tokens
+
+    def report(self):
+        with self._lock:
+            return {
+                tier: {
+                    "model": model_tiers.get(tier, {}).get("model"),
+                    "calls": stats["calls"],
+                    "mean_latency": round(stats["latency"] / stats["calls"], 3),
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "output_tokens": stats["output_tokens"]
+                }
+                for tier, stats in self._tiers.items()
+            }
+
+    def publish(self, since=None):
+        """
+        Add this analysis' totals to the fleet-wide counters in Redis (llm:tier_metrics:<tier>).
+        `since` is an earlier snapshot already published, so only the difference is added.
+        """
+        since = since or {}
+        try:
+            pipe = get_redis().pipeline()
+            with self._lock:
+                for tier, totals in self._tiers.items():
+                    previous = since.get(tier, {})
+                    stats = {field: value - previous.get(field, 0) for field, value in totals.items()}
+                    key = f"llm:tier_metrics:{tier}"
+                    pipe.hincrby(key, "calls", stats["calls"])
+                    pipe.hincrbyfloat(key, "latency", stats["latency"])
+                    pipe.hincrby(key, "prompt_tokens", stats["prompt_tokens"])
+                    pipe.hincrby(key, "output_tokens", stats["output_tokens"])
+            pipe.execute()
+        except Exception as e:
+            print("[Tier Metrics Error]", e)
@@ -0,0 +1,88 @@
+"""
+Include/exclude path globs that scope an analysis to part of a repository.
+
+Globs use `*` (within one path segment), `?` and `**` (any number of
+segments), e.g. `src/**` or `docs/**/*.md`. A glob without a `/` matches the
+file name in any directory, like `*.lock` in .gitignore. A path is analyzed
+when it matches an include glob (or there are none) and no exclude glob.
+
+Fetchers use the filter to skip downloads where the platform allows it;
+parsing enforces it on every fetched diff (see group_file_changes).
+"""
+import re
+import json
+import posixpath
+from functools import lru_cache
+
+def parse_globs(value):
+    """Globs from a list or a comma/newline separated string."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = re.split(r"[,\n]", value)
+    return [glob.strip().lstrip("/") for glob in value if glob and glob.strip()]
+
+def make_filter(include=None, exclude=None):
+    """{ include, exclude } for the given globs, or None when there are none (the whole PR)."""
+    include, exclude = parse_globs(include), parse_globs(exclude)
+    if not (include or exclude):
+        return None
+    return {"include": include, "exclude": exclude}
+
+def _translate(glob):
+    parts = []
+    i = 0
+    while i < len(glob):
+        if glob.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif glob.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif glob[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif glob[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(glob[i]))
+            i += 1
+    return "".join(parts)
+
+def _compile_all(globs):
+    if not globs:
+        return None
+    return re.compile("|".join(f"(?:{_translate(glob)})" for glob in globs))
+
+@lru_cache(maxsize=256)
+def _compile(globs):
+    """One regex for paths and one for file names, or None when no glob applies to them."""
+    path_globs = [g for g in globs if "/" in g]
+    name_globs = [g for g in globs if "/" not in g]
+    return _compile_all(path_globs), _compile_all(name_globs)
+
+def _matches_any(globs, path):
+    path_regex, name_regex = _compile(tuple(globs))
+    return bool(
+        (path_regex and path_regex.fullmatch(path)) or
+        (name_regex and name_regex.fullmatch(posixpath.basename(path)))
+    )
+
+def path_matches(path_filter, path):
+    """True when `path` is in scope (always, without a filter)."""
+    if not path_filter:
+        return True
+    path = path.lstrip("/")
+    if path_filter["include"] and not _matches_any(path_filter["include"], path):
+        return False
+    return not _matches_any(path_filter["exclude"], path)
+
+def analysis_scope(prompt_intro, path_filter):
+    """
+    Prompt text extended by the filter: results of differently scoped analyses
+    must not be shared (pre-warm index, single-flight coalescing).
+    """
+    if not path_filter:
+        return prompt_intro
+    return f"{prompt_intro}\n[paths] {json.dumps(path_filter, sort_keys=True)}"
@@ -0,0 +1,127 @@
+"""
+Shrink the added/removed lines of one file before they are put in a prompt:
+drop "---" commit separators, blank and comment-only lines, cancel lines that
+were only moved (present in both lists) and collapse runs of repeated or
+near-identical lines. Which files are summarized is unchanged.
+"""
+import os
+import re
+from collections import Counter
+
+compaction_enabled = os.getenv("PROMPT_COMPACTION", "true").lower() == "true"
+drop_comments = os.getenv("PROMPT_DROP_COMMENTS", "true").lower() == "true"
+# Shortest run of similar lines that gets collapsed
+collapse_min_run = int(os.getenv("PROMPT_COLLAPSE_MIN_RUN", "3"))
+
+LINE_SEPARATOR = "---"  # see diff_parser.regroup_by_file_path
+
+# Comment markers by file extension; other files keep all their lines
+_hash_comments = ("#",)
+_c_comments = ("//", "/*", "*/", "* ")
+comment_prefixes = {
+    **dict.fromkeys([".py", ".sh", ".bash", ".rb", ".pl", ".r", ".yml", ".yaml", ".toml", ".cfg", ".ini", ".conf", ".dockerfile"], _hash_comments),
+    **dict.fromkeys([".js", ".jsx", ".ts", ".tsx", ".java", ".kt", ".scala", ".c", ".h", ".cc", ".cpp", ".hpp",
+                     ".cs", ".go", ".rs", ".swift", ".php", ".dart", ".css", ".scss", ".less"], _c_comments),
+    **dict.fromkeys([".sql", ".lua", ".hs"], ("--",)),
+    **dict.fromkeys([".html", ".xml", ".vue", ".svg"], ("<!--",))
+}
+
+_digits = re.compile(r"\d+")
+
+def _tokens(lines):
+    # Same ~4 characters per token rule as cost_estimator.estimate_tokens
+    return sum(len(line) + 1 for line in lines) // 4
+
+def _is_comment(line, prefixes):
+    return line == "*" or line.startswith(prefixes)
+
+def _drop_noise(lines, prefixes):
+    return [
+        line for line in lines
+        if line and line != LINE_SEPARATOR and not (prefixes and _is_comment(line, prefixes))
+    ]
+
+def _cancel_moved(added, removed):
+    """Remove lines present in both lists (as many times as they appear in both)."""
+    moved = Counter(added) & Counter(removed)
+    if not moved:
+        return added, removed, 0
+
+    def without_moved(lines):
+        remaining = Counter(moved)
+        kept = []
+        for line in lines:
+            if remaining[line]:
+                remaining[line] -= 1
+            else:
+                kept.append(line)
+        return kept
+
+    return without_moved(added), without_moved(removed), sum(moved.values())
+
+def _collapse_runs(lines):
+    """Keep the first line of each run of identical or number-only-different lines."""
+    collapsed = []
+    saved = 0
+    i = 0
+    while i < len(lines):
+        shape = _digits.sub("0", lines[i])
+        j = i + 1
+        while j < len(lines) and _digits.sub("0", lines[j]) == shape:
+            j += 1
+        run = j - i
+        if run >= collapse_min_run:
+            if all(line == lines[i] for line in lines[i:j]):
+                collapsed.append(f"{lines[i]}  (x{run})")
+            else:
+                collapsed.extend([lines[i], f"... ({run - 1} similar)"])
+            saved += run - 1
+        else:
+            collapsed.extend(lines[i:j])
+        i = j
+    return collapsed, saved
+
+def _unchanged(added_lines, removed_lines, tokens):
+    return added_lines, removed_lines, {
+        "tokens_before": tokens, "tokens_after": tokens, "tokens_saved": 0,
+        "moved_lines": 0, "collapsed_lines": 0, "dropped_lines": 0
+    }
+
+def compact_lines(file_path, added_lines, removed_lines):
+    """
+    Returns (added_lines, removed_lines, stats) where stats is
+    { tokens_before, tokens_after, tokens_saved, moved_lines, collapsed_lines, dropped_lines }.
+    """
+    added_lines = added_lines or []
+    removed_lines = removed_lines or []
+    tokens_before = _tokens(added_lines) + _tokens(removed_lines)
+    if not compaction_enabled:
+        return _unchanged(added_lines, removed_lines, tokens_before)
+
+    prefixes = comment_prefixes.get(os.path.splitext(file_path)[1].lower()) if drop_comments else None
+    added = _drop_noise(added_lines, prefixes)
+    removed = _drop_noise(removed_lines, prefixes)
+    if prefixes and not added and not removed:
+        # A comment-only change: the comments are the change
+        added = _drop_noise(added_lines, None)
+        removed = _drop_noise(removed_lines, None)
+    dropped = len(added_lines) + len(removed_lines) - len(added) - len(removed)
+
+    added, removed, moved = _cancel_moved(added, removed)
+    added, collapsed_added = _collapse_runs(added)
+    removed, collapsed_removed = _collapse_runs(removed)
+    if moved:
+        added.append(f"... ({moved} moved lines omitted)")
+
+    tokens_after = _tokens(added) + _tokens(removed)
+    if tokens_after >= tokens_before:
+        # Nothing worth removing (the markers would cost more than they save)
+        return _unchanged(added_lines, removed_lines, tokens_before)
+    return added, removed, {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": max(tokens_before - tokens_after, 0),
+        "moved_lines": moved,
+        "collapsed_lines": collapsed_added + collapsed_removed,
+        "dropped_lines": dropped
+    }
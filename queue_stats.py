@@ -0,0 +1,204 @@
+"""
+Queue backlog and wait estimates for users and autoscalers.
+
+Every enqueued analysis is registered with its estimated LLM calls; workers
+report when it starts, each summarized file and when it finishes or is
+rescheduled for the quota. Together with the broker queue depths, the
+measured per-file latency (moving average) and the rate-limit state this
+gives the remaining work and an ETA per task.
+"""
+import os
+import json
+import time
+from utils.redis_client import get_redis
+from llm_client import circuit_cooldown
+from key_pool import pool_rpm
+
+broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+queues = [q.strip() for q in os.getenv("QUEUE_STATS_QUEUES", "celery,prewarm").split(",") if q.strip()]
+# Analyses that run at the same time across all workers (sum of worker concurrency)
+worker_slots = max(int(os.getenv("WORKER_SLOTS", "1")), 1)
+# Prior for the per-file latency until real timings have been measured
+default_file_seconds = float(os.getenv("LLM_SECONDS_PER_CALL", "2.0"))
+# Registrations older than this are considered lost (e.g. purged queues)
+job_ttl = int(os.getenv("RESULT_EXPIRES", "86400"))
+timing_weight = 0.2  # weight of the newest measurement in the moving averages
+
+JOBS_KEY = "queue:jobs"
+PROGRESS_KEY = "queue:progress"
+
+_broker = None
+
+def _broker_client():
+    global _broker
+    if _broker is None and broker_url.startswith("redis"):
+        import redis
+        _broker = redis.Redis.from_url(broker_url)
+    return _broker
+
+def record_phase(phase, seconds):
+    """Fold one timing of a phase ("fetch", "summarize_file") into its moving average."""
+    try:
+        r = get_redis()
+        key = f"queue:timing:{phase}"
+        previous = r.get(key)
+        average = seconds if previous is None else (1 - timing_weight) * float(previous) + timing_weight * seconds
+        r.set(key, average)
+    except Exception as e:
+        print("[Queue Stats Error]", e)
+
+def phase_seconds(phase, default):
+    try:
+        value = get_redis().get(f"queue:timing:{phase}")
+        return float(value) if value is not None else default
+    except Exception as e:
+        print("[Queue Stats Error]", e)
+        return default
+
+def _update_job(task_id, **fields):
+    try:
+        r = get_redis()
+        raw = r.hget(JOBS_KEY, task_id)
+        if raw is not None:
+            r.hset(JOBS_KEY, task_id, json.dumps({**json.loads(raw), **fields}))
+    except Exception as e:
+        print("[Queue Stats Error]", e)
+
+def register_task(task_id, queue, estimate, countdown=None, started=False):
+    """Remember an enqueued (or already running) analysis and its estimated work."""
+    now = time.time()
+    try:
+        get_redis().hset(JOBS_KEY, task_id, json.dumps({
+            "queue": queue,
+            "files": estimate["files"],
+            "llm_calls": estimate["llm_calls"],
+            "enqueued_at": now,
+            "not_before": now + (countdown or 0),
+            "started_at": now if started else None
+        }))
+    except Exception as e:
+        print("[Queue Stats Error]", e)
+
+def mark_started(task_id):
+    _update_job(task_id, started_at=time.time())
+
+def defer_task(task_id, retry_after):
+    """The task went back to the queue to wait for the rate limit."""
+    _update_job(task_id, started_at=None, not_before=time.time() + retry_after)
+
+def track_progress(task_id, files=1):
+    try:
+        get_redis().hincrby(PROGRESS_KEY, task_id, files)
+    except Exception as e:
+        print("[Queue Stats Error]", e)
+
+def finish_task(task_id):
+    try:
+        get_redis().pipeline().hdel(JOBS_KEY, task_id).hdel(PROGRESS_KEY, task_id).execute()
+    except Exception as e:
+        print("[Queue Stats Error]", e)
+
+def _load_jobs(r, now):
+    """{ task_id: job } of unfinished registrations, each with its "remaining" LLM calls."""
+    progress = r.hgetall(PROGRESS_KEY)
+    jobs = {}
+    stale = []
+    for task_id, raw in r.hgetall(JOBS_KEY).items():
+        job = json.loads(raw)
+        if now - job["enqueued_at"] > job_ttl:
+            stale.append(task_id)
+            continue
+        job["remaining"] = max(job["llm_calls"] - int(progress.get(task_id, 0)), 0)
+        jobs[task_id.decode()] = job
+    if stale:
+        r.pipeline().hdel(JOBS_KEY, *stale).hdel(PROGRESS_KEY, *stale).execute()
+    return jobs
+
+def _task_seconds(llm_calls, file_seconds, rpm):
+    # Summaries are paced at one key's (or the key pool's) requests per minute
+    pacing = max(llm_calls - 1, 0) // rpm * 60
+    return max(llm_calls * file_seconds, pacing)
+
+def queue_depths():
+    """({ queue: waiting messages }, messages reserved by workers), or ({}, None) without a Redis broker."""
+    client = _broker_client()
+    if client is None:
+        return {}, None
+    try:
+        pipe = client.pipeline()
+        for queue in queues:
+            pipe.llen(queue)
+        pipe.hlen("unacked")  # kombu's reserved-but-unacknowledged messages
+        *lengths, reserved = pipe.execute()
+        return dict(zip(queues, lengths)), reserved
+    except Exception as e:
+        print("[Queue Stats Error]", e)
+        return {}, None
+
+def snapshot():
+    """Queue depth, in-flight tasks, remaining work and the time to drain the backlog."""
+    now = time.time()
+    jobs = _load_jobs(get_redis(), now)
+    file_seconds = phase_seconds("summarize_file", default_file_seconds)
+    rpm = pool_rpm()
+    in_flight = sum(1 for job in jobs.values() if job["started_at"])
+    slots = max(worker_slots, in_flight)
+    remaining_seconds = sum(_task_seconds(job["remaining"], file_seconds, rpm) for job in jobs.values())
+    breaker_wait = circuit_cooldown()
+    depths, reserved = queue_depths()
+
+    return {
+        "queues": depths,
+        "reserved": reserved,
+        "in_flight": in_flight,
+        "waiting": len(jobs) - in_flight,
+        "remaining_files": sum(job["remaining"] for job in jobs.values()),
+        "remaining_work_seconds": int(remaining_seconds),
+        "drain_seconds": int(remaining_seconds / slots + breaker_wait),
+        "per_file_seconds": round(file_seconds, 2),
+        "fetch_seconds": round(phase_seconds("fetch", 0.0), 2),
+        "worker_slots": slots,
+        "rate_limit": {"requests_per_minute": rpm, "circuit_open_seconds": breaker_wait}
+    }
+
+def task_eta(task_id):
+    """{ tasks_ahead, eta_seconds } for a registered unfinished task, or None."""
+    now = time.time()
+    jobs = _load_jobs(get_redis(), now)
+    job = jobs.get(task_id)
+    if job is None:
+        return None
+
+    file_seconds = phase_seconds("summarize_file", default_file_seconds)
+    rpm = pool_rpm()
+    eta = _task_seconds(job["remaining"], file_seconds, rpm)
+    ahead = []
+    if not job["started_at"]:
+        # Running tasks and everything enqueued earlier go first (queues share the workers)
+        ahead = [
+            other for other_id, other in jobs.items()
+            if other_id != task_id and (other["started_at"] or other["enqueued_at"] < job["enqueued_at"])
+        ]
+        in_flight = sum(1 for other in jobs.values() if other["started_at"])
+        wait = sum(_task_seconds(other["remaining"], file_seconds, rpm) for other in ahead) / max(worker_slots, in_flight)
+        eta += max(wait, job["not_before"] - now)
+
+    return {"tasks_ahead": len(ahead), "eta_seconds": int(eta + circuit_cooldown())}
+
+def prometheus_text(stats):
+    """The snapshot in the Prometheus text exposition format."""
+    lines = [
+        "# HELP prct_queue_depth Messages waiting in a Celery queue.",
+        "# TYPE prct_queue_depth gauge"
+    ]
+    lines += [f'prct_queue_depth{{queue="{queue}"}} {depth}' for queue, depth in stats["queues"].items()]
+    for name, help_text in (
+        ("in_flight", "Analyses currently running."),
+        ("waiting", "Registered analyses waiting to run."),
+        ("remaining_files", "Files still to be summarized by registered analyses."),
+        ("remaining_work_seconds", "Estimated summarization work left, in worker seconds."),
+        ("drain_seconds", "Estimated time until the backlog is processed."),
+        ("per_file_seconds", "Moving average of the wall time per summarized file.")
+    ):
+        lines += [f"# HELP prct_{name} {help_text}", f"# TYPE prct_{name} gauge", f"prct_{name} {stats[name]}"]
+    return "\n".join(lines) + "\n"
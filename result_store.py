@@ -0,0 +1,96 @@
+"""
+Compact task results: summaries and metadata stay in the Celery result, the raw
+added/removed lines of every file are stored separately in Redis (one hash
+field per file, msgpack + zstd) and loaded only when the UI asks for them.
+"""
+import os
+import json
+import zlib
+from utils.redis_client import get_redis
+
+try:
+    import msgpack
+except ImportError:  # optional: fall back to JSON
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional: fall back to zlib
+    zstandard = None
+
+# Celery result expiry (seconds); raw lines live as long as the result by default
+result_expires = int(os.getenv("RESULT_EXPIRES", "86400"))
+result_lines_ttl = int(os.getenv("RESULT_LINES_TTL", str(result_expires)))
+
+# Header byte of every stored value, so readers decode whatever the writer had installed
+_MSGPACK = 1
+_ZSTD = 2
+
+def _key(task_id):
+    return f"result_lines:{task_id}"
+
+def _pack(value):
+    flags = 0
+    if msgpack:
+        data = msgpack.packb(value)
+        flags |= _MSGPACK
+    else:
+        data = json.dumps(value).encode()
+    if zstandard:
+        data = zstandard.ZstdCompressor(level=3).compress(data)
+        flags |= _ZSTD
+    else:
+        data = zlib.compress(data, 6)
+    return bytes([flags]) + data
+
+def _unpack(blob):
+    flags, data = blob[0], blob[1:]
+    data = zstandard.ZstdDecompressor().decompress(data) if flags & _ZSTD else zlib.decompress(data)
+    return msgpack.unpackb(data) if flags & _MSGPACK else json.loads(data)
+
+def compact_result(task_id, grouped_data):
+    """
+    Move added_lines/removed_lines of every file out of `grouped_data` (in place)
+    into Redis, leaving added_count/removed_count and a `lines_ref` ("item:file")
+    for /task_lines. Files keep their lines inline if Redis is unavailable.
+    """
+    fields = {}
+    for i, item in enumerate(grouped_data):
+        for j, file_change in enumerate(item.get("files_changed", [])):
+            if "added_lines" not in file_change:
+                continue
+            ref = f"{i}:{j}"
+            fields[ref] = _pack([file_change["added_lines"], file_change["removed_lines"]])
+    if not fields:
+        return grouped_data
+
+    try:
+        pipe = get_redis().pipeline()
+        pipe.delete(_key(task_id))
+        pipe.hset(_key(task_id), mapping=fields)
+        pipe.expire(_key(task_id), result_lines_ttl)
+        pipe.execute()
+    except Exception as e:
+        print("[Result Lines Save Error]", e)
+        return grouped_data
+
+    for i, item in enumerate(grouped_data):
+        for j, file_change in enumerate(item.get("files_changed", [])):
+            if "added_lines" not in file_change:
+                continue
+            file_change["added_count"] = len(file_change.pop("added_lines"))
+            file_change["removed_count"] = len(file_change.pop("removed_lines"))
+            file_change["lines_ref"] = f"{i}:{j}"
+    return grouped_data
+
+def load_lines(task_id, ref):
+    """Return {added_lines, removed_lines} of one file, or None if expired or unknown."""
+    try:
+        blob = get_redis().hget(_key(task_id), ref)
+    except Exception as e:
+        print("[Result Lines Load Error]", e)
+        return None
+    if blob is None:
+        return None
+    added_lines, removed_lines = _unpack(blob)
+    return {"added_lines": added_lines, "removed_lines": removed_lines}
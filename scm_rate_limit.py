@@ -0,0 +1,172 @@
+"""
+Per-token scheduling of SCM API requests (GitHub, GitLab, Bitbucket, Azure DevOps).
+
+Every response updates the token's remaining budget and reset time in Redis
+from the rate-limit headers, so all web and worker processes share it. Once
+less than `pace_fraction` of the budget is left, requests are spaced to spread
+the rest until the reset. A 429 (or a 403 secondary/abuse limit) blocks the
+token for the announced delay and the request is retried after it. Waits longer
+than `max_wait` raise ScmRateLimitError instead, so the caller can report when
+to try again rather than failing halfway through a fetch.
+"""
+import os
+import time
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from utils.redis_client import get_redis
+from task_profiler import phase
+
+pace_fraction = float(os.getenv("SCM_PACE_FRACTION", "0.2"))  # share of the budget below which requests are paced
+max_wait = float(os.getenv("SCM_MAX_WAIT_SECONDS", "60"))     # longest single wait before giving up
+max_retries = int(os.getenv("SCM_RATE_LIMIT_RETRIES", "3"))   # retries of a throttled request
+default_backoff = 60  # throttled without a Retry-After or reset header (Bitbucket)
+
+_platform_hosts = {
+    "api.github.com": "github",
+    "gitlab.com": "gitlab",
+    "api.bitbucket.org": "bitbucket",
+    "dev.azure.com": "azdevops"
+}
+
+class ScmRateLimitError(Exception):
+    def __init__(self, platform, retry_after):
+        self.platform = platform
+        self.retry_after = int(retry_after) + 1
+        super().__init__(f"{platform} API rate limit reached for this token. Try again in {self.retry_after} seconds.")
+
+def bucket_for(url, kwargs):
+    """Rate-limit bucket of a request: "<platform>:<token hash>" (platforms limit per token)."""
+    host = urlparse(url).netloc.lower()
+    headers = kwargs.get("headers") or {}
+    auth = kwargs.get("auth")
+    credential = headers.get("Authorization") or headers.get("PRIVATE-TOKEN") or ""
+    if auth is not None:
+        credential = f"{getattr(auth, 'username', '')}:{getattr(auth, 'password', '')}"
+    token_hash = hashlib.sha256(credential.encode()).hexdigest()[:16] if credential else "anonymous"
+    return f"{_platform_hosts.get(host, host)}:{token_hash}"
+
+def _key(bucket, name):
+    return f"scm:rate:{bucket}:{name}"
+
+def _header(headers, *names):
+    for name in names:
+        if headers.get(name) not in (None, ""):
+            return headers[name]
+    return None
+
+def _retry_after(value, now):
+    """Seconds from a Retry-After header (delay or HTTP date)."""
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return parsedate_to_datetime(value).timestamp() - now
+        except (TypeError, ValueError):
+            return None
+
+def _reset_at(value, now):
+    # Epoch seconds (GitHub, GitLab, Azure), or seconds from now on some servers
+    reset = float(value)
+    return reset if reset > 1e9 else now + reset
+
+def _sleep(seconds, stats):
+    with phase("sleep", "scm rate limit"):
+        time.sleep(seconds)
+    with _stats_lock:
+        if stats is not None:
+            stats["throttled_seconds"] = round(stats["throttled_seconds"] + seconds, 2)
+
+def wait_turn(bucket):
+    """Block until the token may send the next request (raises ScmRateLimitError for long waits)."""
+    platform = bucket.split(":")[0]
+    stats = _stats.get()
+    try:
+        r = get_redis()
+        blocked = r.pttl(_key(bucket, "blocked")) / 1000
+        if blocked > 0:
+            if blocked > max_wait:
+                raise ScmRateLimitError(platform, blocked)
+            _sleep(blocked, stats)
+
+        budget = r.hgetall(_key(bucket, "budget"))
+        if not budget:
+            return
+        remaining = int(budget[b"remaining"])
+        limit = int(budget[b"limit"] or 0)
+        until_reset = float(budget[b"reset"]) - time.time()
+        # Without an announced limit, only an exhausted budget is spread (i.e. waited out)
+        if until_reset <= 0 or remaining > limit * pace_fraction:
+            return
+        interval = until_reset / max(remaining, 1)
+        if interval > max_wait:
+            raise ScmRateLimitError(platform, until_reset)
+
+        # One request per interval across all processes: whoever sets the slot goes next
+        while not r.set(_key(bucket, "slot"), 1, nx=True, px=max(int(interval * 1000), 1)):
+            _sleep(max(r.pttl(_key(bucket, "slot")), 1) / 1000, stats)
+    except ScmRateLimitError:
+        raise
+    except Exception as e:
+        print("[SCM Rate Limit Error]", e)
+
+def observe(bucket, resp):
+    """
+    Record the budget announced by a response. Returns the seconds to wait
+    before retrying when the response is a rate-limit rejection, else None.
+    """
+    now = time.time()
+    headers = resp.headers
+    remaining = _header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+    reset = _header(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+    limit = _header(headers, "X-RateLimit-Limit", "RateLimit-Limit")
+    retry_after = _header(headers, "Retry-After")
+
+    wait = None
+    throttled = resp.status_code == 429 or (
+        resp.status_code == 403 and (retry_after is not None or remaining == "0")
+    )
+    if throttled:
+        if retry_after is not None:
+            wait = _retry_after(retry_after, now)
+        elif reset is not None:
+            wait = _reset_at(reset, now) - now
+        wait = max(wait if wait is not None else default_backoff, 1)
+
+    try:
+        r = get_redis()
+        if remaining is not None and reset is not None:
+            reset_at = _reset_at(reset, now)
+            pipe = r.pipeline()
+            pipe.hset(_key(bucket, "budget"), mapping={"remaining": int(remaining), "limit": limit or 0, "reset": reset_at})
+            pipe.expireat(_key(bucket, "budget"), int(reset_at) + 60)
+            pipe.execute()
+        if wait is not None:
+            print(f"[SCM Rate Limit] {bucket.split(':')[0]} throttled ({resp.status_code}), waiting {int(wait)}s")
+            r.set(_key(bucket, "blocked"), 1, px=int(wait * 1000))
+    except Exception as e:
+        print("[SCM Rate Limit Error]", e)
+    return wait
+
+# API calls of the current fetch (see track_calls)
+_stats = contextvars.ContextVar("scm_api_stats", default=None)
+_stats_lock = threading.Lock()
+
+@contextmanager
+def track_calls():
+    """Count the API requests made inside the block: yields { calls, throttled_seconds }."""
+    stats = {"calls": 0, "throttled_seconds": 0.0}
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+def count_call():
+    stats = _stats.get()
+    if stats is not None:
+        with _stats_lock:
+            stats["calls"] += 1
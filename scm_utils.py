@@ -1,15 +1,95 @@
 import requests
 import re
+import os
+import io
 import json
+import difflib
+import zipfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from requests.auth import HTTPBasicAuth
-
-def get_github_pr_data(parsed, token):
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse, unquote
+import diff_store
+from path_filter import path_matches
+from scm_rate_limit import ScmRateLimitError, bucket_for, wait_turn, observe, track_calls, count_call, max_retries
+
+# Azure DevOps content fetch tuning
+azure_fetch_concurrency = int(os.getenv("AZURE_FETCH_CONCURRENCY", "8"))
+azure_blob_batch_size = int(os.getenv("AZURE_BLOB_BATCH_SIZE", "100"))
+azure_max_blob_bytes = int(os.getenv("AZURE_MAX_BLOB_BYTES", str(1024 * 1024)))
+
+# "api" (REST calls per commit) or "git" (local bare mirrors, see git_mirror.py)
+fetch_backend = os.getenv("SCM_FETCH_BACKEND", "api").lower()
+
+# One pooled session per process: keep-alive connections are reused across
+# requests, PRs and threads (batch analyses fetch several PRs in parallel).
+scm_pool_size = int(os.getenv("SCM_POOL_SIZE", "16"))
+# Most paths passed to Bitbucket's diff endpoint; larger scopes download whole diffs
+bitbucket_max_diff_paths = int(os.getenv("BITBUCKET_MAX_DIFF_PATHS", "50"))
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=scm_pool_size))
+
+def _request(method, url, **kwargs):
+    """Send a request once the token's rate limit allows it, retrying throttled ones (see scm_rate_limit.py)."""
+    bucket = bucket_for(url, kwargs)
+    for _ in range(max_retries + 1):
+        wait_turn(bucket)
+        resp = session.request(method, url, **kwargs)
+        count_call()
+        retry_after = observe(bucket, resp)
+        if retry_after is None:
+            return resp
+    raise ScmRateLimitError(bucket.split(":")[0], retry_after)
+
+def _map_in_context(pool, fn, items):
+    """pool.map that keeps the caller's context (the API call count) in the worker threads."""
+    return [f.result() for f in [pool.submit(contextvars.copy_context().run, fn, item) for item in items]]
+
+def _stored_commit(repo_key, sha, message):
+    """Commit served from the on-disk diff store (no diff download), or None."""
+    files_changed = diff_store.get(repo_key, sha)
+    if files_changed is None:
+        return None
+    return {"sha": sha, "message": message, "repo": repo_key, "files_changed": files_changed}
+
+def _any_in_scope(path_filter, paths):
+    """False when a PR-level file listing proves no changed file is in scope."""
+    return path_filter is None or paths is None or any(path_matches(path_filter, p) for p in paths)
+
+def _github_pr_files(repo, pr_number, headers):
+    """Paths changed by a PR (old and new names), or None if the listing failed."""
+    paths = []
+    page = 1
+    while True:
+        resp = _request(
+            "GET", f"https://api.github.com/repos/{repo}/pulls/{pr_number}/files",
+            headers=headers, params={"per_page": 100, "page": page}
+        )
+        if resp.status_code != 200:
+            return None
+        files = resp.json()
+        for f in files:
+            paths.append(f["filename"])
+            if f.get("previous_filename"):
+                paths.append(f["previous_filename"])
+        if len(files) < 100:
+            return paths
+        page += 1
+
+def get_github_pr_data(parsed, token, diff_cache=None, path_filter=None):
     """
     Fetch PR or compare data from GitHub depending on the parsed input.
     parsed: dict with keys:
       - type: "pr" or "compare"
       - repo: "owner/repo"
       - pr_number OR base/head depending on type
+    diff_cache: optional dict shared across fetches; commit diffs are looked
+      up by SHA before downloading and stored after (see fetch_pr_data)
+    path_filter: commit diffs are skipped when the PR's file listing has no
+      file in scope. Otherwise they are downloaded in full and filtered when
+      parsed: GitHub can't narrow a commit diff to some paths, and a commit's
+      file list comes with all of its patches.
     """
     headers = {
         "Authorization": f"token {token}",
@@ -22,17 +102,18 @@ def get_github_pr_data(parsed, token):
 
         # Fetch PR metadata
         parsed = f"https://api.github.com/repos/{repo}/pulls/{pr_number}"
-        pr_resp = requests.get(parsed, headers=headers)
+        pr_resp = _request("GET", parsed, headers=headers)
         if pr_resp.status_code != 200:
             return {"error": f"GitHub API Error: {pr_resp.status_code} - {pr_resp.text}"}
         pr_data = pr_resp.json()
 
         # Fetch commits
         commits_url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/commits"
-        commits_resp = requests.get(commits_url, headers=headers)
+        commits_resp = _request("GET", commits_url, headers=headers)
         if commits_resp.status_code != 200:
             return {"error": f"GitHub API Error: {commits_resp.status_code} - {commits_resp.text}"}
         commits_data = commits_resp.json()
+        changed_paths = _github_pr_files(repo, pr_number, headers) if path_filter else None
 
     elif parsed["type"] == "compare":
         repo = parsed["repo"]
@@ -40,31 +121,53 @@ def get_github_pr_data(parsed, token):
         head = parsed["head"]
 
         compare_url = f"https://api.github.com/repos/{repo}/compare/{base}...{head}"
-        compare_resp = requests.get(compare_url, headers=headers)
+        compare_resp = _request("GET", compare_url, headers=headers)
         if compare_resp.status_code != 200:
             return {"error": f"GitHub API Error: {compare_resp.status_code} - {compare_resp.text}"}
         compare_data = compare_resp.json()
         commits_data = compare_data.get("commits", [])
+        # The compare response lists at most 300 files
+        files = compare_data.get("files", [])
+        changed_paths = [f["filename"] for f in files] if len(files) < 300 else None
         pr_data = {
             "title": f"Comparison {base}...{head}",
             "user": {"login": None},
-            "state": "compared"
+            "state": "compared",
+            "head": {"sha": commits_data[-1]["sha"] if commits_data else None}
         }
 
     else:
         return {"error": "Unsupported type in parsed data"}
 
     # Collect commit diffs
+    repo_key = f"github:{repo}"
+    in_scope = _any_in_scope(path_filter, changed_paths)
     commits = []
     for commit in commits_data:
         sha = commit["sha"]
         msg = commit["commit"]["message"]
-        diff_url = f"https://api.github.com/repos/{repo}/commits/{sha}"
-        diff_resp = requests.get(diff_url, headers={**headers, "Accept": "application/vnd.github.v3.diff"}).text
+        if not in_scope:
+            commits.append({"sha": sha, "message": msg, "repo": repo_key, "diff": "", "partial": True})
+            continue
+        if diff_cache is not None and sha in diff_cache:
+            diff_resp = diff_cache[sha]
+        else:
+            stored = _stored_commit(repo_key, sha, msg)
+            if stored is not None:
+                commits.append(stored)
+                continue
+            diff_url = f"https://api.github.com/repos/{repo}/commits/{sha}"
+            resp = _request("GET", diff_url, headers={**headers, "Accept": "application/vnd.github.v3.diff"})
+            if resp.status_code != 200:
+                return {"error": f"GitHub API Error: {resp.status_code} - failed to fetch diff for commit {sha}"}
+            diff_resp = resp.text
+            if diff_cache is not None:
+                diff_cache[sha] = diff_resp
 
         commits.append({
             "sha": sha,
             "message": msg,
+            "repo": repo_key,
             "diff": diff_resp
         })
 
@@ -72,10 +175,11 @@ def get_github_pr_data(parsed, token):
         "title": pr_data.get("title"),
         "author": pr_data.get("user", {}).get("login"),
         "state": pr_data.get("state"),
+        "head_sha": (pr_data.get("head") or {}).get("sha"),
         "commits": commits
     }
 
-def get_gitlab_pr_data(parsed, token):
+def get_gitlab_pr_data(parsed, token, diff_cache=None, path_filter=None):
     """
     Fetch MR data from GitLab based on a merge request URL.
     Returns:
@@ -87,6 +191,7 @@ def get_gitlab_pr_data(parsed, token):
                 { sha, message, diff }
             ]
         }
+    Files outside `path_filter` are left out of the combined commit diffs.
     """
     # Extract project path and MR IID
     match = re.search(r"gitlab\.com/([^/]+(?:/[^/]+)*)/-/merge_requests/(\d+)", parsed["url"])
@@ -103,28 +208,38 @@ def get_gitlab_pr_data(parsed, token):
     }
 
     # Step 1: Get project ID
-    project_resp = requests.get(f"{base_url}/projects/{encoded_project_path}", headers=headers)
+    project_resp = _request("GET", f"{base_url}/projects/{encoded_project_path}", headers=headers)
     if project_resp.status_code != 200:
         return {"error": f"Failed to get project: {project_resp.status_code} - {project_resp.text}"}
     project_id = project_resp.json()['id']
 
     # Step 2: Get MR details
-    mr_resp = requests.get(f"{base_url}/projects/{project_id}/merge_requests/{mr_iid}", headers=headers)
+    mr_resp = _request("GET", f"{base_url}/projects/{project_id}/merge_requests/{mr_iid}", headers=headers)
     if mr_resp.status_code != 200:
         return {"error": f"Failed to get MR: {mr_resp.status_code} - {mr_resp.text}"}
     mr_data = mr_resp.json()
 
     # Step 3: Get commits
-    commits_resp = requests.get(f"{base_url}/projects/{project_id}/merge_requests/{mr_iid}/commits", headers=headers)
+    commits_resp = _request("GET", f"{base_url}/projects/{project_id}/merge_requests/{mr_iid}/commits", headers=headers)
     if commits_resp.status_code != 200:
         return {"error": f"Failed to get commits: {commits_resp.status_code} - {commits_resp.text}"}
+    repo_key = f"gitlab:{project_path}"
     commits = []
     for commit in commits_resp.json():
         sha = commit["id"]
         msg = commit["message"]
 
+        if diff_cache is not None and sha in diff_cache:
+            commits.append({"sha": sha, "message": msg, "repo": repo_key, "diff": diff_cache[sha], "partial": bool(path_filter)})
+            continue
+        stored = _stored_commit(repo_key, sha, msg)
+        if stored is not None:
+            commits.append(stored)
+            continue
+
         # Get raw diff for this commit (closest equivalent to GitHub diff URL)
-        diff_resp = requests.get(
+        diff_resp = _request(
+            "GET",
             f"{base_url}/projects/{project_id}/repository/commits/{sha}/diff",
             headers=headers
         )
@@ -132,25 +247,49 @@ def get_gitlab_pr_data(parsed, token):
             return {"error": f"Failed to get diff for commit {sha}"}
         
         # Merge diffs into one string (optional: you could keep per-file diffs too)
-        diffs = diff_resp.json()
+        diffs = [
+            d for d in diff_resp.json()
+            if path_matches(path_filter, d["new_path"]) or path_matches(path_filter, d["old_path"])
+        ]
         combined_diff = "\n\n".join([
             f"--- {d['old_path']}\n+++ {d['new_path']}\n{d['diff']}" for d in diffs
         ])
+        if diff_cache is not None:
+            diff_cache[sha] = combined_diff
 
         commits.append({
             "sha": sha,
             "message": msg,
-            "diff": combined_diff
+            "repo": repo_key,
+            "diff": combined_diff,
+            "partial": bool(path_filter)
         })
 
     return {
         "title": mr_data.get("title"),
         "author": mr_data.get("author", {}).get("username"),
         "state": mr_data.get("state"),
+        "head_sha": mr_data.get("sha"),
         "commits": commits
     }
 
-def get_bitbucket_pr_data(parsed, username, app_password):
+def _bitbucket_pr_files(base_url, auth):
+    """Paths changed by a PR according to its diffstat (old and new names), or None on errors."""
+    paths = []
+    url = f"{base_url}/diffstat"
+    while url:
+        resp = _request("GET", url, auth=auth)
+        if resp.status_code != 200:
+            return None
+        page = resp.json()
+        for entry in page.get("values", []):
+            for side in ("old", "new"):
+                if entry.get(side):
+                    paths.append(entry[side]["path"])
+        url = page.get("next")
+    return paths
+
+def get_bitbucket_pr_data(parsed, username, app_password, diff_cache=None, path_filter=None):
     """
     Fetch pull request data from Bitbucket Cloud.
     Returns:
@@ -162,6 +301,8 @@ def get_bitbucket_pr_data(parsed, username, app_password):
                 { sha, message, diff }
             ]
         }
+    With a `path_filter`, the PR diffstat picks the files in scope and commit
+    diffs are requested for those paths only.
     """
     # Parse URL
     match = re.search(r"bitbucket\.org/([^/]+)/([^/]+)/pull-requests/(\d+)", parsed["url"])
@@ -176,43 +317,149 @@ def get_bitbucket_pr_data(parsed, username, app_password):
     auth = HTTPBasicAuth(username, app_password)
 
     # Step 1: Get PR metadata
-    pr_resp = requests.get(base_url, auth=auth)
+    pr_resp = _request("GET", base_url, auth=auth)
     if pr_resp.status_code != 200:
         return {"error": f"Failed to fetch PR: {pr_resp.status_code} - {pr_resp.text}"}
     pr_data = pr_resp.json()
 
     # Step 2: Get list of commits
     commits_url = f"{base_url}/commits"
-    commits_resp = requests.get(commits_url, auth=auth)
+    commits_resp = _request("GET", commits_url, auth=auth)
     if commits_resp.status_code != 200:
         return {"error": f"Failed to fetch commits: {commits_resp.status_code} - {commits_resp.text}"}
     commits_data = commits_resp.json()
 
+    # Paths in scope, passed to the diff endpoint (None: download whole diffs)
+    scoped_paths = None
+    if path_filter:
+        changed_paths = _bitbucket_pr_files(base_url, auth)
+        if changed_paths is not None:
+            scoped_paths = sorted({p for p in changed_paths if path_matches(path_filter, p)})
+            if len(scoped_paths) > bitbucket_max_diff_paths:
+                scoped_paths = None
+
+    repo_key = f"bitbucket:{workspace}/{repo_slug}"
     commits = []
     for commit in commits_data.get("values", []):
         sha = commit["hash"]
         msg = commit["message"]
 
+        if scoped_paths == []:
+            commits.append({"sha": sha, "message": msg, "repo": repo_key, "diff": "", "partial": True})
+            continue
+        if diff_cache is not None and sha in diff_cache:
+            commits.append({"sha": sha, "message": msg, "repo": repo_key, "diff": diff_cache[sha], "partial": scoped_paths is not None})
+            continue
+        stored = _stored_commit(repo_key, sha, msg)
+        if stored is not None:
+            commits.append(stored)
+            continue
+
         # Step 3: Get diff for each commit
         diff_url = f"https://api.bitbucket.org/2.0/repositories/{workspace}/{repo_slug}/diff/{sha}"
-        diff_resp = requests.get(diff_url, auth=auth)
+        params = [("path", p) for p in scoped_paths] if scoped_paths else None
+        diff_resp = _request("GET", diff_url, auth=auth, params=params)
         if diff_resp.status_code != 200:
             return {"error": f"Failed to fetch diff for commit {sha}: {diff_resp.status_code}"}
+        if diff_cache is not None:
+            diff_cache[sha] = diff_resp.text
 
         commits.append({
             "sha": sha,
             "message": msg,
-            "diff": diff_resp.text
+            "repo": repo_key,
+            "diff": diff_resp.text,
+            "partial": scoped_paths is not None
         })
 
     return {
         "title": pr_data.get("title"),
         "author": pr_data.get("author", {}).get("nickname"),
         "state": pr_data.get("state"),
+        "head_sha": ((pr_data.get("source") or {}).get("commit") or {}).get("hash"),
         "commits": commits
     }
 
-def get_azure_devops_pr_data(parsed, token):
+def build_unified_diff(path, old_text, new_text, old_path=None):
+    """
+    Compute a git-style unified diff for one file from its two versions
+    (None means the file does not exist on that side).
+    """
+    old_path = old_path or path
+    header = [f"diff --git a/{old_path} b/{path}\n"]
+    if old_text is None:
+        header.append("new file mode 100644\n")
+    elif new_text is None:
+        header.append("deleted file mode 100644\n")
+
+    if (old_text is not None and "\0" in old_text) or (new_text is not None and "\0" in new_text):
+        return "".join(header) + f"Binary files a/{old_path} and b/{path} differ\n"
+
+    def split(text):
+        lines = (text or "").splitlines(keepends=True)
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        return lines
+
+    diff = difflib.unified_diff(
+        split(old_text), split(new_text),
+        fromfile="/dev/null" if old_text is None else f"a/{old_path}",
+        tofile="/dev/null" if new_text is None else f"b/{path}",
+        n=3
+    )
+    body = "".join(diff)
+    if not body:
+        return ""
+    return "".join(header) + body
+
+def _azure_fetch_blobs(repo_api, auth, object_ids):
+    """
+    Download blob contents in batches through the Azure DevOps blobs batch API
+    (one zip per chunk of ids), running the chunks concurrently.
+    Returns { objectId: text or None }.
+    """
+    object_ids = list(dict.fromkeys(object_ids))
+    chunks = [object_ids[i:i + azure_blob_batch_size] for i in range(0, len(object_ids), azure_blob_batch_size)]
+
+    def fetch_chunk(chunk):
+        contents = {}
+        resp = _request(
+            "POST",
+            f"{repo_api}/blobs?api-version=7.1",
+            auth=auth,
+            json=chunk,
+            headers={"Content-Type": "application/json", "Accept": "application/zip"}
+        )
+        if resp.status_code == 200:
+            with zipfile.ZipFile(io.BytesIO(resp.content)) as archive:
+                for name in archive.namelist():
+                    contents[name] = archive.read(name)
+        # Fall back to single-blob requests for anything the batch didn't return
+        for object_id in chunk:
+            if object_id not in contents:
+                single = _request("GET", f"{repo_api}/blobs/{object_id}?$format=octetstream&api-version=7.1", auth=auth)
+                contents[object_id] = single.content if single.status_code == 200 else None
+        return contents
+
+    blobs = {}
+    with ThreadPoolExecutor(max_workers=azure_fetch_concurrency) as pool:
+        for contents in _map_in_context(pool, fetch_chunk, chunks):
+            for object_id, data in contents.items():
+                if data is None or len(data) > azure_max_blob_bytes:
+                    blobs[object_id] = None
+                else:
+                    blobs[object_id] = data.decode("utf-8", errors="replace")
+    return blobs
+
+def get_azure_devops_pr_data(parsed, token, diff_cache=None, path_filter=None):
+    """
+    Fetch PR data from Azure DevOps. Azure has no per-commit diff endpoint, so
+    both versions of every changed file are downloaded with the blobs batch API
+    and the unified diff is computed locally.
+    Round trips: PR + commits + one changes call per commit (concurrent) + one
+    call per chunk of `azure_blob_batch_size` blobs (concurrent). Only blobs
+    of files within `path_filter` are downloaded.
+    """
     organization = parsed["organization"]
     project = parsed["project"]
     repo_name = parsed["repo"]
@@ -222,7 +469,7 @@ def get_azure_devops_pr_data(parsed, token):
     auth = HTTPBasicAuth('', token)
 
     pr_url = f'https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo_name}/pullrequests/{pr_id}?api-version=7.1-preview.1'
-    pr_resp = requests.get(pr_url, auth=auth, headers=headers)
+    pr_resp = _request("GET", pr_url, auth=auth, headers=headers)
 
     if pr_resp.status_code != 200:
         return {"error": f"Azure DevOps API Error: {pr_resp.status_code} - {pr_resp.text}"}
@@ -232,37 +479,261 @@ def get_azure_devops_pr_data(parsed, token):
         "title": pr_data.get("title"),
         "author": pr_data["createdBy"]["displayName"],
         "state": pr_data["status"],
+        "head_sha": (pr_data.get("lastMergeSourceCommit") or {}).get("commitId"),
         "commits": []
     }
 
     commits_url = f"https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo_name}/pullRequests/{pr_id}/commits?api-version=7.1-preview.1"
-    commits_resp = requests.get(commits_url, auth=auth, headers=headers)
+    commits_resp = _request("GET", commits_url, auth=auth, headers=headers)
     if commits_resp.status_code != 200:
         return {"error": f"Azure DevOps API Error: {commits_resp.status_code} - {commits_resp.text}"}
 
-    for commit in commits_resp.json().get("value", []):
+    repo_api = f"https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo_name}"
+
+    def fetch_changes(commit_id):
+        # Changes (file paths, change types and blob ids)
+        changes_url = f"{repo_api}/commits/{commit_id}/changes?api-version=7.1-preview.1"
+        changes_resp = _request("GET", changes_url, auth=auth, headers=headers)
+        if changes_resp.status_code != 200:
+            return []
+        return [
+            c for c in changes_resp.json().get("changes", [])
+            if not c["item"].get("isFolder") and path_matches(path_filter, c["item"]["path"])
+        ]
+
+    commits_data = commits_resp.json().get("value", [])
+    repo_key = f"azdevops:{organization}/{project}/{repo_name}"
+    # Commits already in the shared diff cache or the diff store need no further requests
+    stored = {}
+    for c in commits_data:
+        if diff_cache is None or c["commitId"] not in diff_cache:
+            commit_entry = _stored_commit(repo_key, c["commitId"], c["comment"])
+            if commit_entry is not None:
+                stored[c["commitId"]] = commit_entry
+    missing = [c["commitId"] for c in commits_data
+               if (diff_cache is None or c["commitId"] not in diff_cache) and c["commitId"] not in stored]
+    with ThreadPoolExecutor(max_workers=azure_fetch_concurrency) as pool:
+        changes_by_commit = dict(zip(missing, _map_in_context(pool, fetch_changes, missing)))
+
+    # Old and new blob of every change: edits need both, adds only the new, deletes only the old
+    def blob_ids(change):
+        item = change["item"]
+        change_type = change["changeType"].lower()
+        if "add" in change_type:
+            return None, item.get("objectId")
+        if "delete" in change_type:
+            return item.get("originalObjectId") or item.get("objectId"), None
+        return item.get("originalObjectId"), item.get("objectId")
+
+    wanted = [object_id for changes in changes_by_commit.values() for change in changes for object_id in blob_ids(change) if object_id]
+    blobs = _azure_fetch_blobs(repo_api, auth, wanted)
+
+    for commit in commits_data:
         commit_id = commit["commitId"]
-        commit_message = commit["comment"]
+        if commit_id in stored:
+            pr_info["commits"].append(stored[commit_id])
+            continue
+        if commit_id not in changes_by_commit:
+            pr_info["commits"].append({
+                "sha": commit_id, "message": commit["comment"], "repo": repo_key, **diff_cache[commit_id], "partial": bool(path_filter)
+            })
+            continue
 
-        # Changes (file paths and change types)
-        changes_url = f"https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo_name}/commits/{commit_id}/changes?api-version=7.1-preview.1"
-        changes_resp = requests.get(changes_url, auth=auth, headers=headers)
         file_changes = []
-        if changes_resp.status_code == 200:
-            changes_data = changes_resp.json()
-            for change in changes_data.get("changes", []):
-                file_changes.append({
-                    "file": change["item"]["path"],
-                    "change_type": change["changeType"]
-                })
-
+        diff_parts = []
+        for change in changes_by_commit[commit_id]:
+            path = change["item"]["path"].lstrip("/")
+            file_changes.append({
+                "file": change["item"]["path"],
+                "change_type": change["changeType"]
+            })
+            old_id, new_id = blob_ids(change)
+            if not (old_id or new_id) or any(blobs.get(i) is None for i in (old_id, new_id) if i):
+                continue  # content unavailable (too large or failed); only listed in "files"
+            old_path = (change.get("sourceServerItem") or change["item"]["path"]).lstrip("/")
+            diff_parts.append(build_unified_diff(
+                path,
+                blobs[old_id] if old_id else None,
+                blobs[new_id] if new_id else None,
+                old_path=old_path
+            ))
+
+        if diff_cache is not None:
+            diff_cache[commit_id] = {"files": file_changes, "diff": "".join(diff_parts)}
         pr_info["commits"].append({
             "sha": commit_id,
-            "message": commit_message,
+            "message": commit["comment"],
+            "repo": repo_key,
             "files": file_changes,
-            "diff": ""
+            "diff": "".join(diff_parts),
+            "partial": bool(path_filter)
         })
 
     return pr_info
 
+def parse_github_url(url):
+    """
+    Parses a GitHub Pull Request or Compare URL and returns a dict with type info.
+    """
+    url = url.strip()
+    pr_pattern = r"https://github\.com/([^/]+)/([^/]+)/pull/(\d+)"
+    compare_pattern = r"https://github\.com/([^/]+)/([^/]+)/compare/(.+)\.\.\.(.+)"
+
+    pr_match = re.match(pr_pattern, url)
+    if pr_match:
+        return {
+            "type": "pr",
+            "repo": f"{pr_match.group(1)}/{pr_match.group(2)}",
+            "pr_number": int(pr_match.group(3))
+        }
+
+    compare_match = re.match(compare_pattern, url)
+    if compare_match:
+        return {
+            "type": "compare",
+            "repo": f"{compare_match.group(1)}/{compare_match.group(2)}",
+            "base": compare_match.group(3),
+            "head": compare_match.group(4)
+        }
+
+    raise ValueError("Unsupported or invalid GitHub URL.")
+
+def parse_gitlab_url(url):
+    """
+    Parses a GitLab Merge Request (MR) URL and returns a dict with type info.
+    """
+    url = url.strip()
+    mr_pattern = r"https://gitlab\.com/([^/]+(?:/[^/]+)*)/-/merge_requests/(\d+)"
+
+    mr_match = re.match(mr_pattern, url)
+    print(mr_match)
+    if mr_match:
+        return {
+            "url": url,
+            "type": "mr",  # Merge Request in GitLab
+            "repo": mr_match.group(1),
+            "mr_id": int(mr_match.group(2))
+        }
+
+    raise ValueError("Unsupported or invalid GitLab Merge Request URL.")
 
+def parse_bitbucket_url(url):
+    """
+    Parses a Bitbucket Pull Request URL and returns a dict with type info.
+    """
+    url = url.strip()
+    pr_pattern = r"https://bitbucket\.org/([^/]+)/([^/]+)/pull-requests/(\d+)"
+
+    pr_match = re.match(pr_pattern, url)
+    print(url,pr_match)
+    if pr_match:
+        return {
+            "url": url,
+            "type": "pr",  # Pull Request in Bitbucket
+            "workspace": pr_match.group(1),
+            "repo": pr_match.group(2),
+            "pr_id": int(pr_match.group(3))
+        }
+
+    raise ValueError("Unsupported or invalid Bitbucket Pull Request URL.")
+
+def parse_azure_devops_url(url):
+    """
+    Parses an Azure DevOps Pull Request URL and returns a dict with type info.
+    Supports format:
+    https://dev.azure.com/{organization}/{project}/_git/{repo}/pullrequest/{pr_id}
+    or
+    https://dev.azure.com/{organization}/{project}/_apis/git/repositories/{repo}/pullRequests/{pr_id}
+    """
+    url = url.strip()
+    parsed = urlparse(url)
+    path = unquote(parsed.path)  # Decode any URL-encoded characters
+    path_parts = path.strip("/").split("/")
+
+    if "pullrequest" in path_parts:
+        try:
+            org = path_parts[0]
+            project = path_parts[1]
+            if "_apis" in path_parts:
+                repo = path_parts[5]
+                pr_id = path_parts[7]
+            else:
+                repo = path_parts[3]
+                pr_id = path_parts[5]
+
+            return {
+                "url": url,
+                "type": "pr",
+                "organization": org,
+                "project": project,
+                "repo": repo,
+                "pr_id": int(pr_id)
+            }
+        except (IndexError, ValueError):
+            raise ValueError("Malformed Azure DevOps PR URL structure.")
+
+    raise ValueError("Unsupported or invalid Azure DevOps PR URL.")
+
+SUPPORTED_PLATFORMS = ["github", "gitlab", "bitbucket", "azdevops"]
+
+_platform_hosts = {
+    "github.com": "github",
+    "gitlab.com": "gitlab",
+    "bitbucket.org": "bitbucket",
+    "dev.azure.com": "azdevops"
+}
+
+def detect_platform(url):
+    host = urlparse(url.strip()).netloc.lower()
+    return _platform_hosts.get(host)
+
+def parse_pr_url(platform, url):
+    """Parse a PR/MR/compare URL for the given platform. Raises ValueError if invalid."""
+    parsers = {
+        "github": parse_github_url,
+        "gitlab": parse_gitlab_url,
+        "bitbucket": parse_bitbucket_url,
+        "azdevops": parse_azure_devops_url
+    }
+    if platform not in parsers:
+        raise ValueError("Unsupported platform selected.")
+    return parsers[platform](url)
+
+def fetch_pr_data(platform, url, credentials, diff_cache=None, path_filter=None):
+    """
+    Parse the URL and fetch PR data with the matching fetcher.
+    credentials: dict with github_token, gitlab_token, bitbucket_username,
+      bitbucket_app_password and azdevops_token (only the platform's are needed)
+    path_filter: make_filter() result; fetchers skip out-of-scope downloads
+      where the platform allows it, the parser drops whatever is left over.
+      A diff_cache must only be shared between fetches with the same filter.
+    Returns the fetcher's result (which contains "error" on API failures, with
+    "retry_after" when the token's rate limit ran out) and its "api_stats".
+    """
+    with track_calls() as api_stats:
+        try:
+            pr_data = _fetch_pr_data(platform, url, credentials, diff_cache, path_filter)
+        except ScmRateLimitError as e:
+            pr_data = {"error": str(e), "retry_after": e.retry_after}
+    pr_data["api_stats"] = api_stats
+    print(f"[SCM] {platform} fetch: {api_stats['calls']} API calls, {api_stats['throttled_seconds']}s throttled")
+    return pr_data
+
+def _fetch_pr_data(platform, url, credentials, diff_cache, path_filter):
+    parsed = parse_pr_url(platform, url)
+    if fetch_backend == "git":
+        import git_mirror
+        try:
+            return git_mirror.fetch_pr_data(platform, parsed, credentials, diff_cache=diff_cache)
+        except git_mirror.GitMirrorError as e:
+            print(f"[Git Mirror] {e}; falling back to the {platform} API")
+    if platform == "github":
+        return get_github_pr_data(parsed, credentials.get("github_token"), diff_cache=diff_cache, path_filter=path_filter)
+    if platform == "gitlab":
+        return get_gitlab_pr_data(parsed, credentials.get("gitlab_token"), diff_cache=diff_cache, path_filter=path_filter)
+    if platform == "bitbucket":
+        return get_bitbucket_pr_data(
+            parsed, credentials.get("bitbucket_username"), credentials.get("bitbucket_app_password"),
+            diff_cache=diff_cache, path_filter=path_filter
+        )
+    return get_azure_devops_pr_data(parsed, credentials.get("azdevops_token"), diff_cache=diff_cache, path_filter=path_filter)
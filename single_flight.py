@@ -0,0 +1,106 @@
+"""
+Single-flight coalescing of identical analyses across all web processes.
+
+The first submission of a (platform, PR, head SHA, prompt) takes a lease in
+Redis holding its task id; later submissions attach to that task instead of
+enqueueing their own. The lease is long enough to cover the queue wait, the
+worker shortens it to a heartbeat once it runs and renews it with every
+summarized file, so a crashed worker can't block the PR for long. Failed
+tasks release it; successful ones let it expire (their result is reusable
+through the pre-warm index, see webhooks.py).
+"""
+import os
+from utils.redis_client import get_redis
+from webhooks import pr_key, prompt_hash
+
+# Held while the task waits in the queue
+queued_ttl = int(os.getenv("SINGLE_FLIGHT_QUEUED_SECONDS", "1800"))
+# Held while the task runs, renewed by every summarized file
+lease_ttl = int(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "120"))
+
+def flight_key(platform, url, head_sha, prompt_intro):
+    """Lease key of an analysis, or None when the PR head is unknown (no coalescing)."""
+    if not (platform and url and head_sha):
+        return None
+    return f"inflight:{pr_key(platform, url)}:{head_sha}:{prompt_hash(prompt_intro)}"
+
+def _compare_and_set(key, expected, value, ttl=None):
+    """Atomically replace the holder `expected` by `value` (None deletes); False if someone else holds it."""
+    from redis.exceptions import WatchError
+
+    with get_redis().pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            current = pipe.get(key)
+            if (current.decode() if current else None) != expected:
+                pipe.unwatch()
+                return False
+            pipe.multi()
+            if value is None:
+                pipe.delete(key)
+            else:
+                pipe.set(key, value, ex=ttl)
+            pipe.execute()
+            return True
+        except WatchError:
+            return False
+
+def claim(key, task_id, queued_for=None):
+    """
+    Take the lease for `task_id` (`queued_for`: seconds the task is held back
+    before it runs); returns None on success, else the task id holding it.
+    """
+    if key is None:
+        return None
+    ttl = queued_ttl + (queued_for or 0)
+    try:
+        r = get_redis()
+        for _ in range(2):  # the holder may expire between SET NX and GET
+            if r.set(key, task_id, nx=True, ex=ttl):
+                return None
+            holder = r.get(key)
+            if holder is not None:
+                return holder.decode()
+        return None
+    except Exception as e:
+        print("[Single Flight Error]", e)
+        return None
+
+def current_flight(key):
+    """Task id holding the lease, or None."""
+    if key is None:
+        return None
+    try:
+        holder = get_redis().get(key)
+        return holder.decode() if holder else None
+    except Exception as e:
+        print("[Single Flight Error]", e)
+        return None
+
+def take_over(key, stale_task_id, task_id):
+    """Replace a holder whose task failed; False if another submission got there first."""
+    try:
+        return _compare_and_set(key, stale_task_id, task_id, queued_ttl)
+    except Exception as e:
+        print("[Single Flight Error]", e)
+        return False
+
+def renew(key, task_id, ttl=None):
+    """Heartbeat from the running task: extend its lease (re-taking it if it expired)."""
+    if key is None:
+        return
+    try:
+        r = get_redis()
+        ttl = ttl or lease_ttl
+        if not r.set(key, task_id, nx=True, ex=ttl):
+            _compare_and_set(key, task_id, task_id, ttl)
+    except Exception as e:
+        print("[Single Flight Error]", e)
+
+def release(key, task_id):
+    if key is None:
+        return
+    try:
+        _compare_and_set(key, task_id, None)
+    except Exception as e:
+        print("[Single Flight Error]", e)
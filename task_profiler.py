@@ -0,0 +1,214 @@
+"""
+On-demand profiling of worker tasks.
+
+A profiled task run gets a sampling profiler (the stacks of all threads every
+PROFILE_INTERVAL_MS, so parsing and the summary threads show up alike) and a
+wall-clock timeline of its phases: fetch, parse, group, classify, every
+summarize call and every sleep. Both are stored in Redis under the task id, one
+entry per run (retries included), for the admin endpoints in app.py.
+
+Tasks are profiled when submitted with "profile": true, or sampled with
+PROFILE_SAMPLE_RATE (decided by task id, so every run of a task agrees).
+The timeline is process-wide: prefork workers run one task per process.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from utils.redis_client import get_redis
+
+sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+sample_interval = float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000
+max_stacks = int(os.getenv("PROFILE_MAX_STACKS", "2000"))   # distinct stacks kept per run
+profile_ttl = int(os.getenv("PROFILE_TTL", os.getenv("RESULT_EXPIRES", "86400")))
+index_size = 200  # profiles listed by /admin/profiles
+
+INDEX_KEY = "profile:index"
+
+def _key(task_id):
+    return f"profile:{task_id}"
+
+def is_sampled(task_id, requested=False):
+    if requested:
+        return True
+    if sample_rate <= 0:
+        return False
+    return int(hashlib.sha256(task_id.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF < sample_rate
+
+class _Timeline:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, name, started, seconds, detail=None):
+        event = {
+            "phase": name,
+            "start": round(started - self.started, 4),
+            "seconds": round(seconds, 4),
+            "thread": threading.current_thread().name
+        }
+        if detail:
+            event["detail"] = detail
+        with self._lock:
+            self.events.append(event)
+
+_timeline = None
+
+@contextmanager
+def _timed(name, detail):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timeline = _timeline
+        if timeline is not None:
+            timeline.add(name, started, time.monotonic() - started, detail)
+
+def phase(name, detail=None):
+    """Context manager timing one phase of the running task (a no-op unless it is profiled)."""
+    if _timeline is None:
+        return nullcontext()
+    return _timed(name, detail)
+
+class _Sampler(threading.Thread):
+    """Collects the folded stacks ("outer;...;inner" -> samples) of every other thread."""
+
+    def __init__(self, interval):
+        super().__init__(name="task-profiler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack[0].startswith("_worker (thread.py"):
+                    continue  # idle pool thread waiting for work
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+@contextmanager
+def profile_task(task_id, run=0, enabled=False, meta=None):
+    """Profile the enclosed task run and store the result under `task_id` (entry `run`)."""
+    global _timeline
+    if not enabled:
+        yield
+        return
+
+    _timeline = timeline = _Timeline()
+    sampler = _Sampler(sample_interval)
+    sampler.start()
+    wall_started = time.time()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        sampler.stop()
+        _timeline = None
+        save_profile(task_id, run, {
+            "task_id": task_id,
+            "run": run,
+            "started_at": wall_started,
+            "seconds": round(time.monotonic() - timeline.started, 3),
+            "outcome": error or "finished",
+            "interval_ms": sample_interval * 1000,
+            "samples": sampler.samples,
+            "stacks": dict(sampler.stacks.most_common(max_stacks)),
+            "timeline": timeline.events,
+            **(meta or {})
+        })
+
+def save_profile(task_id, run, profile):
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.hset(_key(task_id), str(run), zlib.compress(json.dumps(profile).encode()))
+        pipe.expire(_key(task_id), profile_ttl)
+        pipe.zadd(INDEX_KEY, {task_id: profile["started_at"]})
+        pipe.zremrangebyrank(INDEX_KEY, 0, -index_size - 1)
+        pipe.execute()
+        print(f"[Profiler] Stored profile of task {task_id} run {run}: {profile['samples']} samples, {len(profile['timeline'])} phases")
+    except Exception as e:
+        print("[Profiler Error]", e)
+
+def load_profile(task_id, run=None):
+    """Stored run of a task (the latest when `run` is None), or None."""
+    runs = get_redis().hgetall(_key(task_id))
+    if not runs:
+        return None
+    chosen = str(run) if run is not None else max(runs, key=int).decode()
+    data = runs.get(chosen.encode())
+    if data is None:
+        return None
+    profile = json.loads(zlib.decompress(data))
+    profile["runs"] = sorted(int(r) for r in runs)
+    return profile
+
+def list_profiles():
+    """[{ task_id, started_at }] of the most recently profiled tasks that are still stored."""
+    r = get_redis()
+    entries = r.zrevrange(INDEX_KEY, 0, -1, withscores=True)
+    pipe = r.pipeline()
+    for task_id, _ in entries:
+        pipe.exists(_key(task_id.decode()))
+    alive = pipe.execute()
+    return [{"task_id": task_id.decode(), "started_at": started} for (task_id, started), ok in zip(entries, alive) if ok]
+
+def folded_text(profile):
+    """Stacks in the folded format read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].items())
+
+def summary_text(profile, top=25):
+    """Plain-text flame graph summary: hottest functions and the phase timeline."""
+    total = sum(profile["stacks"].values()) or 1
+    own = Counter()
+    inclusive = Counter()
+    for stack, count in profile["stacks"].items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+
+    phases = {}
+    for event in profile["timeline"]:
+        stats = phases.setdefault(event["phase"], {"count": 0, "seconds": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["seconds"] += event["seconds"]
+        stats["max"] = max(stats["max"], event["seconds"])
+
+    lines = [
+        f"Task {profile['task_id']} run {profile['run']}: {profile['seconds']}s, {profile['outcome']}, "
+        f"{profile['samples']} samples every {profile['interval_ms']:g} ms",
+        "",
+        "Phases (count, total s, max s; concurrent phases overlap):"
+    ]
+    lines += [
+        f"  {name:<24} {stats['count']:>6} {stats['seconds']:>10.2f} {stats['max']:>8.2f}"
+        for name, stats in sorted(phases.items(), key=lambda p: -p[1]["seconds"])
+    ]
+    for title, counter in (("Self time", own), ("Total time", inclusive)):
+        lines += ["", f"{title} (% of thread samples):"]
+        lines += [f"  {count * 100 / total:6.1f}%  {frame}" for frame, count in counter.most_common(top)]
+    return "\n".join(lines) + "\n"
@@ -1,19 +1,90 @@
 from celery import Celery
-from celery_worker import celery
-from diff_parser import parse_diff_by_commit  # existing function
+from celery_worker import celery, capped_countdown
+from diff_parser import parse_diff_by_commit, SummarizationDeferred  # existing function
+from diff_parser import parse_commit_files, group_parsed_commits, summarize_grouped, change_digest, group_file_changes
+from checkpoint_store import load_checkpoint, save_checkpoint, clear_checkpoint, load_metrics, save_metrics, load_state, save_state
+from cost_estimator import estimate_analysis_cost, check_budget, record_usage, admit_deferred
+from model_router import TierMetrics
+from scm_utils import fetch_pr_data
+from result_store import compact_result
+from intent_extractor import intent_breakdown
+from diff_stats import build_report
+from path_filter import analysis_scope, path_matches
+from task_profiler import profile_task, is_sampled, phase
+from webhooks import record_analysis, lookup_analysis, is_latest_push, PREWARM_QUEUE
+from single_flight import flight_key, claim, renew, release, lease_ttl
+from queue_stats import register_task, mark_started, defer_task, track_progress, finish_task, record_phase
+from concurrent.futures import ThreadPoolExecutor
+import os
 import time
 
-@celery.task(bind=True)
+# Upper bound on quota/pacing reschedules for a single analysis
+max_reschedules = int(os.getenv("MAX_RESCHEDULES", "200"))
+
+# acks_late: a task lost with its worker (restart, OOM kill) is redelivered and
+# resumes from the per-file checkpoint instead of starting over.
+@celery.task(bind=True, max_retries=max_reschedules, acks_late=True, reject_on_worker_lost=True)
 def analyze_pr_task(self, pr_commits_and_metadata):
+    task_id = self.request.id
+    profiled = is_sampled(task_id, pr_commits_and_metadata.get("profile"))
+    # The PR was fetched by the web process; its fetch time is kept with the profile
+    with profile_task(task_id, self.request.retries, profiled, meta={"fetch_seconds": pr_commits_and_metadata.get("fetch_seconds")}):
+        return run_pr_analysis(self, pr_commits_and_metadata)
+
+def checkpoint_progress(task_id, flight=None):
+    """
+    on_summary callback: checkpoint the summary, count it towards the queue ETA
+    and renew the single-flight lease (the task's heartbeat).
+    """
+    def on_summary(digest, text):
+        save_checkpoint(task_id, digest, text)
+        track_progress(task_id)
+        renew(flight, task_id)
+    return on_summary
+
+def run_pr_analysis(task, pr_commits_and_metadata):
+    """Summarize one fetched PR inside `task` (shared by analyze_pr_task and prewarm_pr_task)."""
     try:
         pr_data = pr_commits_and_metadata["pr_data"]
         commits = pr_data["commits"]
         google_token = pr_commits_and_metadata.get("google_token")
         prompt_intro = pr_commits_and_metadata.get("prompt_intro")
+        mode = pr_commits_and_metadata.get("mode", "full")
+        task_id = task.request.id
+        flight = pr_commits_and_metadata.get("flight")
+        path_filter = pr_commits_and_metadata.get("path_filter")
+        mark_started(task_id)
+        renew(flight, task_id)
+        completed = load_checkpoint(task_id)
+        if completed:
+            print(f"[INFO] Resuming task {task_id} with {len(completed)} checkpointed files")
         #print("[DEBUG] Google token in Celery task:", google_token)
 
+        previous_metrics = load_metrics(task_id)
+        metrics = TierMetrics(previous_metrics)
+
+        # Deferred by the budget on submission: charged (or deferred again) only now
+        deferred = pr_commits_and_metadata.get("deferred_admission")
+        if deferred and mode == "full":
+            admission = admit_deferred(task_id, deferred["user_id"], deferred["estimate"])
+            if admission["decision"] == "reject":
+                raise Exception(admission["reason"])
+            if admission["decision"] == "defer":
+                raise SummarizationDeferred(admission["retry_after"], {})
+            if admission["decision"] == "downgrade":
+                mode = "stats"  # not worth sharing, like stats runs from /summarize
+                release(flight, task_id)
+                flight = None
+
         # Analyze diffs (with progress tracking)
-        grouped_data = parse_diff_by_commit(commits, self, google_token=google_token, prompt_intro=prompt_intro)
+        grouped_data = parse_diff_by_commit(
+            commits, task, google_token=google_token, prompt_intro=prompt_intro,
+            mode=mode, completed=completed,
+            on_summary=checkpoint_progress(task_id, flight),
+            metrics=metrics, path_filter=path_filter
+        )
+        metrics.publish(since=previous_metrics)
+        intents = intent_breakdown([c["message"] for c in commits])
 
         # Full summary (matches original code)
         summary = {
@@ -21,13 +92,295 @@ def analyze_pr_task(self, pr_commits_and_metadata):
                 "title": pr_data["title"],
                 "author": pr_data["author"],
                 "state": pr_data["state"],
-                "url": pr_commits_and_metadata.get("url", "-")
-            },
-            "commits": grouped_data
+                "url": pr_commits_and_metadata.get("url", "-"),
+                "mode": mode,
+                "path_filter": path_filter,
+                "scm_api": pr_data.get("api_stats"),
+                "llm_metrics": metrics.report(),
+                "intents": intents,
+                "prompt_tokens_saved": sum(item.get("prompt_tokens_saved", 0) for item in grouped_data)
+            }
         }
+        # Stats mode: structural report instead of AI summaries (needs the lines, so before compacting)
+        if mode == "stats":
+            summary["metadata"]["report"] = build_report(grouped_data, intents)
+        with phase("store_result"):
+            summary["commits"] = compact_result(task_id, grouped_data)
 
+        # Later /summarize calls on the same PR, head and prompt reuse complete results
+        if mode == "full" and not any(item.get("status") == "pending" for item in grouped_data):
+            record_analysis(
+                pr_commits_and_metadata.get("platform"), pr_commits_and_metadata.get("url"),
+                pr_commits_and_metadata.get("head_sha"), analysis_scope(prompt_intro, path_filter), task_id
+            )
+        clear_checkpoint(task_id)
+        finish_task(task_id)
         return summary
 
+    except SummarizationDeferred as e:
+        # Release the worker while waiting for the quota: finished files are in
+        # the checkpoint, so the re-enqueued task only summarizes the rest.
+        print(f"[INFO] {len(e.completed)} files done, task rescheduled in {e.retry_after}s")
+        metrics.publish(since=previous_metrics)
+        save_metrics(task_id, metrics.snapshot())
+        defer_task(task_id, e.retry_after)
+        renew(flight, task_id, ttl=e.retry_after + lease_ttl)
+        raise task.retry(countdown=capped_countdown(e.retry_after))
+
+    except Exception as e:
+        finish_task(task.request.id)
+        release(pr_commits_and_metadata.get("flight"), task.request.id)
+        task.update_state(state="FAILURE", meta={"exc": str(e)})
+        raise e
+
+@celery.task(bind=True, max_retries=max_reschedules, acks_late=True, reject_on_worker_lost=True)
+def prewarm_pr_task(self, job):
+    """
+    Background analysis enqueued by a PR webhook on the low-priority "prewarm" queue.
+    job: { platform, url, head_sha, user_id, credentials, google_token, prompt_intro, path_filter }
+    """
+    with profile_task(self.request.id, self.request.retries, is_sampled(self.request.id)):
+        return _prewarm(self, job)
+
+def _prewarm(self, job):
+    task_id = self.request.id
+    platform = job["platform"]
+    url = job["url"]
+    path_filter = job.get("path_filter")
+    scope = analysis_scope(job["prompt_intro"], path_filter)
+
+    # Fetching and admission happen once; quota reschedules reuse the saved state
+    state = load_state(task_id)
+    if state is None:
+        if not is_latest_push(platform, url, job["user_id"], job["head_sha"]):
+            print(f"[Prewarm] Skipping {url} at {job['head_sha'][:12]}: superseded by a newer push")
+            return {"skipped": "superseded by a newer push"}
+
+        fetch_started = time.monotonic()
+        with phase("fetch", url):
+            pr_data = fetch_pr_data(platform, url, job["credentials"], path_filter=path_filter)
+        record_phase("fetch", time.monotonic() - fetch_started)
+        if "retry_after" in pr_data:
+            print(f"[Prewarm] {pr_data['error']}")
+            raise self.retry(countdown=capped_countdown(pr_data["retry_after"]))
+        if "error" in pr_data:
+            print(f"[Prewarm] Fetch failed for {url}: {pr_data['error']}")
+            return {"skipped": pr_data["error"]}
+        if lookup_analysis(platform, url, pr_data.get("head_sha"), scope):
+            return {"skipped": "already analyzed"}
+
+        # Pre-warming is optional work: only run it when the budget allows it outright
+        estimate = estimate_analysis_cost(group_file_changes(pr_data["commits"], path_filter), job["prompt_intro"])
+        admission = check_budget(job["user_id"], estimate)
+        if admission["decision"] != "accept":
+            print(f"[Prewarm] Skipping {url}: {admission['reason']}")
+            return {"skipped": admission["reason"]}
+        # A user's /summarize (or another pre-warm) may already be running it
+        flight = flight_key(platform, url, pr_data.get("head_sha"), scope)
+        if claim(flight, task_id):
+            return {"skipped": "already running"}
+        record_usage(job["user_id"], estimate)
+        register_task(task_id, PREWARM_QUEUE, estimate, started=True)
+
+        state = {"pr_data": pr_data, "flight": flight}
+        save_state(task_id, state)
+
+    return run_pr_analysis(self, {
+        "pr_data": state["pr_data"],
+        "url": url,
+        "platform": platform,
+        "head_sha": state["pr_data"].get("head_sha"),
+        "google_token": job.get("google_token"),
+        "prompt_intro": job.get("prompt_intro"),
+        "mode": "full",
+        "flight": state.get("flight"),
+        "path_filter": path_filter
+    })
+
+
+# PRs fetched in parallel by a batch analysis (they share one HTTP session pool)
+batch_fetch_concurrency = int(os.getenv("BATCH_FETCH_CONCURRENCY", "4"))
+
+def build_batch(prs, fetched, path_filter=None):
+    """
+    Combine fetched PRs into one grouped analysis. Commits are deduplicated by
+    SHA and file changes by content digest (cherry-picks, stacked PRs), so each
+    distinct change is summarized once. Files outside `path_filter` are dropped.
+    Returns (combined grouped data, per-PR views, dedup stats).
+    """
+    files_by_sha = {}
+    entries = []
+    seen_changes = set()
+    stats = {"prs": len(prs), "commits": 0, "duplicate_commits": 0, "file_changes": 0, "duplicate_file_changes": 0}
+    views = []
+
+    for pr, pr_data in zip(prs, fetched):
+        if "error" in pr_data:
+            views.append({"metadata": {"url": pr["url"], "platform": pr["platform"]}, "error": pr_data["error"]})
+            continue
+
+        shas = []
+        for commit in pr_data["commits"]:
+            sha = commit["sha"]
+            shas.append(sha)
+            stats["commits"] += 1
+            if sha in files_by_sha:
+                stats["duplicate_commits"] += 1
+                continue
+
+            files_by_sha[sha] = [f for f in parse_commit_files(commit) if path_matches(path_filter, f["file_path"])]
+            unique_files = []
+            for file_change in files_by_sha[sha]:
+                stats["file_changes"] += 1
+                digest = change_digest(file_change)
+                if digest in seen_changes:
+                    stats["duplicate_file_changes"] += 1
+                    continue
+                seen_changes.add(digest)
+                unique_files.append(file_change)
+            entries.append({"message": commit["message"], "files_changed": unique_files})
+
+        views.append({
+            "metadata": {
+                "title": pr_data["title"],
+                "author": pr_data["author"],
+                "state": pr_data["state"],
+                "url": pr["url"],
+                "platform": pr["platform"],
+                "intents": intent_breakdown([c["message"] for c in pr_data["commits"]])
+            },
+            "commit_shas": shas,
+            "files": sorted({f["file_path"] for sha in shas for f in files_by_sha[sha]})
+        })
+
+    combined = group_parsed_commits(entries)
+    index_by_path = {item["files_changed"][0]["file_path"]: i for i, item in enumerate(combined)}
+    for view in views:
+        if "files" in view:
+            view["file_indexes"] = [index_by_path[path] for path in view["files"] if path in index_by_path]
+    return combined, views, stats
+
+@celery.task(bind=True, max_retries=max_reschedules, acks_late=True, reject_on_worker_lost=True)
+def analyze_batch_task(self, batch):
+    """
+    Analyze many PRs/compare ranges as one job.
+    batch: { prs: [{url, platform}], credentials, google_token, prompt_intro, path_filter, user_id, profile }
+    """
+    with profile_task(self.request.id, self.request.retries, is_sampled(self.request.id, batch.get("profile"))):
+        return _analyze_batch(self, batch)
+
+def _analyze_batch(self, batch):
+    metrics = None
+    previous_metrics = {}
+    try:
+        task_id = self.request.id
+        google_token = batch.get("google_token")
+        prompt_intro = batch.get("prompt_intro")
+
+        # Fetching and grouping happen once; reschedules reuse the saved state
+        state = load_state(task_id)
+        if state is None:
+            prs = batch["prs"]
+            diff_cache = {}
+            self.update_state(state='PROGRESS', meta={'current': 0, 'total': len(prs), 'status': f'Fetching {len(prs)} PRs'})
+
+            def fetch(pr):
+                try:
+                    with phase("fetch", pr["url"]):
+                        return fetch_pr_data(
+                            pr["platform"], pr["url"], batch["credentials"],
+                            diff_cache=diff_cache, path_filter=batch.get("path_filter")
+                        )
+                except Exception as e:
+                    return {"error": str(e)}
+
+            with ThreadPoolExecutor(max_workers=batch_fetch_concurrency) as pool:
+                fetched = list(pool.map(fetch, prs))
+
+            with phase("parse", f"{len(prs)} PRs"):
+                combined, views, stats = build_batch(prs, fetched, batch.get("path_filter"))
+            scm_api = {
+                "calls": sum(pr_data.get("api_stats", {}).get("calls", 0) for pr_data in fetched),
+                "throttled_seconds": sum(pr_data.get("api_stats", {}).get("throttled_seconds", 0) for pr_data in fetched)
+            }
+            print(f"[INFO] Batch {task_id}: {stats}")
+
+            # Same admission control as /summarize, applied once the diffs are known
+            estimate = estimate_analysis_cost(combined, prompt_intro)
+            admission = check_budget(batch.get("user_id"), estimate)
+            if admission["decision"] == "reject":
+                raise Exception(admission["reason"])
+            mode = "stats" if admission["decision"] == "downgrade" else "full"
+
+            state = {
+                "combined": combined, "views": views, "stats": stats, "mode": mode, "estimate": estimate,
+                "scm_api": scm_api, "deferred": admission["decision"] == "defer"
+            }
+            save_state(task_id, state)
+            register_task(task_id, "celery", estimate, started=True)
+            if state["deferred"]:
+                raise SummarizationDeferred(admission["retry_after"], {})
+            if mode == "full":
+                record_usage(batch.get("user_id"), estimate)
+        elif state.get("deferred") and state["mode"] == "full":
+            # Deferred by the budget: charged (or deferred again) once it is due
+            admission = admit_deferred(task_id, batch.get("user_id"), state["estimate"])
+            if admission["decision"] == "reject":
+                raise Exception(admission["reason"])
+            if admission["decision"] == "defer":
+                raise SummarizationDeferred(admission["retry_after"], {})
+            if admission["decision"] == "downgrade":
+                state["mode"] = "stats"
+                save_state(task_id, state)
+
+        mark_started(task_id)
+        completed = load_checkpoint(task_id)
+        previous_metrics = load_metrics(task_id)
+        metrics = TierMetrics(previous_metrics)
+
+        combined = summarize_grouped(
+            state["combined"], self, google_token=google_token, prompt_intro=prompt_intro,
+            mode=state["mode"], completed=completed,
+            on_summary=checkpoint_progress(task_id),
+            metrics=metrics
+        )
+        metrics.publish(since=previous_metrics)
+
+        result = {
+            "metadata": {
+                "title": f"Batch of {len(state['views'])} PRs",
+                "author": "-",
+                "state": "batch",
+                "url": "-",
+                "mode": state["mode"],
+                "path_filter": batch.get("path_filter"),
+                "llm_metrics": metrics.report(),
+                "dedup": state["stats"],
+                "scm_api": state.get("scm_api"),
+                "prompt_tokens_saved": sum(item.get("prompt_tokens_saved", 0) for item in combined),
+                "estimate": state["estimate"]
+            }
+        }
+        if state["mode"] == "stats":
+            messages = {m for item in combined for m in item["message"].split(" || ")}
+            result["metadata"]["report"] = build_report(combined, intent_breakdown(list(messages)))
+        with phase("store_result"):
+            result["commits"] = compact_result(task_id, combined)
+        result["prs"] = state["views"]
+
+        clear_checkpoint(task_id)
+        finish_task(task_id)
+        return result
+
+    except SummarizationDeferred as e:
+        print(f"[INFO] Batch {self.request.id} rescheduled in {e.retry_after}s")
+        if metrics:
+            metrics.publish(since=previous_metrics)
+            save_metrics(task_id, metrics.snapshot())
+        defer_task(self.request.id, e.retry_after)
+        raise self.retry(countdown=capped_countdown(e.retry_after))
+
     except Exception as e:
+        finish_task(self.request.id)
         self.update_state(state="FAILURE", meta={"exc": str(e)})
         raise e
@@ -0,0 +1,94 @@
+"""
+The git mirror fetch backend against throwaway local repositories
+(GIT_MIRROR_URL_TEMPLATE pointing at file:// URLs). Needs the git CLI.
+"""
+import shutil
+import subprocess
+
+import pytest
+
+import diff_store
+import git_mirror
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git CLI not installed")
+
+def git(cwd, *args):
+    return subprocess.run(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com", *args],
+        cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+def commit(repo, path, content, message):
+    (repo / path).write_text(content)
+    git(repo, "add", path)
+    git(repo, "commit", "--quiet", "-m", message)
+    return git(repo, "rev-parse", "HEAD")
+
+@pytest.fixture
+def origin(tmp_path, monkeypatch):
+    """Repository "origin" with main and a two-commit feature branch; mirrors go to tmp_path."""
+    repo = tmp_path / "origin"
+    repo.mkdir()
+    git(repo, "init", "--quiet", "-b", "main")
+    base = commit(repo, "a.txt", "one\ntwo\n", "Initial commit")
+    git(repo, "checkout", "--quiet", "-b", "feature")
+    commit(repo, "b.txt", "new file\n", "Add b")
+    commit(repo, "a.txt", "one\nchanged\n", "Change a")
+    git(repo, "checkout", "--quiet", "main")
+
+    monkeypatch.setattr(git_mirror, "mirror_dir", str(tmp_path / "mirrors"))
+    monkeypatch.setattr(git_mirror, "url_template", f"file://{tmp_path}/{{repo}}")
+    monkeypatch.setattr(diff_store, "store_enabled", False)
+    return repo, base
+
+def merged_pr(monkeypatch, base_sha):
+    """PR metadata as the platform reports it (the API call is the only part not served by git)."""
+    monkeypatch.setattr(git_mirror, "pr_refs", lambda platform, parsed, credentials: {
+        "title": "Feature", "author": "test", "state": "merged", "repo": "origin", "auth": (None, None),
+        "base": "refs/heads/main", "head": "refs/heads/feature", "base_sha": base_sha
+    })
+
+def test_compare_range_commits_and_diffs(origin):
+    repo, _ = origin
+    parsed = {"type": "compare", "repo": "origin", "base": "main", "head": "feature"}
+    pr_data = git_mirror.fetch_pr_data("github", parsed, {})
+
+    assert [c["message"] for c in pr_data["commits"]] == ["Add b", "Change a"]
+    assert pr_data["head_sha"] == git(repo, "rev-parse", "feature")
+    add_b, change_a = (c["diff"] for c in pr_data["commits"])
+    assert "diff --git a/b.txt b/b.txt" in add_b and "+new file" in add_b
+    assert "-two" in change_a and "+changed" in change_a and "b.txt" not in change_a
+
+def test_fetch_is_incremental_and_uses_the_diff_cache(origin):
+    repo, _ = origin
+    parsed = {"type": "compare", "repo": "origin", "base": "main", "head": "feature"}
+    diff_cache = {}
+    git_mirror.fetch_pr_data("github", parsed, {}, diff_cache=diff_cache)
+
+    git(repo, "checkout", "--quiet", "feature")
+    commit(repo, "c.txt", "third\n", "Add c")
+    cached_sha = next(iter(diff_cache))
+    diff_cache[cached_sha] = "cached diff"
+    pr_data = git_mirror.fetch_pr_data("github", parsed, {}, diff_cache=diff_cache)
+
+    assert [c["message"] for c in pr_data["commits"]] == ["Add b", "Change a", "Add c"]
+    assert next(c["diff"] for c in pr_data["commits"] if c["sha"] == cached_sha) == "cached diff"
+
+@pytest.mark.parametrize("merge", [["--no-ff", "-m", "Merge feature"], ["--ff-only"]])
+def test_merged_pr_starts_at_the_recorded_base(origin, monkeypatch, merge):
+    repo, base = origin
+    if merge[0] == "--no-ff":
+        commit(repo, "main.txt", "main\n", "Work on main")
+    git(repo, "merge", "--quiet", *merge, "feature")
+    merged_pr(monkeypatch, base[:12])  # Bitbucket reports abbreviated hashes
+
+    pr_data = git_mirror.fetch_pr_data("bitbucket", {}, {})
+
+    # target..head would be empty: the head is reachable from main after the merge
+    assert [c["message"] for c in pr_data["commits"]] == ["Add b", "Change a"]
+
+def test_unknown_recorded_base_falls_back(origin, monkeypatch):
+    merged_pr(monkeypatch, "0" * 40)
+
+    with pytest.raises(git_mirror.GitMirrorError):
+        git_mirror.fetch_pr_data("github", {}, {})
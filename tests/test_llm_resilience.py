@@ -0,0 +1,131 @@
+"""
+Hedged requests, timeouts and the circuit breaker against a stub Gemini server.
+
+The stub speaks the generateContent REST API on localhost; Redis (shared
+breaker state) is replaced by fakeredis. Run from the repository root:
+    pip install -r requirements-dev.txt
+    python -m pytest -q tests
+"""
+import importlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fakeredis
+import pytest
+
+# Short timeouts, a breaker that opens quickly and one summary at a time
+SETTINGS = {
+    "LLM_REQUEST_TIMEOUT": ("llm_client", "request_timeout", 2.0),
+    "LLM_HEDGE_MIN_DELAY": ("llm_client", "hedge_min_delay", 0.3),
+    "LLM_BREAKER_MIN_REQUESTS": ("llm_client", "breaker_min_requests", 3),
+    "LLM_BREAKER_ERROR_RATE": ("llm_client", "breaker_error_rate", 0.5),
+    "SUMMARY_CONCURRENCY": ("diff_parser", "summary_concurrency", 1),
+    "GEMINI_REQUESTS_PER_MINUTE": ("diff_parser", "requests_per_minute", 100000)
+}
+
+class StubGemini(BaseHTTPRequestHandler):
+    # Behaviors of the next requests ("ok", ("slow", seconds), ("error", status)); then `default`
+    script = []
+    default = "ok"
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with StubGemini.lock:
+            StubGemini.requests += 1
+            behavior = StubGemini.script.pop(0) if StubGemini.script else StubGemini.default
+        if isinstance(behavior, tuple) and behavior[0] == "slow":
+            time.sleep(behavior[1])
+        if isinstance(behavior, tuple) and behavior[0] == "error":
+            self._reply(behavior[1], {"error": {"message": "stub failure"}})
+            return
+        self._reply(200, {
+            "candidates": [{"content": {"parts": [{"text": "stub summary"}]}}],
+            "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 2}
+        })
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubGemini)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+
+@pytest.fixture
+def stub(server, monkeypatch):
+    api_base = f"http://127.0.0.1:{server.server_port}/v1beta"
+    monkeypatch.setenv("GEMINI_API_BASE", api_base)
+    for name, (_, _, value) in SETTINGS.items():
+        monkeypatch.setenv(name, str(value))
+    # Configuration is read at import time, so modules imported earlier get the values patched in
+    for module, attribute, value in SETTINGS.values():
+        monkeypatch.setattr(importlib.import_module(module), attribute, value)
+    import utils.redis_client as redis_client
+    import llm_client
+    import llm_providers
+
+    monkeypatch.setattr(llm_providers, "gemini_api_base", api_base)
+    monkeypatch.setattr(redis_client, "_client", fakeredis.FakeRedis())
+    llm_client._latencies.clear()
+    llm_client._hedge_times.clear()
+    StubGemini.script, StubGemini.default, StubGemini.requests = [], "ok", 0
+    return StubGemini
+
+def generate():
+    from llm_providers import get_provider
+    return get_provider("gemini").generate("prompt", model="stub-model", max_output_tokens=64, temperature=0, api_key="key", timeout=5)
+
+def test_hedged_request_answers_a_slow_call(stub):
+    from llm_client import call_with_hedging
+
+    stub.script = [("slow", 1.8), "ok"]
+    started = time.monotonic()
+    result = call_with_hedging(generate)
+
+    assert result["text"] == "stub summary"
+    assert stub.requests == 2
+    assert time.monotonic() - started < 1.5
+
+def test_timeout_raises_and_counts_as_failure(stub):
+    from llm_client import call_with_hedging, LLMTimeoutError
+    import utils.redis_client as redis_client
+
+    stub.default = ("slow", 3)
+    with pytest.raises(LLMTimeoutError):
+        call_with_hedging(generate, timeout=1)
+    assert int(redis_client.get_redis().get("llm:breaker:gemini:err")) == 1
+
+def test_failures_open_the_breaker_and_leave_files_pending(stub):
+    from diff_parser import group_file_changes, summarize_grouped, PENDING_SUMMARY
+    from llm_client import circuit_is_open
+
+    stub.default = ("error", 500)
+    diff = "".join(
+        f"diff --git a/src/f{i}.py b/src/f{i}.py\n--- a/src/f{i}.py\n+++ b/src/f{i}.py\n@@ -1,2 +1,2 @@\n-a\n+b\n c\n"
+        for i in range(5)
+    )
+    grouped = group_file_changes([{"sha": None, "message": "Change files", "diff": diff}])
+    checkpointed = []
+    summarize_grouped(grouped, google_token="key", on_summary=lambda digest, text: checkpointed.append(digest))
+
+    assert circuit_is_open()
+    assert stub.requests == 3  # later files are short-circuited
+    assert all(item["status"] == "pending" for item in grouped)
+    assert [item["summary"] for item in grouped][3:] == [PENDING_SUMMARY, PENDING_SUMMARY]
+    assert grouped[0]["summary"].startswith("Error generating summary:")
+    assert checkpointed == []
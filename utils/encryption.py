@@ -1,13 +1,29 @@
-from cryptography.fernet import Fernet
 import os
 from dotenv import load_dotenv
+from utils.cache import TTLCache
 
 load_dotenv()
 
-fernet = Fernet(os.environ["ENCRYPTION_KEY"].encode())
+_fernet = None
+
+# Plaintext of recently decrypted tokens, keyed by ciphertext. Updating a token
+# produces a new ciphertext, so stale entries are never returned, only aged out.
+_decrypted = TTLCache(int(os.getenv("TOKEN_CACHE_TTL", "300")))
+
+def get_fernet():
+    # cryptography is imported on first use to keep process startup fast
+    global _fernet
+    if _fernet is None:
+        from cryptography.fernet import Fernet
+        _fernet = Fernet(os.environ["ENCRYPTION_KEY"].encode())
+    return _fernet
 
 def encrypt_token(token: str) -> str:
-    return fernet.encrypt(token.encode()).decode()
+    return get_fernet().encrypt(token.encode()).decode()
 
 def decrypt_token(token: str) -> str:
-    return fernet.decrypt(token.encode()).decode()
\ No newline at end of file
+    plaintext = _decrypted.get(token)
+    if plaintext is None:
+        plaintext = get_fernet().decrypt(token.encode()).decode()
+        _decrypted.set(token, plaintext)
+    return plaintext
@@ -0,0 +1,14 @@
+import os
+
+# Shared Redis connection for budgets, checkpoints and other cross-process state.
+# Defaults to the Celery result backend so no extra service is needed.
+redis_url = os.getenv("REDIS_URL", os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0"))
+
+_client = None
+
+def get_redis():
+    global _client
+    if _client is None:
+        import redis
+        _client = redis.Redis.from_url(redis_url)
+    return _client
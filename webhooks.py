@@ -0,0 +1,139 @@
+"""
+Webhook-driven pre-warming: parse and verify pull request events from the
+supported platforms, debounce rapid pushes, and keep an index of finished
+analyses keyed by (platform, PR, head SHA, prompt) so /summarize can reuse them.
+"""
+import os
+import hmac
+import base64
+import hashlib
+from urllib.parse import urlparse
+from scm_utils import parse_pr_url
+from utils.redis_client import get_redis
+
+# Wait this long after the last push before analyzing; newer pushes restart the wait
+debounce_seconds = int(os.getenv("WEBHOOK_DEBOUNCE_SECONDS", "60"))
+# How long a precomputed analysis can be reused (matches the result expiry by default)
+index_ttl = int(os.getenv("PREWARM_INDEX_TTL", os.getenv("RESULT_EXPIRES", "86400")))
+
+PREWARM_QUEUE = "prewarm"
+
+def verify_signature(platform, headers, body, secret):
+    """Check the platform's signature (or shared token) for a raw request body."""
+    if not secret:
+        return False
+    if platform in ("github", "bitbucket"):
+        # GitHub: X-Hub-Signature-256, Bitbucket: X-Hub-Signature, both "sha256=<hmac>"
+        signature = headers.get("X-Hub-Signature-256") or headers.get("X-Hub-Signature") or ""
+        expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+    if platform == "gitlab":
+        return hmac.compare_digest(headers.get("X-Gitlab-Token", ""), secret)
+    if platform == "azdevops":
+        # Service hooks send the configured basic auth credentials; the password is the secret
+        auth = headers.get("Authorization", "")
+        if not auth.startswith("Basic "):
+            return False
+        try:
+            password = base64.b64decode(auth[6:]).decode().split(":", 1)[1]
+        except (ValueError, IndexError):
+            return False
+        return hmac.compare_digest(password, secret)
+    return False
+
+def parse_event(platform, headers, payload):
+    """
+    Return { repo, url, head_sha } for a PR opened/updated event, or None for
+    events that don't need an analysis. `repo` is the identifier used by
+    webhook subscriptions (owner/repo, group/project, workspace/repo, org/project/repo).
+    """
+    if platform == "github":
+        if headers.get("X-GitHub-Event") != "pull_request":
+            return None
+        if payload.get("action") not in ("opened", "synchronize", "reopened", "ready_for_review"):
+            return None
+        pr = payload["pull_request"]
+        return {"repo": payload["repository"]["full_name"], "url": pr["html_url"], "head_sha": pr["head"]["sha"]}
+
+    if platform == "gitlab":
+        if headers.get("X-Gitlab-Event") != "Merge Request Hook":
+            return None
+        attrs = payload.get("object_attributes", {})
+        # "update" events without oldrev are title/label edits, not pushes
+        if attrs.get("action") not in ("open", "reopen") and not (attrs.get("action") == "update" and attrs.get("oldrev")):
+            return None
+        return {"repo": payload["project"]["path_with_namespace"], "url": attrs["url"], "head_sha": attrs["last_commit"]["id"]}
+
+    if platform == "bitbucket":
+        if headers.get("X-Event-Key") not in ("pullrequest:created", "pullrequest:updated"):
+            return None
+        pr = payload["pullrequest"]
+        return {
+            "repo": payload["repository"]["full_name"],
+            "url": pr["links"]["html"]["href"],
+            "head_sha": pr["source"]["commit"]["hash"]
+        }
+
+    if platform == "azdevops":
+        if payload.get("eventType") not in ("git.pullrequest.created", "git.pullrequest.updated"):
+            return None
+        resource = payload["resource"]
+        repository = resource["repository"]
+        organization = urlparse(repository["url"]).path.strip("/").split("/")[0]
+        project = repository["project"]["name"]
+        return {
+            "repo": f"{organization}/{project}/{repository['name']}",
+            "url": f"https://dev.azure.com/{organization}/{project}/_git/{repository['name']}/pullrequest/{resource['pullRequestId']}",
+            "head_sha": resource["lastMergeSourceCommit"]["commitId"]
+        }
+
+    return None
+
+def pr_key(platform, url):
+    """Canonical identifier of a PR/MR/compare range, independent of URL formatting."""
+    parsed = parse_pr_url(platform, url)
+    if platform == "github":
+        ref = f"#{parsed['pr_number']}" if parsed["type"] == "pr" else f"@{parsed['base']}...{parsed['head']}"
+        return f"github:{parsed['repo']}{ref}".lower()
+    if platform == "gitlab":
+        return f"gitlab:{parsed['repo']}!{parsed['mr_id']}".lower()
+    if platform == "bitbucket":
+        return f"bitbucket:{parsed['workspace']}/{parsed['repo']}#{parsed['pr_id']}".lower()
+    return f"azdevops:{parsed['organization']}/{parsed['project']}/{parsed['repo']}#{parsed['pr_id']}".lower()
+
+def prompt_hash(prompt_intro):
+    return hashlib.sha256((prompt_intro or "").strip().encode()).hexdigest()[:16]
+
+def _index_key(platform, url, head_sha, prompt_intro):
+    return f"prewarm:index:{pr_key(platform, url)}:{head_sha}:{prompt_hash(prompt_intro)}"
+
+def lookup_analysis(platform, url, head_sha, prompt_intro):
+    """Task id of a finished analysis of this PR at this head SHA with this prompt, or None."""
+    if not (platform and url and head_sha):
+        return None
+    try:
+        task_id = get_redis().get(_index_key(platform, url, head_sha, prompt_intro))
+        return task_id.decode() if task_id else None
+    except Exception as e:
+        print("[Prewarm Index Error]", e)
+        return None
+
+def record_analysis(platform, url, head_sha, prompt_intro, task_id):
+    if not (platform and url and head_sha):
+        return
+    try:
+        get_redis().set(_index_key(platform, url, head_sha, prompt_intro), task_id, ex=index_ttl)
+    except Exception as e:
+        print("[Prewarm Index Error]", e)
+
+def _debounce_key(platform, url, user_id):
+    return f"prewarm:debounce:{pr_key(platform, url)}:{user_id}"
+
+def debounce(platform, url, user_id, head_sha):
+    """Remember the latest pushed head SHA; the analysis enqueued for it runs after `debounce_seconds`."""
+    get_redis().set(_debounce_key(platform, url, user_id), head_sha, ex=debounce_seconds * 10)
+
+def is_latest_push(platform, url, user_id, head_sha):
+    """False when a newer push arrived while this pre-warm analysis was waiting."""
+    latest = get_redis().get(_debounce_key(platform, url, user_id))
+    return latest is None or latest.decode() == head_sha